@@ -0,0 +1,398 @@
+"""API HTTP/JSON de agendamento, servida junto com a interface Flet.
+
+Permite que integrações e um front-end móvel simples agendem sem abrir uma sessão
+da interface (websocket + BarbeariaApp por cliente). O servidor é assíncrono, feito
+só com asyncio da biblioteca padrão; as chamadas ao banco (bloqueantes) rodam no
+pool de threads do loop e usam o mesmo módulo db da interface.
+
+Rotas:
+    GET  /api/servicos
+    GET  /api/disponibilidade?data=AAAA-MM-DD
+    POST /api/agendamentos                     {"nome", "telefone", "servico_id", "data", "hora"}
+    POST /api/agendamentos/<id>/cancelar       {"telefone"}
+    POST /api/lista-espera                     {"nome", "telefone", "servico_id", "data", "hora_inicio", "hora_fim"}
+    POST /api/series/<id>/horario              {"telefone", "hora", "a_partir_de" (opcional)}
+    GET  /feeds/barbearia.(ics|csv)?token=<token de um barbeiro>
+    GET  /feeds/barbeiro/<id>.(ics|csv)?token=<token do barbeiro>
+
+Os feeds trazem nome e telefone dos clientes, por isso exigem o token secreto do
+barbeiro (auth.token_feed), que vai no link de assinatura da agenda.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import socket
+import threading
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+
+import auth
+import db
+import exportacao
+import horarios
+
+HOST_PADRAO = os.environ.get("BARBEARIA_API_HOST", "0.0.0.0")
+PORTA_PADRAO = int(os.environ.get("BARBEARIA_API_PORTA", "8080"))
+
+# Endereço da API como os clientes a enxergam, usado nos links de assinatura da agenda
+URL_PUBLICA = os.environ.get("BARBEARIA_API_URL", f"http://localhost:{PORTA_PADRAO}")
+
+# Limites de tamanho para não aceitar requisições abusivas
+TAMANHO_MAXIMO_CABECALHO = 16 * 1024
+TAMANHO_MAXIMO_CORPO = 64 * 1024
+
+# Tempo máximo esperando a próxima requisição numa conexão keep-alive
+TEMPO_OCIOSO = 15
+
+logger = logging.getLogger(__name__)
+
+
+class ErroRequisicao(Exception):
+    """Erro que vira uma resposta JSON {"erro": mensagem} com o status dado."""
+
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+        self.mensagem = mensagem
+
+
+class _FeedInterrompido(Exception):
+    """O feed falhou depois dos cabeçalhos enviados: a conexão só pode ser fechada."""
+
+
+class Requisicao:
+    def __init__(self, metodo, caminho, consulta, cabecalhos, corpo):
+        self.metodo = metodo
+        self.caminho = caminho
+        self.consulta = consulta
+        self.cabecalhos = cabecalhos
+        self.corpo = corpo
+
+    def json(self):
+        try:
+            dados = json.loads(self.corpo or b"{}")
+        except ValueError:
+            raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "JSON inválido")
+        if not isinstance(dados, dict):
+            raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "O corpo deve ser um objeto JSON")
+        return dados
+
+
+# ------------------------------------------------------------------ operações
+
+def _validar_data_hora(data, hora):
+    """Mesmas regras da tela de agendamento: data futura, dia de atendimento, horário da grade."""
+    try:
+        dia = datetime.strptime(data or "", "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Data inválida (use AAAA-MM-DD)")
+    if dia < datetime.now().date():
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Selecione uma data futura")
+    if not horarios.dia_aberto(dia):
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "A barbearia não abre nesse dia")
+    if hora is not None:
+        if not horarios.horario_permitido(dia, hora):
+            raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Horário inválido ou fora do horário comercial")
+        if datetime.strptime(f"{data} {hora}", "%Y-%m-%d %H:%M") <= datetime.now():
+            raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Esse horário já passou")
+
+
+def listar_servicos(requisicao):
+    return HTTPStatus.OK, [
+        {
+            'id': servico.id,
+            'nome': servico.nome,
+            'preco': servico.preco,
+            'duracao': servico.duracao,
+            'descricao': servico.descricao,
+        }
+        for servico in db.listar_servicos()
+    ]
+
+
+def disponibilidade(requisicao):
+    data = (requisicao.consulta.get("data") or [None])[0]
+    _validar_data_hora(data, None)
+    ocupados = db.horarios_ocupados(data)
+    agora = datetime.now()
+    resultado = []
+    for hora in horarios.horarios_do_dia(data):
+        passado = datetime.strptime(f"{data} {hora}", "%Y-%m-%d %H:%M") <= agora
+        resultado.append({'hora': hora, 'disponivel': hora not in ocupados and not passado})
+    return HTTPStatus.OK, {'data': data, 'horarios': resultado}
+
+
+def criar_agendamento(requisicao):
+    dados = requisicao.json()
+    if not dados.get("hora"):
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Informe o horário (hora)")
+    _validar_data_hora(dados.get("data"), dados.get("hora"))
+    try:
+        servico_id = int(dados.get("servico_id"))
+    except (TypeError, ValueError):
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "servico_id inválido")
+    agendamento_id = db.adicionar_agendamento(
+        str(dados.get("nome") or ""),
+        str(dados.get("telefone") or ""),
+        servico_id,
+        dados["data"],
+        dados["hora"]
+    )
+    return HTTPStatus.CREATED, {'id': agendamento_id, 'status': "Pendente"}
+
+
+def cancelar_agendamento(requisicao, agendamento_id):
+    dados = requisicao.json()
+    if not dados.get("telefone"):
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Informe o telefone usado no agendamento")
+    db.cancelar_agendamento(int(agendamento_id), str(dados["telefone"]))
+    return HTTPStatus.OK, {'id': int(agendamento_id), 'status': "Cancelado"}
+
+
+def entrar_lista_espera(requisicao):
+    dados = requisicao.json()
+    _validar_data_hora(dados.get("data"), None)
+    for campo in ("hora_inicio", "hora_fim"):
+        if not horarios.horario_permitido(dados["data"], dados.get(campo) or ""):
+            raise ErroRequisicao(HTTPStatus.BAD_REQUEST, f"{campo} inválido ou fora do horário comercial")
+    try:
+        servico_id = int(dados.get("servico_id"))
+    except (TypeError, ValueError):
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "servico_id inválido")
+    espera_id = db.entrar_lista_espera(
+        str(dados.get("nome") or ""),
+        str(dados.get("telefone") or ""),
+        servico_id,
+        dados["data"],
+        dados["hora_inicio"],
+        dados["hora_fim"]
+    )
+    return HTTPStatus.CREATED, {'id': espera_id, 'status': "Aguardando"}
+
+
+def alterar_hora_serie(requisicao, serie_id):
+    dados = requisicao.json()
+    if not dados.get("telefone"):
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Informe o telefone usado no agendamento")
+    if not horarios.horario_valido(dados.get("hora") or ""):
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Horário inválido ou fora do horário comercial")
+    a_partir_de = None
+    if dados.get("a_partir_de"):
+        try:
+            a_partir_de = datetime.strptime(dados["a_partir_de"], "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "a_partir_de inválida (use AAAA-MM-DD)")
+    resultado = db.alterar_hora_serie(int(serie_id), dados["hora"], a_partir_de, telefone=str(dados["telefone"]))
+    return HTTPStatus.OK, {
+        'serie_id': int(serie_id),
+        'hora': dados["hora"],
+        'alterados': resultado['alterados'],
+        'conflitos': [{'data': data, 'motivo': motivo} for data, motivo in resultado['conflitos']],
+    }
+
+
+ROTAS = [
+    ("GET", re.compile(r"/api/servicos"), listar_servicos),
+    ("GET", re.compile(r"/api/disponibilidade"), disponibilidade),
+    ("POST", re.compile(r"/api/agendamentos"), criar_agendamento),
+    ("POST", re.compile(r"/api/agendamentos/(\d+)/cancelar"), cancelar_agendamento),
+    ("POST", re.compile(r"/api/lista-espera"), entrar_lista_espera),
+    ("POST", re.compile(r"/api/series/(\d+)/horario"), alterar_hora_serie),
+]
+
+ROTA_FEED = re.compile(r"/feeds/(?:barbearia|barbeiro/(\d+))\.(ics|csv)")
+
+
+def url_feed(formato, token, barbeiro_id=None):
+    """Link de assinatura da agenda (da barbearia ou de um barbeiro) com o token do barbeiro."""
+    caminho = f"barbeiro/{barbeiro_id}" if barbeiro_id else "barbearia"
+    return f"{URL_PUBLICA}/feeds/{caminho}.{formato}?token={token}"
+
+
+# --------------------------------------------------------------------- HTTP
+
+async def _ler_requisicao(leitor):
+    """Lê uma requisição HTTP/1.1; retorna None se a conexão foi fechada."""
+    try:
+        bruto = await asyncio.wait_for(leitor.readuntil(b"\r\n\r\n"), TEMPO_OCIOSO)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise ErroRequisicao(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Cabeçalho muito grande")
+
+    linhas = bruto.decode("latin-1").split("\r\n")
+    try:
+        metodo, alvo, _ = linhas[0].split(" ", 2)
+    except ValueError:
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Requisição inválida")
+    cabecalhos = {}
+    for linha in linhas[1:]:
+        if ":" in linha:
+            nome, valor = linha.split(":", 1)
+            cabecalhos[nome.strip().lower()] = valor.strip()
+
+    tamanho = int(cabecalhos.get("content-length") or 0)
+    if tamanho > TAMANHO_MAXIMO_CORPO:
+        raise ErroRequisicao(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Corpo muito grande")
+    corpo = await leitor.readexactly(tamanho) if tamanho else b""
+
+    url = urlsplit(alvo)
+    return Requisicao(metodo.upper(), url.path.rstrip("/") or "/", parse_qs(url.query), cabecalhos, corpo)
+
+
+def _cabecalho_resposta(status, cabecalhos):
+    status = HTTPStatus(status)
+    linhas = [f"HTTP/1.1 {status.value} {status.phrase}"]
+    linhas += [f"{nome}: {valor}" for nome, valor in cabecalhos.items()]
+    return ("\r\n".join(linhas) + "\r\n\r\n").encode("latin-1")
+
+
+async def _responder_json(escritor, status, dados, manter_aberta):
+    corpo = json.dumps(dados, ensure_ascii=False, default=str).encode("utf-8")
+    escritor.write(_cabecalho_resposta(status, {
+        'Content-Type': "application/json; charset=utf-8",
+        'Content-Length': len(corpo),
+        'Connection': "keep-alive" if manter_aberta else "close",
+    }) + corpo)
+    await escritor.drain()
+
+
+async def _responder_feed(escritor, loop, requisicao, barbeiro_id, formato, manter_aberta):
+    # Qualquer barbeiro vê a agenda da barbearia; a de um barbeiro, só ele
+    token = (requisicao.consulta.get("token") or [None])[0]
+    dono = await loop.run_in_executor(None, auth.usuario_do_token_feed, token)
+    if dono is None or (barbeiro_id and int(barbeiro_id) != dono):
+        raise ErroRequisicao(HTTPStatus.FORBIDDEN, "Link da agenda inválido")
+
+    status, cabecalhos, corpo = await loop.run_in_executor(
+        None,
+        lambda: exportacao.abrir_feed(
+            formato,
+            int(barbeiro_id) if barbeiro_id else None,
+            requisicao.cabecalhos.get("if-none-match"),
+            requisicao.cabecalhos.get("if-modified-since"),
+        )
+    )
+    cabecalhos['Connection'] = "keep-alive" if manter_aberta else "close"
+    if corpo is None:
+        escritor.write(_cabecalho_resposta(status, cabecalhos))
+        await escritor.drain()
+        return
+
+    # O feed vai sendo enviado em pedaços, sem montar o arquivo inteiro em memória
+    cabecalhos['Transfer-Encoding'] = "chunked"
+    escritor.write(_cabecalho_resposta(status, cabecalhos))
+    try:
+        while True:
+            pedaco = await loop.run_in_executor(None, next, corpo, None)
+            if pedaco is None:
+                break
+            dados = pedaco.encode("utf-8")
+            if dados:
+                escritor.write(f"{len(dados):X}\r\n".encode("ascii") + dados + b"\r\n")
+                await escritor.drain()
+        escritor.write(b"0\r\n\r\n")
+        await escritor.drain()
+    except ConnectionError:
+        raise
+    except Exception:
+        # Sem o pedaço final ("0") o cliente vê a resposta truncada, não um feed incompleto
+        logger.exception("Erro ao gerar o feed %s", requisicao.caminho)
+        raise _FeedInterrompido
+    finally:
+        await loop.run_in_executor(None, corpo.close)
+
+
+async def _atender(requisicao, escritor, loop, manter_aberta):
+    feed = ROTA_FEED.fullmatch(requisicao.caminho)
+    if feed and requisicao.metodo == "GET":
+        await _responder_feed(escritor, loop, requisicao, feed.group(1), feed.group(2), manter_aberta)
+        return
+
+    caminho_existe = False
+    for metodo, padrao, funcao in ROTAS:
+        encontrado = padrao.fullmatch(requisicao.caminho)
+        if not encontrado:
+            continue
+        caminho_existe = True
+        if metodo != requisicao.metodo:
+            continue
+        status, dados = await loop.run_in_executor(None, funcao, requisicao, *encontrado.groups())
+        await _responder_json(escritor, status, dados, manter_aberta)
+        return
+
+    if caminho_existe:
+        raise ErroRequisicao(HTTPStatus.METHOD_NOT_ALLOWED, "Método não permitido")
+    raise ErroRequisicao(HTTPStatus.NOT_FOUND, "Rota não encontrada")
+
+
+async def _tratar_conexao(leitor, escritor):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                requisicao = await _ler_requisicao(leitor)
+                if requisicao is None:
+                    break
+                manter_aberta = requisicao.cabecalhos.get("connection", "").lower() != "close"
+                await _atender(requisicao, escritor, loop, manter_aberta)
+            except _FeedInterrompido:
+                break
+            except ErroRequisicao as erro:
+                manter_aberta = False
+                await _responder_json(escritor, erro.status, {'erro': erro.mensagem}, False)
+            except db.ConflitoHorario as erro:
+                await _responder_json(escritor, HTTPStatus.CONFLICT, {'erro': str(erro)}, manter_aberta)
+            except (db.ConexaoIndisponivel, db.PoolEsgotado) as erro:
+                await _responder_json(escritor, HTTPStatus.SERVICE_UNAVAILABLE, {'erro': str(erro)}, manter_aberta)
+            except db.NaoEncontrado as erro:
+                await _responder_json(escritor, HTTPStatus.NOT_FOUND, {'erro': str(erro)}, manter_aberta)
+            except db.DatabaseError as erro:
+                await _responder_json(escritor, HTTPStatus.BAD_REQUEST, {'erro': str(erro)}, manter_aberta)
+            if not manter_aberta:
+                break
+    except ConnectionError:
+        pass
+    except Exception:
+        logger.exception("Erro ao atender requisição da API")
+        try:
+            await _responder_json(escritor, HTTPStatus.INTERNAL_SERVER_ERROR, {'erro': "Erro interno"}, False)
+        except ConnectionError:
+            pass
+    finally:
+        escritor.close()
+
+
+async def servir(host=HOST_PADRAO, porta=PORTA_PADRAO):
+    """Roda o servidor da API até ser cancelado.
+
+    Com SO_REUSEPORT (Linux, BSD, macOS) todos os workers escutam a mesma porta e o
+    sistema divide as conexões entre eles, em vez de só o primeiro conseguir o bind.
+    """
+    servidor = await asyncio.start_server(
+        _tratar_conexao, host, porta,
+        limit=TAMANHO_MAXIMO_CABECALHO,
+        reuse_port=hasattr(socket, "SO_REUSEPORT")
+    )
+    async with servidor:
+        await servidor.serve_forever()
+
+
+def iniciar_em_segundo_plano(host=HOST_PADRAO, porta=PORTA_PADRAO):
+    """Sobe a API numa thread própria (com seu loop asyncio) dentro do processo do app."""
+    thread = threading.Thread(
+        target=lambda: asyncio.run(servir(host, porta)),
+        name="api",
+        daemon=True
+    )
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    db.criar_tabelas()
+    auth.criar_tabela_usuarios()
+    asyncio.run(servir())
@@ -1,8 +1,33 @@
+import base64
 import hashlib
+import hmac
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 import psycopg2
-from db import conectar
+from db import TRAVA_ESQUEMA, conectar, conexao, criar_tabelas, criar_triggers_coerencia
+import repositorio
 import bcrypt
 
+# Validade de uma sessão de barbeiro
+DURACAO_SESSAO = timedelta(days=7)
+
+# Quantas sessões já validadas ficam em memória (as menos usadas saem primeiro)
+MAXIMO_SESSOES_EM_CACHE = 1024
+
+# Chave dos tokens de sessão; com vários workers, todos precisam da mesma
+ARQUIVO_SEGREDO_SESSAO = "segredo_sessao"
+
+# id da sessão -> (usuário, expira_em), em ordem de uso
+_sessoes_em_cache = OrderedDict()
+_sessoes_lock = threading.Lock()
+_segredo = None
+
+# criar_tabela_usuarios já rodou com sucesso neste processo
+_tabelas_prontas = False
+
 def hash_senha(senha):
     """Cria um hash seguro da senha usando bcrypt"""
     return bcrypt.hashpw(senha.encode(), bcrypt.gensalt()).decode()
@@ -12,9 +37,15 @@ def verificar_senha(senha, hash_armazenado):
     return bcrypt.checkpw(senha.encode(), hash_armazenado.encode())
 
 def criar_tabela_usuarios():
-    """Cria a tabela de usuários se não existir"""
+    """Cria a tabela de usuários se não existir (uma vez por processo)"""
+    global _tabelas_prontas
+    if _tabelas_prontas:
+        return
+    # publicar_coerencia_alteracao, usada pelos triggers abaixo, vem do esquema principal
+    criar_tabelas()
     conn = conectar()
     cursor = conn.cursor()
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (TRAVA_ESQUEMA,))
     
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS usuarios (
@@ -25,43 +56,174 @@ def criar_tabela_usuarios():
     );
     """)
     
+    # Sessões de login (tokens assinados guardados no navegador)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sessoes (
+        id TEXT PRIMARY KEY,
+        usuario_id INTEGER NOT NULL REFERENCES usuarios (id),
+        criada_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+        expira_em TIMESTAMPTZ NOT NULL,
+        revogada_em TIMESTAMPTZ
+    );
+    """)
+    
+    # Token secreto de cada barbeiro nos links da agenda (.ics/.csv) servidos pela API
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS tokens_feed (
+        usuario_id INTEGER PRIMARY KEY REFERENCES usuarios (id),
+        token TEXT UNIQUE NOT NULL,
+        criado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+    
+    # Renomear/remover barbeiros e revogar sessões avisa os demais workers (ver coerencia.py)
+    criar_triggers_coerencia(cursor, 'usuarios', 'usuarios', 'id', eventos=('UPDATE', 'DELETE'))
+    criar_triggers_coerencia(cursor, 'sessoes', 'sessoes', 'id', eventos=('UPDATE', 'DELETE'))
+    
     # Criar usuário admin padrão se não existir
-    cursor.execute("SELECT id FROM usuarios WHERE email = 'admin@barbearia.com'")
-    if not cursor.fetchone():
-        cursor.execute(
-            "INSERT INTO usuarios (email, senha, nome) VALUES (%s, %s, %s)",
-            ('admin@barbearia.com', hash_senha('admin123'), 'Administrador')
-        )
+    if not repositorio.buscar_usuario_por_email(cursor, 'admin@barbearia.com'):
+        repositorio.inserir_usuario(cursor, 'admin@barbearia.com', hash_senha('admin123'), 'Administrador')
     
     conn.commit()
     conn.close()
+    _tabelas_prontas = True
 
 def validar_login(email, senha):
     """Valida as credenciais do barbeiro na tabela usuarios."""
-    conn = conectar()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, nome, senha FROM usuarios WHERE email = %s",
-        (email,)
-    )
-    usuario = cursor.fetchone()
-    conn.close()
+    with conexao() as conn:
+        usuario = repositorio.buscar_usuario_por_email(conn.cursor(), email)
     if usuario and verificar_senha(senha, usuario[2]):
         return {'id': usuario[0], 'nome': usuario[1]}
     return None
 
 def registrar_usuario(email, senha, nome):
     """Registra um novo usuário barbeiro na tabela usuarios."""
-    conn = conectar()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM usuarios WHERE email = %s", (email,))
-    if cursor.fetchone():
-        conn.close()
-        raise Exception("Já existe um usuário com este email.")
-    hash_senha_usuario = hash_senha(senha)
-    cursor.execute(
-        "INSERT INTO usuarios (email, senha, nome) VALUES (%s, %s, %s)",
-        (email, hash_senha_usuario, nome)
-    )
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    with conexao() as conn:
+        cursor = conn.cursor()
+        if repositorio.buscar_usuario_por_email(cursor, email):
+            raise Exception("Já existe um usuário com este email.")
+        hash_senha_usuario = hash_senha(senha)
+        repositorio.inserir_usuario(cursor, email, hash_senha_usuario, nome)
+
+def buscar_usuario(usuario_id):
+    """Retorna {'id', 'nome'} do usuário ou None se ele não existir mais."""
+    with conexao() as conn:
+        usuario = repositorio.buscar_usuario_por_id(conn.cursor(), usuario_id)
+    if usuario:
+        return {'id': usuario[0], 'nome': usuario[1]}
+    return None
+
+def token_feed(usuario_id):
+    """Token dos links da agenda do barbeiro; criado no primeiro uso."""
+    with conexao() as conn:
+        cursor = conn.cursor()
+        return repositorio.buscar_token_feed(cursor, usuario_id) or repositorio.criar_token_feed(
+            cursor, usuario_id, secrets.token_urlsafe(24)
+        )
+
+def renovar_token_feed(usuario_id):
+    """Troca o token dos links da agenda; os links antigos deixam de funcionar."""
+    token = secrets.token_urlsafe(24)
+    with conexao() as conn:
+        repositorio.trocar_token_feed(conn.cursor(), usuario_id, token)
+    return token
+
+def usuario_do_token_feed(token):
+    """id do barbeiro dono do token dos links da agenda, ou None."""
+    if not token:
+        return None
+    with conexao(leitura=True) as conn:
+        return repositorio.usuario_por_token_feed(conn.cursor(), token)
+
+def _obter_segredo():
+    """Chave HMAC dos tokens: BARBEARIA_SEGREDO_SESSAO ou um arquivo gerado na primeira vez."""
+    global _segredo
+    if _segredo is None:
+        segredo = os.environ.get("BARBEARIA_SEGREDO_SESSAO")
+        if segredo:
+            _segredo = segredo.encode()
+        else:
+            try:
+                descritor = os.open(ARQUIVO_SEGREDO_SESSAO, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(descritor, "w") as arquivo:
+                    arquivo.write(secrets.token_hex(32))
+            except FileExistsError:
+                pass
+            with open(ARQUIVO_SEGREDO_SESSAO) as arquivo:
+                _segredo = arquivo.read().strip().encode()
+    return _segredo
+
+def _assinar(sessao_id):
+    assinatura = hmac.new(_obter_segredo(), sessao_id.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(assinatura).decode().rstrip("=")
+
+def id_do_token(token):
+    """id da sessão se a assinatura do token confere; senão None (sem ir ao banco)."""
+    sessao_id, _, assinatura = (token or "").partition(".")
+    if not sessao_id or not hmac.compare_digest(assinatura, _assinar(sessao_id)):
+        return None
+    return sessao_id
+
+def _guardar_em_cache(sessao_id, usuario, expira_em):
+    with _sessoes_lock:
+        _sessoes_em_cache[sessao_id] = (usuario, expira_em)
+        _sessoes_em_cache.move_to_end(sessao_id)
+        while len(_sessoes_em_cache) > MAXIMO_SESSOES_EM_CACHE:
+            _sessoes_em_cache.popitem(last=False)
+
+def criar_sessao(usuario):
+    """Abre uma sessão para o usuário já autenticado e retorna o token assinado."""
+    sessao_id = secrets.token_urlsafe(24)
+    expira_em = datetime.now(timezone.utc) + DURACAO_SESSAO
+    with conexao() as conn:
+        repositorio.inserir_sessao(conn.cursor(), sessao_id, usuario['id'], expira_em)
+    _guardar_em_cache(sessao_id, dict(usuario), expira_em)
+    return f"{sessao_id}.{_assinar(sessao_id)}"
+
+def validar_sessao(token):
+    """Retorna {'id', 'nome'} do dono de uma sessão válida ou None.
+
+    Sessões já validadas neste processo são respondidas pelo cache em memória; só as
+    demais consultam a tabela sessoes. Nenhum caminho passa pelo bcrypt.
+    """
+    sessao_id = id_do_token(token)
+    if sessao_id is None:
+        return None
+    agora = datetime.now(timezone.utc)
+    with _sessoes_lock:
+        em_cache = _sessoes_em_cache.get(sessao_id)
+        if em_cache:
+            _sessoes_em_cache.move_to_end(sessao_id)
+    if em_cache:
+        usuario, expira_em = em_cache
+        if expira_em > agora:
+            return dict(usuario)
+        descartar_sessoes_em_cache([sessao_id])
+        return None
+
+    with conexao() as conn:
+        sessao = repositorio.buscar_sessao_valida(conn.cursor(), sessao_id)
+    if sessao is None:
+        return None
+    usuario_id, nome, expira_em = sessao
+    usuario = {'id': usuario_id, 'nome': nome}
+    _guardar_em_cache(sessao_id, usuario, expira_em)
+    return dict(usuario)
+
+def revogar_sessao(token):
+    """Encerra a sessão no banco; o trigger de coerência avisa os demais workers."""
+    sessao_id = id_do_token(token)
+    if sessao_id is None:
+        return
+    with conexao() as conn:
+        repositorio.revogar_sessao(conn.cursor(), sessao_id)
+    descartar_sessoes_em_cache([sessao_id])
+
+def descartar_sessoes_em_cache(sessao_ids=None):
+    """Tira sessões do cache em memória (None = todas); usado também pelas invalidações."""
+    with _sessoes_lock:
+        if sessao_ids is None:
+            _sessoes_em_cache.clear()
+        else:
+            for sessao_id in sessao_ids:
+                _sessoes_em_cache.pop(sessao_id, None)
@@ -0,0 +1,437 @@
+"""Teste de carga sem interface gráfica para a BarbeariaApp.
+
+Reproduz o movimento de sábado de manhã: vários clientes e barbeiros usando
+instâncias independentes da BarbeariaApp ao mesmo tempo, cada uma ligada a uma
+página falsa no lugar do ft.Page, contra um PostgreSQL local.
+
+Uso:
+    python carga.py --clientes 40 --barbeiros 4 --duracao 60 --dbname agendamentos_carga
+
+Ao final mostra vazão, latências p50/p95/p99 por ação, uso de conexões e
+agendamentos duplicados (dois agendamentos ativos no mesmo dia e horário).
+
+Com --coerencia N, verifica a coerência dos caches entre N processos: cada worker
+aquece seu cache de horários ocupados de um dia, agenda um horário diferente e
+espera ver os agendamentos de todos os outros pelo LISTEN/NOTIFY, sem reconsultar
+o banco a cada leitura.
+
+    python carga.py --coerencia 4 --dbname agendamentos_carga
+"""
+import argparse
+import multiprocessing
+import queue
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import flet as ft
+
+import db
+import auth
+import coerencia
+import horarios
+from main import BarbeariaApp
+
+EMAIL_BARBEIRO_CARGA = "carga@barbearia.com"
+SENHA_BARBEIRO_CARGA = "carga123"
+PREFIXO_CLIENTE = "Carga"
+
+
+class ArmazenamentoFalso(dict):
+    """Substituto do page.client_storage do navegador."""
+
+    def set(self, chave, valor):
+        self[chave] = valor
+
+    def remove(self, chave):
+        self.pop(chave, None)
+
+
+class PaginaFalsa:
+    """Substituto mínimo do ft.Page: guarda os controles adicionados e não renderiza nada."""
+
+    def __init__(self):
+        self.controls = []
+        self.snack_bar = None
+        self.client_storage = ArmazenamentoFalso()
+
+    def clean(self):
+        self.controls.clear()
+
+    def add(self, *controles):
+        self.controls.extend(controles)
+
+    def update(self, *controles):
+        pass
+
+
+class Metricas:
+    """Coleta latências, resultados e uso de conexões de todas as sessões simuladas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencias = defaultdict(list)
+        self.resultados = defaultdict(lambda: defaultdict(int))
+        self.conexoes_abertas = 0
+        self.amostras_sessoes = []
+
+    def medir(self, acao, funcao, *args):
+        """Executa a ação, registra a duração e devolve o resultado (ou None se falhar)."""
+        inicio = time.perf_counter()
+        resultado = None
+        try:
+            resultado = funcao(*args)
+            desfecho = "ok"
+        except Exception as erro:
+            desfecho = f"erro: {type(erro).__name__}"
+        duracao = time.perf_counter() - inicio
+        with self._lock:
+            self.latencias[acao].append(duracao)
+            self.resultados[acao][desfecho] += 1
+        return resultado
+
+    def registrar(self, acao, desfecho):
+        with self._lock:
+            self.resultados[acao][desfecho] += 1
+
+    def contar_conexao(self):
+        with self._lock:
+            self.conexoes_abertas += 1
+
+
+def percentil(valores, p):
+    """Percentil pelo método do posto mais próximo."""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[indice]
+
+
+def procurar_controles(raiz, condicao):
+    """Percorre a árvore de controles (controls/content) e devolve os que satisfazem a condição."""
+    encontrados = []
+    pilha = list(raiz) if isinstance(raiz, list) else [raiz]
+    while pilha:
+        controle = pilha.pop()
+        if controle is None:
+            continue
+        if condicao(controle):
+            encontrados.append(controle)
+        pilha.extend(getattr(controle, "controls", None) or [])
+        pilha.append(getattr(controle, "content", None))
+    return encontrados
+
+
+def instrumentar_conexoes(metricas):
+    """Conta cada conexão aberta ou emprestada do pool, envolvendo db.conectar e db.conexao onde são usados."""
+    conectar_original = db.conectar
+    conexao_original = db.conexao
+
+    def conectar_contando(*args, **kwargs):
+        metricas.contar_conexao()
+        return conectar_original(*args, **kwargs)
+
+    def conexao_contando(*args, **kwargs):
+        metricas.contar_conexao()
+        return conexao_original(*args, **kwargs)
+
+    for modulo in (db, auth):
+        modulo.conectar = conectar_contando
+        modulo.conexao = conexao_contando
+    return conectar_original
+
+
+def monitorar_sessoes(metricas, conectar_original, parar, intervalo=0.2):
+    """Amostra periodicamente quantas sessões o banco tem abertas."""
+    conn = conectar_original()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        while not parar.is_set():
+            cursor.execute(
+                "SELECT COUNT(*) FROM pg_stat_activity WHERE datname = %s",
+                (db.DB_CONFIG["dbname"],)
+            )
+            metricas.amostras_sessoes.append(cursor.fetchone()[0])
+            parar.wait(intervalo)
+    finally:
+        conn.close()
+
+
+def sessao_cliente(indice, metricas, fim, dias_quentes):
+    """Cliente: abre o app, escolhe um dia, vê os horários livres e tenta agendar."""
+    rng = random.Random(indice)
+    while time.monotonic() < fim:
+        app = metricas.medir("abrir_app", BarbeariaApp, PaginaFalsa())
+        if app is None:
+            continue
+
+        # A maioria disputa os primeiros dias, como acontece na correria de sábado
+        dias = [opcao.key for opcao in app.dias_disponiveis.options]
+        app.dias_disponiveis.value = rng.choice(dias[:dias_quentes] if rng.random() < 0.8 else dias)
+        metricas.medir("escolher_dia", app.atualizar_horarios_disponiveis, SimpleNamespace(control=app.dias_disponiveis))
+
+        livres = [opcao.key for opcao in app.horarios_disponiveis.options if not opcao.disabled]
+        if not livres:
+            metricas.registrar("fazer_agendamento", "sem horário livre")
+            continue
+
+        app.nome_cliente.value = f"{PREFIXO_CLIENTE} {indice}-{rng.randrange(10**6)}"
+        app.telefone_cliente.value = f"(11) 9{rng.randrange(10**4):04d}-{rng.randrange(10**4):04d}"
+        app.servicos_dropdown.value = rng.choice(app.servicos_dropdown.options).key
+        app.horarios_disponiveis.value = rng.choice(livres)
+        metricas.medir("fazer_agendamento", app.fazer_agendamento, None)
+
+        mensagem = app.mensagem_container.content
+        sucesso = mensagem is not None and mensagem.bgcolor == ft.colors.GREEN_50
+        metricas.registrar("agendamento_confirmado_na_tela", "sim" if sucesso else "não")
+
+
+def sessao_barbeiro(indice, metricas, fim):
+    """Barbeiro: faz login, filtra a agenda e confirma agendamentos pendentes."""
+    rng = random.Random(10**6 + indice)
+    app = metricas.medir("abrir_app", BarbeariaApp, PaginaFalsa())
+    if app is None:
+        return
+    app.email_login.value = EMAIL_BARBEIRO_CARGA
+    app.senha_login.value = SENHA_BARBEIRO_CARGA
+    metricas.medir("login", app.fazer_login, None)
+    if not app.barbeiro_atual:
+        metricas.registrar("login", "recusado")
+        return
+
+    filtro_data, filtro_status = None, None
+    for controle in procurar_controles(app.page.controls, lambda c: isinstance(c, ft.Dropdown)):
+        if controle.label == "Filtrar por data":
+            filtro_data = controle
+        elif controle.label == "Status":
+            filtro_status = controle
+    evento_filtro = SimpleNamespace(control=SimpleNamespace(parent=SimpleNamespace(controls=[filtro_data, filtro_status])))
+
+    while time.monotonic() < fim:
+        filtro_data.value = rng.choice(["hoje", "semana", "todos"])
+        filtro_status.value = rng.choice(["todos", "Pendente"])
+        metricas.medir("filtrar_agendamentos", app.filtrar_agendamentos, evento_filtro)
+
+        pendentes = procurar_controles(
+            app.lista_agendamentos,
+            lambda c: isinstance(c, ft.Dropdown) and c.label is None and c.value == "Pendente"
+        )
+        if pendentes:
+            seletor = rng.choice(pendentes)
+            seletor.value = "Confirmado"
+            metricas.medir("confirmar_agendamento", seletor.on_change, SimpleNamespace(control=seletor))
+        time.sleep(rng.uniform(0.1, 0.5))
+
+
+def preparar_banco():
+    """Cria as tabelas e o barbeiro usado no teste de carga."""
+    db.criar_tabelas()
+    auth.criar_tabela_usuarios()
+    if not auth.validar_login(EMAIL_BARBEIRO_CARGA, SENHA_BARBEIRO_CARGA):
+        auth.registrar_usuario(EMAIL_BARBEIRO_CARGA, SENHA_BARBEIRO_CARGA, "Barbeiro Carga")
+
+
+def buscar_duplicados(conectar_original):
+    """Dias e horários com mais de um agendamento ativo."""
+    conn = conectar_original()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT data, hora, COUNT(*)
+        FROM agendamentos
+        WHERE status != 'Cancelado'
+        GROUP BY data, hora
+        HAVING COUNT(*) > 1
+        ORDER BY data, hora
+        """)
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def limpar_agendamentos_carga(conectar_original):
+    """Remove os agendamentos criados por execuções anteriores do teste de carga."""
+    conn = conectar_original()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM agendamentos WHERE cliente_nome LIKE %s", (f"{PREFIXO_CLIENTE} %",))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+
+class OrigemContada:
+    """Repassa ao db contando as consultas de horários ocupados que chegam ao banco."""
+
+    def __init__(self):
+        self.consultas = 0
+
+    def horarios_ocupados(self, data, sessao=None, primario=False):
+        self.consultas += 1
+        return db.horarios_ocupados(data, sessao=sessao, primario=primario)
+
+    def adicionar_agendamento(self, *args, **kwargs):
+        return db.adicionar_agendamento(*args, **kwargs)
+
+    def listar_servicos(self, sessao=None, primario=False):
+        return db.listar_servicos(sessao=sessao, primario=primario)
+
+
+def worker_coerencia(indice, config, dia, horarios_teste, servico_id, barreira, resultados, tempo_limite):
+    """Um worker: cache quente, um agendamento próprio e espera pelos agendamentos dos outros."""
+    db.DB_CONFIG.update(config)
+    instancia = coerencia.Coerencia(coerencia.BarramentoPostgres())
+    instancia.iniciar()
+    origem = OrigemContada()
+    agenda = coerencia.AgendaEmCache(origem, instancia)
+    if not instancia.barramento.conectado.wait(10):
+        resultados.put((indice, "sem LISTEN", 0.0, 0, 0))
+        barreira.abort()
+        return
+    agenda.horarios_ocupados(dia)
+    barreira.wait()
+
+    inicio = time.monotonic()
+    agenda.adicionar_agendamento(
+        f"{PREFIXO_CLIENTE} Coerencia {indice}", f"1190000{indice:04d}", servico_id, dia, horarios_teste[indice]
+    )
+    esperados = set(horarios_teste)
+    while not esperados <= agenda.horarios_ocupados(dia):
+        if time.monotonic() - inicio > tempo_limite:
+            resultados.put((indice, "desatualizado", time.monotonic() - inicio, origem.consultas, origem.consultas))
+            return
+        time.sleep(0.005)
+    decorrido = time.monotonic() - inicio
+
+    # Sem novas alterações, as leituras seguintes têm de vir do cache
+    consultas = origem.consultas
+    time.sleep(0.5)
+    for _ in range(100):
+        agenda.horarios_ocupados(dia)
+    resultados.put((indice, "ok", decorrido, consultas, origem.consultas))
+    instancia.parar()
+
+
+def verificar_coerencia(workers, tempo_limite=5.0):
+    """Roda `workers` processos contra o mesmo banco; retorna True se todos ficaram coerentes."""
+    dia = date.today() + timedelta(days=30)
+    while len(horarios.horarios_do_dia(dia)) < workers:
+        dia += timedelta(days=1)
+    horarios_teste = list(horarios.horarios_do_dia(dia)[:workers])
+    servico_id = db.listar_servicos()[0].id
+
+    contexto = multiprocessing.get_context("spawn")
+    barreira = contexto.Barrier(workers)
+    resultados = contexto.Queue()
+    processos = [
+        contexto.Process(
+            target=worker_coerencia,
+            args=(i, dict(db.DB_CONFIG), dia, horarios_teste, servico_id, barreira, resultados, tempo_limite)
+        )
+        for i in range(workers)
+    ]
+    for processo in processos:
+        processo.start()
+    for processo in processos:
+        processo.join()
+
+    coletados = []
+    for _ in range(workers):
+        try:
+            coletados.append(resultados.get(timeout=1))
+        except queue.Empty:
+            break
+    coletados.sort()
+    print(f"\n=== Coerência entre {workers} workers ({dia}) ===")
+    print(f"{'worker':<8}{'resultado':<16}{'tempo ms':>10}{'consultas':>11}{'após 100 leituras':>19}")
+    for indice, resultado, decorrido, consultas, consultas_depois in coletados:
+        print(f"{indice:<8}{resultado:<16}{decorrido * 1000:>10.1f}{consultas:>11}{consultas_depois:>19}")
+    return len(coletados) == workers and all(
+        resultado == "ok" and consultas_depois == consultas
+        for _, resultado, _, consultas, consultas_depois in coletados
+    )
+
+
+def imprimir_relatorio(metricas, duracao, duplicados):
+    print(f"\n=== Resultado ({duracao:.1f}s) ===")
+    print(f"{'ação':<26}{'qtd':>7}{'ops/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for acao, valores in sorted(metricas.latencias.items()):
+        print(
+            f"{acao:<26}{len(valores):>7}{len(valores) / duracao:>9.1f}"
+            f"{percentil(valores, 50) * 1000:>10.1f}"
+            f"{percentil(valores, 95) * 1000:>10.1f}"
+            f"{percentil(valores, 99) * 1000:>10.1f}"
+        )
+
+    print("\nResultados:")
+    for acao, desfechos in sorted(metricas.resultados.items()):
+        resumo = ", ".join(f"{desfecho}={qtd}" for desfecho, qtd in sorted(desfechos.items()))
+        print(f"  {acao}: {resumo}")
+
+    amostras = metricas.amostras_sessoes or [0]
+    print("\nConexões:")
+    print(f"  abertas/emprestadas pelo app: {metricas.conexoes_abertas} ({metricas.conexoes_abertas / duracao:.1f}/s)")
+    print(f"  sessões no banco: pico={max(amostras)} média={sum(amostras) / len(amostras):.1f}")
+
+    print(f"\nAgendamentos duplicados: {len(duplicados)}")
+    for data, hora, quantidade in duplicados:
+        print(f"  {data} {hora}: {quantidade} agendamentos ativos")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga da BarbeariaApp sem interface")
+    parser.add_argument("--clientes", type=int, default=40, help="sessões de clientes simultâneas")
+    parser.add_argument("--barbeiros", type=int, default=4, help="sessões de barbeiros simultâneas")
+    parser.add_argument("--duracao", type=float, default=30, help="duração do teste em segundos")
+    parser.add_argument("--dias-quentes", type=int, default=2, help="dias mais disputados pelos clientes")
+    parser.add_argument("--limpar", action="store_true", help="apaga agendamentos de execuções anteriores")
+    parser.add_argument("--coerencia", type=int, metavar="N", help="verifica a coerência de cache entre N processos")
+    for chave in ("dbname", "user", "password", "host", "port"):
+        parser.add_argument(f"--{chave}", default=db.DB_CONFIG[chave])
+    args = parser.parse_args()
+
+    db.DB_CONFIG.update({chave: getattr(args, chave) for chave in ("dbname", "user", "password", "host", "port")})
+
+    preparar_banco()
+    if args.coerencia:
+        limpar_agendamentos_carga(db.conectar)
+        sys.exit(0 if verificar_coerencia(args.coerencia) else 1)
+
+    metricas = Metricas()
+    conectar_original = instrumentar_conexoes(metricas)
+    if args.limpar:
+        print(f"Agendamentos de carga removidos: {limpar_agendamentos_carga(conectar_original)}")
+
+    parar = threading.Event()
+    monitor = threading.Thread(target=monitorar_sessoes, args=(metricas, conectar_original, parar), daemon=True)
+    monitor.start()
+
+    inicio = time.monotonic()
+    fim = inicio + args.duracao
+    sessoes = [
+        threading.Thread(target=sessao_cliente, args=(i, metricas, fim, args.dias_quentes))
+        for i in range(args.clientes)
+    ] + [
+        threading.Thread(target=sessao_barbeiro, args=(i, metricas, fim))
+        for i in range(args.barbeiros)
+    ]
+    for sessao in sessoes:
+        sessao.start()
+    for sessao in sessoes:
+        sessao.join()
+    duracao = time.monotonic() - inicio
+    parar.set()
+    monitor.join()
+
+    imprimir_relatorio(metricas, duracao, buscar_duplicados(conectar_original))
+
+
+if __name__ == "__main__":
+    main()
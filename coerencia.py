@@ -0,0 +1,285 @@
+"""Coerência dos caches locais entre vários processos (workers) do servidor.
+
+Cada worker guarda em memória o que consulta muito (horários ocupados por dia,
+catálogo de serviços, grade semanal, barbeiro logado). Quando algo muda, sai uma
+mensagem de invalidação com o tópico ('agendamentos', 'servicos', 'usuarios',
+'sessoes') e as chaves afetadas (ex.: datas). Os workers descartam só as entradas
+afetadas e continuam servindo o resto do cache sem consultar o banco.
+
+O transporte padrão é LISTEN/NOTIFY do PostgreSQL. Quem publica são triggers nas
+tabelas (ver db.criar_triggers_coerencia): o NOTIFY faz parte da transação que
+alterou os dados, então sai se e somente se ela confirmar, inclusive para alterações
+feitas fora da aplicação. Enquanto o LISTEN está ativo nenhuma mensagem se perde; um
+worker que reconecta ao banco descarta os tópicos inteiros. Logo depois de uma
+invalidação, a releitura vai ao primário, já que a réplica pode ainda não ter a
+alteração. BarramentoMemoria faz o mesmo papel dentro de um único processo, para testes.
+
+Uso:
+    coerencia = Coerencia(BarramentoPostgres())
+    coerencia.iniciar()
+    agenda = coerencia.agenda(db)             # horarios_ocupados/listar_servicos em cache
+    coerencia.registrar('agendamentos', funcao_que_recebe_as_chaves)
+"""
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+
+import db
+import repositorio
+
+TOPICOS = ('agendamentos', 'servicos', 'usuarios', 'sessoes')
+
+CANAL = db.CANAL_COERENCIA
+
+MAXIMO_CHAVES = db.MAXIMO_CHAVES_COERENCIA
+
+# Por quanto tempo (segundos) depois de invalidada uma chave é relida do primário:
+# a réplica pode estar esse tanto atrasada sem que db deixe de usá-la
+JANELA_PRIMARIO = db.ATRASO_MAXIMO_REPLICA + db.INTERVALO_VERIFICACAO_REPLICA
+
+# Espera (segundos) antes de reconectar o LISTEN depois de uma queda
+ESPERA_RECONEXAO = 5
+
+logger = logging.getLogger(__name__)
+
+
+class BarramentoMemoria:
+    """Barramento dentro do processo: várias Coerencia ligadas a ele simulam vários workers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assinantes = []
+
+    def publicar(self, topico, chaves):
+        with self._lock:
+            # Entrega sob o lock para todos verem as mensagens na mesma ordem
+            for ao_receber in list(self._assinantes):
+                ao_receber({'topico': topico, 'chaves': chaves})
+
+    def assinar(self, ao_receber, ao_conectar):
+        with self._lock:
+            self._assinantes.append(ao_receber)
+        ao_conectar()
+
+    def cancelar(self, ao_receber):
+        with self._lock:
+            if ao_receber in self._assinantes:
+                self._assinantes.remove(ao_receber)
+
+
+class BarramentoPostgres:
+    """LISTEN/NOTIFY numa conexão dedicada, com reconexão automática."""
+
+    def __init__(self, canal=CANAL):
+        self.canal = canal
+        # Ligado enquanto o LISTEN está ativo
+        self.conectado = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def publicar(self, topico, chaves):
+        # As tabelas com triggers de coerência já publicam sozinhas; isto é para o resto
+        with db.conexao() as conn:
+            repositorio.publicar_invalidacao(conn.cursor(), topico, chaves)
+
+    def assinar(self, ao_receber, ao_conectar):
+        self._thread = threading.Thread(
+            target=self._escutar, args=(ao_receber, ao_conectar), name="coerencia", daemon=True
+        )
+        self._thread.start()
+
+    def cancelar(self, ao_receber):
+        self._parar.set()
+        if self._thread:
+            self._thread.join()
+
+    def _escutar(self, ao_receber, ao_conectar):
+        while not self._parar.is_set():
+            conn = None
+            try:
+                conn = db.conectar()
+                db.criar_tabelas()
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {self.canal}")
+                # O que mudou enquanto não estávamos ouvindo se perdeu: ao_conectar descarta tudo
+                ao_conectar()
+                self.conectado.set()
+                while not self._parar.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        ao_receber(json.loads(conn.notifies.pop(0).payload))
+            except (psycopg2.Error, db.DatabaseError):
+                logger.exception("Conexão de coerência perdida; reconectando")
+                self._parar.wait(ESPERA_RECONEXAO)
+            finally:
+                self.conectado.clear()
+                if conn is not None:
+                    conn.close()
+
+
+class CacheInvalidavel:
+    """Valores carregados sob demanda, por chave, e descartados pelas invalidações.
+
+    `carregar(chave, primario=..., **kwargs)` recebe primario=True quando a chave foi
+    invalidada há menos de JANELA_PRIMARIO segundos.
+    """
+
+    def __init__(self, carregar):
+        self.carregar = carregar
+        self._valores = {}
+        self._lock = threading.Lock()
+        # Muda a cada invalidação: um valor carregado antes dela não é guardado
+        self._geracao = 0
+        # Momento (time.monotonic) da última invalidação de cada chave e de tudo
+        self._invalidadas_em = {}
+        self._tudo_invalidado_em = float('-inf')
+
+    def obter(self, chave, **kwargs):
+        with self._lock:
+            if chave in self._valores:
+                return self._valores[chave]
+            geracao = self._geracao
+            invalidada_em = max(self._invalidadas_em.get(chave, float('-inf')), self._tudo_invalidado_em)
+        primario = time.monotonic() - invalidada_em < JANELA_PRIMARIO
+        valor = self.carregar(chave, primario=primario, **kwargs)
+        with self._lock:
+            if self._geracao == geracao:
+                self._valores[chave] = valor
+        return valor
+
+    def invalidar(self, chaves=None):
+        """Descarta as chaves informadas ou, com None, tudo."""
+        agora = time.monotonic()
+        with self._lock:
+            self._geracao += 1
+            if chaves is None:
+                self._valores.clear()
+                self._invalidadas_em.clear()
+                self._tudo_invalidado_em = agora
+                return
+            # Só as invalidações ainda dentro da janela interessam
+            for chave, momento in list(self._invalidadas_em.items()):
+                if agora - momento >= JANELA_PRIMARIO:
+                    del self._invalidadas_em[chave]
+            for chave in chaves:
+                self._valores.pop(chave, None)
+                self._invalidadas_em[chave] = agora
+
+
+class AgendaEmCache:
+    """Mesmas operações de db (ou de fila_local.FilaLocal), com leituras em cache coerente."""
+
+    def __init__(self, origem, coerencia):
+        self.origem = origem
+        self.coerencia = coerencia
+        self._ocupados = CacheInvalidavel(
+            lambda data, primario, sessao=None: frozenset(
+                origem.horarios_ocupados(data, sessao=sessao, primario=primario)
+            )
+        )
+        self._servicos = CacheInvalidavel(
+            lambda _, primario, sessao=None: origem.listar_servicos(sessao=sessao, primario=primario)
+        )
+        coerencia.registrar('agendamentos', self._ocupados.invalidar)
+        coerencia.registrar('servicos', lambda chaves: self._servicos.invalidar())
+
+    def adicionar_agendamento(self, nome, telefone, servico_id, data, hora, sessao=None):
+        try:
+            return self.origem.adicionar_agendamento(nome, telefone, servico_id, data, hora, sessao=sessao)
+        finally:
+            # Agendamentos guardados só na fila local não passam pelos eventos do db
+            self._ocupados.invalidar([str(data)])
+
+    def horarios_ocupados(self, data, sessao=None):
+        return set(self._ocupados.obter(str(data), sessao=sessao))
+
+    def listar_servicos(self, sessao=None):
+        return self._servicos.obter(None, sessao=sessao)
+
+
+class Coerencia:
+    """Recebe as invalidações do barramento e repassa aos caches registrados por tópico."""
+
+    def __init__(self, barramento):
+        self.barramento = barramento
+        self._lock = threading.Lock()
+        self._invalidadores = defaultdict(list)
+        self._agendas = {}
+        self._agendas_lock = threading.Lock()
+
+    def iniciar(self):
+        db.registrar_ouvinte(self._ouvinte_db)
+        self.barramento.assinar(self._receber, self._sincronizar)
+
+    def parar(self):
+        db.remover_ouvinte(self._ouvinte_db)
+        self.barramento.cancelar(self._receber)
+
+    def registrar(self, topico, invalidar):
+        """`invalidar(chaves)` é chamada com a lista de chaves afetadas ou None (tudo)."""
+        with self._lock:
+            self._invalidadores[topico].append(invalidar)
+
+    def remover(self, topico, invalidar):
+        with self._lock:
+            if invalidar in self._invalidadores[topico]:
+                self._invalidadores[topico].remove(invalidar)
+
+    def agenda(self, origem):
+        """AgendaEmCache sobre `origem`, compartilhada por todas as sessões do worker."""
+        with self._agendas_lock:
+            if id(origem) not in self._agendas:
+                self._agendas[id(origem)] = AgendaEmCache(origem, self)
+            return self._agendas[id(origem)]
+
+    def publicar(self, topico, chaves=None):
+        """Invalida localmente na hora e avisa os demais workers.
+
+        Para dados sem triggers de coerência; as tabelas com triggers já publicam sozinhas.
+        """
+        if chaves is not None:
+            chaves = sorted({str(chave) for chave in chaves})
+            if len(chaves) > MAXIMO_CHAVES:
+                chaves = None
+        self._invalidar(topico, chaves)
+        self.barramento.publicar(topico, chaves)
+
+    def _ouvinte_db(self, evento):
+        # Só o cache deste worker, sem esperar o NOTIFY: o dos outros vem dos triggers
+        self._invalidar('agendamentos', sorted({str(data) for _, data in evento['agendamentos']}))
+
+    def _receber(self, mensagem):
+        self._invalidar(mensagem['topico'], mensagem.get('chaves'))
+
+    def _sincronizar(self):
+        """Na (re)conexão: o que mudou enquanto não ouvíamos é desconhecido, então descarta tudo."""
+        with self._lock:
+            topicos = set(TOPICOS) | set(self._invalidadores)
+        for topico in topicos:
+            self._invalidar(topico, None)
+
+    def _invalidar(self, topico, chaves):
+        with self._lock:
+            invalidadores = list(self._invalidadores[topico])
+        for invalidar in invalidadores:
+            try:
+                invalidar(chaves)
+            except Exception:
+                logger.exception("Erro ao invalidar cache de %s", topico)
+
+
+def iniciar_padrao():
+    """Inicia a coerência do processo sobre LISTEN/NOTIFY.
+
+    Não exige o banco no ar: o LISTEN (e a criação das tabelas) é refeito até conseguir.
+    """
+    instancia = Coerencia(BarramentoPostgres())
+    instancia.iniciar()
+    return instancia
@@ -1,7 +1,15 @@
+import calendar
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
-from psycopg2 import sql
-from models import Cliente, Agendamento, Servico
-from datetime import datetime
+from psycopg2 import sql, errors, pool
+import repositorio
+import horarios
+from datetime import datetime, date, timedelta
 
 DB_CONFIG = {
     'dbname': 'agendamentos',
@@ -9,27 +17,275 @@ DB_CONFIG = {
     'password': '1234',
     'host': 'localhost',
     'port': 5432,
-    'client_encoding': 'utf8'  # Força a codificação UTF-8
+    'client_encoding': 'utf8',  # Força a codificação UTF-8
+    'connect_timeout': 5  # Segundos até desistir de um servidor que não responde
 }
 
+# Quantos meses de partições de agendamentos são mantidos criados à frente do mês atual
+HORIZONTE_PARTICOES_MESES = 3
+
+# Partições mais antigas que isso (em meses) são desanexadas e movidas para o arquivo
+RETENCAO_PARTICOES_MESES = 24
+
+# Agendamentos cancelados mais antigos que isso (em meses) são removidos na compactação
+COMPACTACAO_CANCELADOS_MESES = 6
+
+ESQUEMA_ARQUIVO = 'arquivo'
+
+# Alterações em agendamentos_alteracoes acima das quais a leitura da versão as compacta
+MAXIMO_ALTERACOES_PENDENTES = 10_000
+
+# Frequências aceitas para séries recorrentes -> intervalo em dias (None = mesmo dia a cada mês)
+FREQUENCIAS_SERIE = {
+    'semanal': 7,
+    'quinzenal': 14,
+    'mensal': None,
+}
+
+# Duração máxima de uma série recorrente
+LIMITE_SERIE_DIAS = 366
+
+# Tamanho de cada pool de conexões (primário e réplica)
+POOL_MIN_CONEXOES = 1
+POOL_MAX_CONEXOES = 10
+
+# Quanto tempo (segundos) esperar por uma conexão livre no pool antes de desistir
+ESPERA_MAXIMA_CONEXAO = 10
+
+# Réplica de leitura opcional (ex.: "host=localhost port=5433 dbname=agendamentos user=postgres").
+# Sem ela, todas as operações vão para o primário.
+REPLICA_DSN = os.environ.get('BARBEARIA_REPLICA_DSN')
+
+# Atraso máximo aceito na réplica antes de mandar as leituras de volta ao primário
+ATRASO_MAXIMO_REPLICA = 5.0
+
+# De quanto em quanto tempo (segundos) o atraso/disponibilidade da réplica é reavaliado
+INTERVALO_VERIFICACAO_REPLICA = 2.0
+
+# Canal do NOTIFY que invalida os caches dos workers (ver coerencia.py)
+CANAL_COERENCIA = "barbearia_coerencia"
+
+# Acima disso a mensagem vai sem chaves (invalida o tópico inteiro); o NOTIFY tem limite de tamanho
+MAXIMO_CHAVES_COERENCIA = 200
+
+_pools = {}
+_pools_lock = threading.Lock()
+_estado_replica = {'ok': True, 'verificado_em': 0.0}
+
+# Funções chamadas depois que agendamentos são criados ou alterados (ver registrar_ouvinte)
+_ouvintes = []
+
+# Partições que este processo já sabe que existem (evita DDL repetido a cada agendamento)
+_particoes_conhecidas = set()
+
+# criar_tabelas já rodou com sucesso neste processo
+_esquema_pronto = False
+
+# Chave do advisory lock que serializa a criação do esquema entre processos
+TRAVA_ESQUEMA = 4_201_733
+
 class DatabaseError(Exception):
     """Exceção personalizada para erros do banco de dados"""
     pass
 
+class ConflitoHorario(DatabaseError):
+    """O horário pedido já está ocupado por outro agendamento."""
+    pass
+
+class NaoEncontrado(DatabaseError):
+    """O serviço, agendamento ou série informado não existe."""
+    pass
+
+class ConexaoIndisponivel(DatabaseError):
+    """O servidor não pôde ser alcançado ou a conexão caiu no meio da operação."""
+    pass
+
+class PoolEsgotado(DatabaseError):
+    """Todas as conexões do pool seguiram ocupadas: o banco está no ar, só sobrecarregado."""
+    pass
+
+# SQLSTATE de servidor derrubando ou recusando conexões (além da classe 08, "connection exception")
+CODIGOS_QUEDA_CONEXAO = {'57P01', '57P02', '57P03'}
+
+def conexao_perdida(erro):
+    """Diz se o erro do psycopg2 é queda ou falta de conexão, e não falha de uma consulta.
+
+    OperationalError também cobre deadlock, serialização (TransactionRollbackError),
+    statement_timeout (QueryCanceledError) e lock_timeout, que não são banco fora do ar.
+    Falhas do lado do cliente (servidor sumiu no meio da conversa) não trazem SQLSTATE.
+    """
+    if isinstance(erro, psycopg2.InterfaceError):
+        return True
+    if not isinstance(erro, psycopg2.OperationalError):
+        return False
+    codigo = erro.pgcode
+    return codigo is None or codigo.startswith('08') or codigo in CODIGOS_QUEDA_CONEXAO
+
 def conectar():
     """Estabelece conexão com o banco de dados PostgreSQL."""
     try:
-        print("DB_CONFIG:", DB_CONFIG)  # Adicionado para depuração
-        return psycopg2.connect(**DB_CONFIG)
+        return psycopg2.connect(connection_factory=repositorio.ConexaoPreparada, **DB_CONFIG)
+    except psycopg2.OperationalError as e:
+        raise ConexaoIndisponivel(f"Erro ao conectar ao banco de dados: {str(e)}")
     except psycopg2.Error as e:
         raise DatabaseError(f"Erro ao conectar ao banco de dados: {str(e)}")
 
+class SessaoDados:
+    """Estado de consistência de uma sessão de usuário com o banco.
+
+    Guarda a posição do WAL da última escrita feita pela sessão, para que as leituras
+    seguintes só usem a réplica depois que ela já tiver aplicado essa escrita.
+    """
+
+    def __init__(self):
+        self.lsn_escrita = None
+
+class _PoolLimitado:
+    """ThreadedConnectionPool que espera por uma vaga em vez de falhar quando esgota.
+
+    A espera é limitada a ESPERA_MAXIMA_CONEXAO: conexões presas por muito tempo
+    viram PoolEsgotado em vez de travar todo o app.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._pool = pool.ThreadedConnectionPool(
+            POOL_MIN_CONEXOES,
+            POOL_MAX_CONEXOES,
+            *args,
+            connection_factory=repositorio.ConexaoPreparada,
+            **kwargs
+        )
+        self._vagas = threading.BoundedSemaphore(POOL_MAX_CONEXOES)
+
+    def emprestar(self):
+        if not self._vagas.acquire(timeout=ESPERA_MAXIMA_CONEXAO):
+            raise PoolEsgotado("Nenhuma conexão livre com o banco de dados no momento")
+        try:
+            return self._pool.getconn()
+        except psycopg2.Error as e:
+            self._vagas.release()
+            if conexao_perdida(e):
+                raise ConexaoIndisponivel(f"Erro ao conectar ao banco de dados: {str(e)}")
+            raise DatabaseError(f"Erro ao conectar ao banco de dados: {str(e)}")
+        except BaseException:
+            self._vagas.release()
+            raise
+
+    def devolver(self, conn):
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._vagas.release()
+
+def _obter_pool(destino='primario'):
+    """Cria o pool de conexões do destino ('primario' ou 'replica') na primeira utilização."""
+    if destino not in _pools:
+        with _pools_lock:
+            if destino not in _pools:
+                try:
+                    if destino == 'replica':
+                        _pools[destino] = _PoolLimitado(REPLICA_DSN)
+                    else:
+                        _pools[destino] = _PoolLimitado(**DB_CONFIG)
+                except psycopg2.OperationalError as e:
+                    raise ConexaoIndisponivel(f"Erro ao conectar ao banco de dados: {str(e)}")
+                except psycopg2.Error as e:
+                    raise DatabaseError(f"Erro ao conectar ao banco de dados: {str(e)}")
+    return _pools[destino]
+
+def _replica_em_dia(conn, sessao):
+    """Diz se a réplica pode atender a leitura: atraso aceitável e escritas da sessão aplicadas."""
+    agora = time.monotonic()
+    cursor = conn.cursor()
+    if agora - _estado_replica['verificado_em'] >= INTERVALO_VERIFICACAO_REPLICA:
+        # Réplica sem nada pendente para aplicar está em dia, mesmo com o primário ocioso
+        cursor.execute("""
+        SELECT CASE
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+        """)
+        atraso = cursor.fetchone()[0] or 0
+        _estado_replica.update(ok=atraso <= ATRASO_MAXIMO_REPLICA, verificado_em=agora)
+    if not _estado_replica['ok']:
+        return False
+
+    if sessao is not None and sessao.lsn_escrita is not None:
+        cursor.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn", (sessao.lsn_escrita,))
+        if not cursor.fetchone()[0]:
+            return False
+        # A réplica só avança: daqui em diante a sessão não precisa mais conferir
+        sessao.lsn_escrita = None
+    return True
+
+def _emprestar(leitura, sessao):
+    """Escolhe o pool da operação e empresta uma conexão dele."""
+    replica_liberada = (
+        time.monotonic() - _estado_replica['verificado_em'] >= INTERVALO_VERIFICACAO_REPLICA
+        or _estado_replica['ok']
+    )
+    if leitura and REPLICA_DSN and replica_liberada:
+        try:
+            replica = _obter_pool('replica')
+            conn = replica.emprestar()
+        except DatabaseError:
+            _estado_replica.update(ok=False, verificado_em=time.monotonic())
+        else:
+            try:
+                if _replica_em_dia(conn, sessao):
+                    return conn, replica
+            except psycopg2.Error:
+                _estado_replica.update(ok=False, verificado_em=time.monotonic())
+            if not conn.closed:
+                conn.rollback()
+            replica.devolver(conn)
+
+    primario = _obter_pool('primario')
+    return primario.emprestar(), primario
+
+@contextmanager
+def conexao(leitura=False, sessao=None):
+    """Empresta uma conexão do pool; faz commit ao final ou rollback se houver erro.
+
+    Com `leitura=True` a operação vai para a réplica (se configurada, em dia e com as
+    escritas da `sessao` já aplicadas) e, caso contrário, para o primário. As conexões
+    do pool guardam seus prepared statements, então consultas repetidas não passam de
+    novo pelo parse/plan do servidor.
+    """
+    conn, pool_usado = _emprestar(leitura, sessao)
+    try:
+        yield conn
+        conn.commit()
+        if not leitura and sessao is not None and REPLICA_DSN:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_current_wal_lsn()::text")
+            sessao.lsn_escrita = cursor.fetchone()[0]
+            conn.commit()
+    except BaseException as erro:
+        if not conn.closed:
+            conn.rollback()
+        if pool_usado is _pools.get('replica') and conexao_perdida(erro):
+            _estado_replica.update(ok=False, verificado_em=time.monotonic())
+        raise
+    finally:
+        pool_usado.devolver(conn)
+
 def criar_tabelas():
-    """Cria as tabelas necessárias no banco de dados se não existirem."""
+    """Cria as tabelas necessárias no banco de dados se não existirem.
+
+    Roda uma vez por processo (as chamadas seguintes não vão ao banco). Comandos que
+    travariam agendamentos (ALTER TABLE, CREATE INDEX, CREATE TRIGGER) só são
+    executados quando o catálogo mostra que o objeto ainda falta.
+    """
+    global _esquema_pronto
+    if _esquema_pronto:
+        return
     conn = None  # Initialize conn to None
     try:
         conn = conectar()
         cursor = conn.cursor()
+        # Processos iniciando juntos criam o esquema um de cada vez, sem deadlock
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (TRAVA_ESQUEMA,))
         
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS clientes (
@@ -58,228 +314,890 @@ def criar_tabelas():
         ]
 
         for servico in servicos_padrao:
-            cursor.execute("SELECT id FROM servicos WHERE nome = %s", (servico[0],))
-            if not cursor.fetchone():
-                cursor.execute("""
-                INSERT INTO servicos (nome, preco, duracao, descricao)
-                VALUES (%s, %s, %s, %s)
-                """, servico)
+            if not repositorio.servico_existe_por_nome(cursor, servico[0]):
+                repositorio.inserir_servico(cursor, *servico)
+
+        # Bancos criados antes do particionamento têm agendamentos como tabela comum
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('agendamentos')")
+        tabela = cursor.fetchone()
+        legado = tabela is not None and tabela[0] == 'r'
+        if legado:
+            cursor.execute("ALTER TABLE agendamentos RENAME TO agendamentos_legado")
+            cursor.execute("ALTER SEQUENCE IF EXISTS agendamentos_id_seq RENAME TO agendamentos_legado_id_seq")
 
+        # Particionada por mês em "data": as consultas do dia/semana só tocam 1 ou 2 partições
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS agendamentos (
-            id SERIAL PRIMARY KEY,
+            id SERIAL,
             cliente_nome TEXT NOT NULL,
             cliente_telefone TEXT NOT NULL,
             servico_id INTEGER REFERENCES servicos (id),
             data DATE NOT NULL,
             hora TIME NOT NULL,
-            status TEXT DEFAULT 'Pendente'
+            status TEXT DEFAULT 'Pendente',
+            PRIMARY KEY (id, data)
+        ) PARTITION BY RANGE (data);
+        """)
+
+        if not _relacao_existe(cursor, 'idx_agendamentos_data_hora'):
+            cursor.execute("""
+            CREATE INDEX idx_agendamentos_data_hora
+            ON agendamentos (data, hora);
+            """)
+
+        hoje = date.today()
+        inicio = hoje
+        if legado:
+            cursor.execute("SELECT MIN(data) FROM agendamentos_legado")
+            inicio = min(cursor.fetchone()[0] or hoje, hoje)
+        criadas = _criar_particoes(cursor, inicio, _somar_meses(hoje, HORIZONTE_PARTICOES_MESES))
+
+        if legado:
+            cursor.execute("""
+            INSERT INTO agendamentos (id, cliente_nome, cliente_telefone, servico_id, data, hora, status)
+            SELECT id, cliente_nome, cliente_telefone, servico_id, data, hora, status
+            FROM agendamentos_legado
+            """)
+            cursor.execute("""
+            SELECT setval('agendamentos_id_seq', COALESCE((SELECT MAX(id) FROM agendamentos), 0) + 1, false)
+            """)
+            cursor.execute("DROP TABLE agendamentos_legado")
+
+        # Séries recorrentes ("toda sexta às 10h até março"); cada ocorrência é um agendamento
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS series_agendamento (
+            id SERIAL PRIMARY KEY,
+            cliente_nome TEXT NOT NULL,
+            cliente_telefone TEXT NOT NULL,
+            servico_id INTEGER REFERENCES servicos (id),
+            frequencia TEXT NOT NULL,
+            data_inicio DATE NOT NULL,
+            data_fim DATE NOT NULL,
+            hora TIME NOT NULL
+        );
+        """)
+
+        # ALTER TABLE trava agendamentos inteira mesmo com IF NOT EXISTS: só roda se a coluna faltar
+        if not _coluna_existe(cursor, 'agendamentos', 'serie_id'):
+            cursor.execute("""
+            ALTER TABLE agendamentos
+            ADD COLUMN serie_id INTEGER REFERENCES series_agendamento (id);
+            """)
+
+        if not _relacao_existe(cursor, 'idx_agendamentos_serie'):
+            cursor.execute("""
+            CREATE INDEX idx_agendamentos_serie
+            ON agendamentos (serie_id, data) WHERE serie_id IS NOT NULL;
+            """)
+
+        # Barbeiro responsável (usuarios.id); NULL = qualquer barbeiro da casa
+        if not _coluna_existe(cursor, 'agendamentos', 'barbeiro_id'):
+            cursor.execute("""
+            ALTER TABLE agendamentos ADD COLUMN barbeiro_id INTEGER;
+            """)
+
+        # Contador de alterações em agendamentos: base do ETag/Last-Modified das exportações.
+        # Cada comando que altera agendamentos só insere uma linha em agendamentos_alteracoes
+        # (sem disputar uma linha única entre escritores); a versão é a base guardada em
+        # agendamentos_versao mais essas linhas, que compactar_versao_agendamentos soma à base.
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agendamentos_versao (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            versao BIGINT NOT NULL DEFAULT 0,
+            alterado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        -- ON CONFLICT esperaria por uma compactação em andamento; o SELECT não espera
+        INSERT INTO agendamentos_versao (id)
+        SELECT TRUE WHERE NOT EXISTS (SELECT 1 FROM agendamentos_versao);
+
+        CREATE TABLE IF NOT EXISTS agendamentos_alteracoes (
+            alterado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE OR REPLACE FUNCTION incrementar_versao_agendamentos() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO agendamentos_alteracoes DEFAULT VALUES;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """)
+        if not _trigger_existe(cursor, 'agendamentos', 'agendamentos_versao_trigger'):
+            cursor.execute("""
+            CREATE TRIGGER agendamentos_versao_trigger
+            AFTER INSERT OR UPDATE OR DELETE ON agendamentos
+            FOR EACH STATEMENT EXECUTE FUNCTION incrementar_versao_agendamentos();
+            """)
+
+        # Histórico de status (somente inserção); o status atual continua em agendamentos.status
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agendamentos_status_historico (
+            id BIGSERIAL PRIMARY KEY,
+            agendamento_id INTEGER NOT NULL,
+            data_agendamento DATE NOT NULL,
+            status_anterior TEXT,
+            status_novo TEXT NOT NULL,
+            usuario_id INTEGER,
+            registrado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS idx_status_historico_agendamento
+        ON agendamentos_status_historico (agendamento_id);
+        """)
+
+        # Lista de espera: vagas liberadas por cancelamento vão para o primeiro inscrito compatível
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS lista_espera (
+            id SERIAL PRIMARY KEY,
+            cliente_nome TEXT NOT NULL,
+            cliente_telefone TEXT NOT NULL,
+            servico_id INTEGER REFERENCES servicos (id),
+            data DATE NOT NULL,
+            hora_inicio TIME NOT NULL,
+            hora_fim TIME NOT NULL,
+            status TEXT NOT NULL DEFAULT 'Aguardando',
+            agendamento_id INTEGER,
+            criado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """)
+
+        # Um registro por horário coberto pela faixa de cada inscrição que aguarda: a vaga
+        # (data, hora) acha o inscrito mais antigo descendo a chave primária, sem varrer
+        # as faixas do dia. Sai quando a inscrição é atendida.
+        if not _relacao_existe(cursor, 'lista_espera_horarios'):
+            cursor.execute("""
+            CREATE TABLE lista_espera_horarios (
+                data DATE NOT NULL,
+                hora TIME NOT NULL,
+                criado_em TIMESTAMPTZ NOT NULL,
+                espera_id INTEGER NOT NULL REFERENCES lista_espera (id) ON DELETE CASCADE,
+                PRIMARY KEY (data, hora, criado_em, espera_id)
+            );
+            CREATE INDEX idx_lista_espera_horarios_espera ON lista_espera_horarios (espera_id);
+            """)
+
+        # Invalidação dos caches entre workers (ver coerencia.py): os triggers mandam o NOTIFY
+        # na própria transação da escrita, que só o entrega (e sempre entrega) se confirmar
+        cursor.execute("""
+        CREATE OR REPLACE FUNCTION publicar_coerencia(topico TEXT, chaves TEXT[]) RETURNS void AS $$
+        BEGIN
+            IF cardinality(chaves) > %(maximo)s THEN
+                chaves := NULL;
+            END IF;
+            PERFORM pg_notify(%(canal)s, json_build_object('topico', topico, 'chaves', chaves)::text);
+        END;
+        $$ LANGUAGE plpgsql;
+
+        -- TG_ARGV: tópico e, opcionalmente, a coluna cujos valores alterados vão como chaves
+        CREATE OR REPLACE FUNCTION publicar_coerencia_alteracao() RETURNS trigger AS $$
+        DECLARE
+            chaves TEXT[];
+            alteradas TEXT;
+        BEGIN
+            IF TG_NARGS > 1 AND TG_OP <> 'TRUNCATE' THEN
+                alteradas := CASE TG_OP
+                    WHEN 'INSERT' THEN 'SELECT * FROM novas'
+                    WHEN 'DELETE' THEN 'SELECT * FROM antigas'
+                    ELSE 'SELECT * FROM novas UNION ALL SELECT * FROM antigas'
+                END;
+                EXECUTE format('SELECT array_agg(DISTINCT %%I::text) FROM (%%s) alteradas', TG_ARGV[1], alteradas)
+                INTO chaves;
+                IF chaves IS NULL THEN
+                    -- Nenhuma linha afetada
+                    RETURN NULL;
+                END IF;
+            END IF;
+            PERFORM publicar_coerencia(TG_ARGV[0], chaves);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """, {'canal': CANAL_COERENCIA, 'maximo': MAXIMO_CHAVES_COERENCIA})
+        criar_triggers_coerencia(cursor, 'agendamentos', 'agendamentos', 'data')
+        criar_triggers_coerencia(cursor, 'servicos', 'servicos', eventos=('INSERT', 'UPDATE', 'DELETE', 'TRUNCATE'))
+
+        # Lembretes já entregues, para o envio ser "pelo menos uma vez" mesmo após reinícios
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS lembretes_enviados (
+            agendamento_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            enviado_em TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (agendamento_id, tipo)
         );
         """)
         
         conn.commit()
+        _particoes_conhecidas.update(criadas)
+        _esquema_pronto = True
     except psycopg2.Error as e:
         raise DatabaseError(f"Erro ao criar tabelas: {str(e)}")
     finally:
         if conn:  # Ensure conn is not None before closing
             conn.close()
 
-def verificar_conflito_horario(data, hora, agendamento_id=None):
-    """Checks if there is already an appointment at the same time."""
+def _coluna_existe(cursor, tabela, coluna):
+    """Consulta o catálogo, sem travar a tabela como um ALTER TABLE faria."""
+    cursor.execute("""
+    SELECT 1 FROM pg_attribute
+    WHERE attrelid = to_regclass(%s) AND attname = %s AND NOT attisdropped
+    """, (tabela, coluna))
+    return cursor.fetchone() is not None
+
+def _relacao_existe(cursor, nome):
+    """Tabela ou índice; CREATE INDEX IF NOT EXISTS esperaria pelos escritores mesmo se ele existir."""
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (nome,))
+    return cursor.fetchone()[0]
+
+def _trigger_existe(cursor, tabela, nome):
+    cursor.execute("""
+    SELECT 1 FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND tgname = %s
+    """, (tabela, nome))
+    return cursor.fetchone() is not None
+
+def criar_triggers_coerencia(cursor, tabela, topico, coluna=None, eventos=('INSERT', 'UPDATE', 'DELETE')):
+    """Triggers que publicam `topico` a cada escrita em `tabela`, na transação da escrita.
+
+    Com `coluna`, as chaves da mensagem são os valores dela nas linhas alteradas; sem
+    ela, a mensagem invalida o tópico inteiro. Exige publicar_coerencia_alteracao()
+    (criada por criar_tabelas) e deve rodar sob a trava TRAVA_ESQUEMA.
+    """
+    # Tabelas de transição só valem para triggers de um único evento
+    transicoes = {
+        'INSERT': "REFERENCING NEW TABLE AS novas",
+        'UPDATE': "REFERENCING OLD TABLE AS antigas NEW TABLE AS novas",
+        'DELETE': "REFERENCING OLD TABLE AS antigas",
+    }
+    argumentos = sql.SQL(", ").join(sql.Literal(valor) for valor in (topico, coluna) if valor is not None)
+    for evento in eventos:
+        nome = f"{tabela}_coerencia_{evento.lower()}"
+        if _trigger_existe(cursor, tabela, nome):
+            continue
+        cursor.execute(sql.SQL("""
+        CREATE TRIGGER {nome} AFTER {evento} ON {tabela} {transicao}
+        FOR EACH STATEMENT EXECUTE FUNCTION publicar_coerencia_alteracao({argumentos})
+        """).format(
+            nome=sql.Identifier(nome),
+            evento=sql.SQL(evento),
+            tabela=sql.Identifier(tabela),
+            transicao=sql.SQL(transicoes[evento] if coluna and evento in transicoes else ""),
+            argumentos=argumentos,
+        ))
+
+def registrar_ouvinte(funcao):
+    """Registra uma função chamada a cada agendamento criado ou alterado.
+
+    A função recebe um dict com 'tipo' ('agendamento_criado' ou 'agendamento_alterado')
+    e 'agendamentos', uma lista de pares (id, data). Mudanças de status trazem também
+    'mudancas_status', lista de (id, data, status anterior, status novo), e 'usuario_id'
+    de quem fez a mudança (None quando foi o cliente). É chamada depois do commit, na
+    thread de quem fez a alteração, então deve ser rápida (ex.: só enfileirar).
+    """
+    _ouvintes.append(funcao)
+
+def remover_ouvinte(funcao):
+    if funcao in _ouvintes:
+        _ouvintes.remove(funcao)
+
+def _notificar(tipo, agendamentos, **dados):
+    """Avisa os ouvintes; uma falha num ouvinte nunca desfaz nem quebra a operação."""
+    if not agendamentos:
+        return
+    evento = dict(dados, tipo=tipo, agendamentos=list(agendamentos))
+    for ouvinte in list(_ouvintes):
+        try:
+            ouvinte(evento)
+        except Exception:
+            logging.getLogger(__name__).exception("Erro no ouvinte de agendamentos")
+
+def _somar_meses(dia, meses):
+    """Retorna o primeiro dia do mês que está `meses` meses depois do mês de `dia`."""
+    indice = dia.year * 12 + (dia.month - 1) + meses
+    return date(indice // 12, indice % 12 + 1, 1)
+
+def _nome_particao(mes):
+    """Nome da partição mensal de agendamentos, ex.: agendamentos_2025_03."""
+    return f"agendamentos_{mes.year:04d}_{mes.month:02d}"
+
+def _criar_particoes(cursor, inicio, fim):
+    """Cria (se preciso) as partições mensais que cobrem de `inicio` até `fim`, inclusive.
+
+    Roda dentro da transação do cursor recebido e retorna os nomes das partições
+    cobertas; quem chama só deve marcá-las como conhecidas depois do commit.
+    """
+    nomes = []
+    mes = _somar_meses(inicio, 0)
+    while mes <= fim:
+        nome = _nome_particao(mes)
+        if nome not in _particoes_conhecidas:
+            cursor.execute(
+                sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF agendamentos FOR VALUES FROM (%s) TO (%s)")
+                .format(sql.Identifier(nome)),
+                (mes, _somar_meses(mes, 1))
+            )
+        nomes.append(nome)
+        mes = _somar_meses(mes, 1)
+    return nomes
+
+def garantir_particoes(inicio, fim=None):
+    """Garante que existam partições de agendamentos para o intervalo de datas informado."""
+    if isinstance(inicio, str):
+        inicio = datetime.strptime(inicio, "%Y-%m-%d").date()
+    if isinstance(fim, str):
+        fim = datetime.strptime(fim, "%Y-%m-%d").date()
+    fim = fim or inicio
+
+    mes = _somar_meses(inicio, 0)
+    pendentes = False
+    while mes <= fim:
+        if _nome_particao(mes) not in _particoes_conhecidas:
+            pendentes = True
+            break
+        mes = _somar_meses(mes, 1)
+    if not pendentes:
+        return
+
+    conn = None
     try:
         conn = conectar()
         cursor = conn.cursor()
+        criadas = _criar_particoes(cursor, inicio, fim)
+        conn.commit()
+        _particoes_conhecidas.update(criadas)
+    except (errors.DuplicateTable, errors.UniqueViolation):
+        # Outro processo criou a mesma partição ao mesmo tempo
+        pass
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao criar partições: {str(e)}")
+    finally:
+        if conn:
+            conn.close()
 
-        if agendamento_id:
-            cursor.execute("""
-                SELECT COUNT(*) FROM agendamentos 
-                WHERE data = %s AND hora = %s AND id != %s AND status != 'Cancelado'
-            """, (data, hora, agendamento_id))
-        else:
-            cursor.execute("""
-                SELECT COUNT(*) FROM agendamentos 
-                WHERE data = %s AND hora = %s AND status != 'Cancelado'
-            """, (data, hora))
+def inicio_cancelados_preservados(hoje=None):
+    """Primeira data cujos agendamentos cancelados ainda não foram removidos pela compactação.
+
+    Cancelamentos anteriores a ela são apagados por `arquivar_particoes`; métricas de
+    cancelamento só são confiáveis a partir desta data.
+    """
+    return _somar_meses(hoje or date.today(), -COMPACTACAO_CANCELADOS_MESES)
+
+def arquivar_particoes(meses_retencao=RETENCAO_PARTICOES_MESES,
+                       meses_compactacao=COMPACTACAO_CANCELADOS_MESES,
+                       remover=False):
+    """Aplica a política de retenção sobre as partições de agendamentos.
 
-        count = cursor.fetchone()[0]
-        return count > 0
+    Remove os agendamentos cancelados mais antigos que `meses_compactacao` e desanexa
+    as partições mensais anteriores a `meses_retencao`, movendo-as para o esquema de
+    arquivo (ou apagando-as, se `remover=True`). Também cria as partições do horizonte
+    de agendamento e compacta o contador de versão. Pensada para rodar periodicamente
+    (ex.: cron diário).
+    """
+    conn = None
+    try:
+        conn = conectar()
+        cursor = conn.cursor()
+        hoje = date.today()
+
+        cursor.execute(
+            "DELETE FROM agendamentos WHERE status = 'Cancelado' AND data < %s",
+            (_somar_meses(hoje, -meses_compactacao),)
+        )
+        cancelados_removidos = cursor.rowcount
+
+        cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'agendamentos'::regclass
+        """)
+        limite = _somar_meses(hoje, -meses_retencao)
+        arquivadas = []
+        for (nome,) in cursor.fetchall():
+            encontrado = re.fullmatch(r"agendamentos_(\d{4})_(\d{2})", nome)
+            if not encontrado:
+                continue
+            mes = date(int(encontrado.group(1)), int(encontrado.group(2)), 1)
+            if mes >= limite:
+                continue
+            cursor.execute(
+                sql.SQL("ALTER TABLE agendamentos DETACH PARTITION {}").format(sql.Identifier(nome))
+            )
+            if remover:
+                cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(nome)))
+            else:
+                cursor.execute(
+                    sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(ESQUEMA_ARQUIVO))
+                )
+                cursor.execute(
+                    sql.SQL("ALTER TABLE {} SET SCHEMA {}")
+                    .format(sql.Identifier(nome), sql.Identifier(ESQUEMA_ARQUIVO))
+                )
+            arquivadas.append(nome)
+
+        criadas = _criar_particoes(cursor, hoje, _somar_meses(hoje, HORIZONTE_PARTICOES_MESES))
+        conn.commit()
+        _particoes_conhecidas.difference_update(arquivadas)
+        _particoes_conhecidas.update(criadas)
+        compactar_versao_agendamentos()
+
+        return {'arquivadas': arquivadas, 'cancelados_removidos': cancelados_removidos}
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao arquivar partições: {str(e)}")
     finally:
         if conn:
             conn.close()
 
-def adicionar_agendamento(nome, telefone, servico_id, data, hora):
-    """Adds a new appointment to the database."""
-    conn = None
+def verificar_conflito_horario(data, hora, agendamento_id=None, sessao=None):
+    """Checks if there is already an appointment at the same time."""
     try:
-        # Basic validations
-        if not nome or len(nome.strip()) < 3:
-            raise DatabaseError("Name must have at least 3 characters")
+        with conexao(leitura=True, sessao=sessao) as conn:
+            return repositorio.contar_conflitos(conn.cursor(), data, hora, agendamento_id) > 0
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Database error: {str(e)}")
 
-        if not telefone or len(''.join(filter(str.isdigit, telefone))) < 10:
-            raise DatabaseError("Invalid phone number")
+def _validar_dados_agendamento(nome, telefone, servico_id, data, hora):
+    """Basic validations shared by single and recurring bookings."""
+    if not nome or len(nome.strip()) < 3:
+        raise DatabaseError("Name must have at least 3 characters")
 
-        if not servico_id:
-            raise DatabaseError("Service not selected")
+    if not telefone or len(''.join(filter(str.isdigit, telefone))) < 10:
+        raise DatabaseError("Invalid phone number")
 
-        if not data or not hora:
-            raise DatabaseError("Date and time are required")
+    if not servico_id:
+        raise DatabaseError("Service not selected")
 
-        # Establish connection to the database
-        conn = conectar()
-        cursor = conn.cursor()
+    if not data or not hora:
+        raise DatabaseError("Date and time are required")
+
+    if not horarios.horario_valido(hora):
+        raise DatabaseError("Time outside business hours")
 
-        # Check if the service exists
-        cursor.execute("SELECT id FROM servicos WHERE id = %s", (servico_id,))
-        if not cursor.fetchone():
-            raise DatabaseError(f"Service with ID {servico_id} not found")
+def adicionar_agendamento(nome, telefone, servico_id, data, hora, sessao=None):
+    """Adds a new appointment to the database."""
+    try:
+        _validar_dados_agendamento(nome, telefone, servico_id, data, hora)
+        if not horarios.horario_permitido(data, hora):
+            raise DatabaseError("The barbershop is closed at this date and time")
 
-        # Check for time conflicts
-        if verificar_conflito_horario(data, hora):
-            raise DatabaseError("There is already an appointment for this time")
+        # Bookings beyond the partition horizon need their month created first
+        garantir_particoes(data)
 
-        # Insert the appointment
-        cursor.execute("""
-        INSERT INTO agendamentos (cliente_nome, cliente_telefone, servico_id, data, hora, status)
-        VALUES (%s, %s, %s, %s, %s, 'Pendente')
-        """, (nome.strip(), telefone, servico_id, data, hora))
+        with conexao(sessao=sessao) as conn:
+            cursor = conn.cursor()
 
-        conn.commit()
-        return cursor.lastrowid
+            # Check if the service exists
+            if not repositorio.servico_existe(cursor, servico_id):
+                raise NaoEncontrado(f"Service with ID {servico_id} not found")
+
+            # Check for time conflicts (same connection, no second checkout from the pool)
+            if repositorio.contar_conflitos(cursor, data, hora) > 0:
+                raise ConflitoHorario("There is already an appointment for this time")
+
+            agendamento_id = repositorio.inserir_agendamento(cursor, nome.strip(), telefone, servico_id, data, hora)
+
+        _notificar('agendamento_criado', [(agendamento_id, data)])
+        return agendamento_id
 
     except psycopg2.IntegrityError:
         raise DatabaseError("Error saving appointment. Check the data and try again.")
     except psycopg2.Error as e:
+        if conexao_perdida(e):
+            # Conexão caiu: quem chamou pode guardar o agendamento para depois (ver fila_local)
+            raise ConexaoIndisponivel(f"Database unavailable: {str(e)}")
         raise DatabaseError(f"Database error: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
 
-def listar_servicos():
-    """Returns all available services."""
-    conn = None
+def horarios_ocupados(data, sessao=None, primario=False):
+    """Horários ("HH:MM") já ocupados no dia, numa única consulta.
+
+    `primario=True` dispensa a réplica (ex.: releitura logo após uma invalidação).
+    """
     try:
-        conn = conectar()
-        cursor = conn.cursor()
+        with conexao(leitura=not primario, sessao=sessao) as conn:
+            return {hora.strftime("%H:%M") for hora in repositorio.horarios_ocupados(conn.cursor(), data)}
+    except psycopg2.Error as e:
+        if conexao_perdida(e):
+            raise ConexaoIndisponivel(f"Erro ao consultar horários: {str(e)}")
+        raise DatabaseError(f"Erro ao consultar horários: {str(e)}")
+
+def horarios_ocupados_periodo(data_inicio, data_fim, sessao=None):
+    """Horários ocupados de cada data do período ("AAAA-MM-DD" -> {"HH:MM"}), numa consulta."""
+    try:
+        with conexao(leitura=True, sessao=sessao) as conn:
+            linhas = repositorio.horarios_ocupados_periodo(conn.cursor(), data_inicio, data_fim)
+    except psycopg2.Error as e:
+        if conexao_perdida(e):
+            raise ConexaoIndisponivel(f"Erro ao consultar horários: {str(e)}")
+        raise DatabaseError(f"Erro ao consultar horários: {str(e)}")
+    ocupados = {
+        str(data_inicio + timedelta(days=dias)): set()
+        for dias in range((data_fim - data_inicio).days + 1)
+    }
+    for data, hora in linhas:
+        ocupados[str(data)].add(hora.strftime("%H:%M"))
+    return ocupados
 
-        cursor.execute("SELECT id, nome, preco, duracao, descricao FROM servicos")
-        servicos = cursor.fetchall()
+def cancelar_agendamento(agendamento_id, telefone, sessao=None):
+    """Cancela um agendamento a pedido do cliente, conferindo o telefone usado no agendamento.
 
-        return [Servico(*servico) for servico in servicos]
+    A vaga liberada vai para a lista de espera na mesma transação.
+    """
+    try:
+        with conexao(sessao=sessao) as conn:
+            cursor = conn.cursor()
+            cancelado = repositorio.cancelar_agendamento_cliente(cursor, agendamento_id, telefone)
+            if cancelado is None:
+                raise NaoEncontrado("Agendamento não encontrado")
+            data, anterior = cancelado
+            preenchidos = _preencher_vagas(cursor, [(agendamento_id, data, anterior)])
+        _notificar(
+            'agendamento_alterado',
+            [(agendamento_id, data)],
+            mudancas_status=[(agendamento_id, data, anterior, 'Cancelado')],
+            usuario_id=None
+        )
+        _notificar_preenchidos(preenchidos)
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao cancelar agendamento: {str(e)}")
+
+def listar_servicos(sessao=None, primario=False):
+    """Returns all available services (from the primary with `primario=True`)."""
+    try:
+        with conexao(leitura=not primario, sessao=sessao) as conn:
+            return repositorio.listar_servicos(conn.cursor())
     except psycopg2.Error as e:
+        if conexao_perdida(e):
+            raise ConexaoIndisponivel(f"Error listing services: {str(e)}")
         raise DatabaseError(f"Error listing services: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
 
-def listar_agendamentos():
-    """Returns all appointments with client and service information."""
-    conn = None
+def listar_agendamentos(data_inicio=None, data_fim=None, status=None, sessao=None):
+    """Returns appointments with client and service information.
+
+    When a date range is given only the matching monthly partitions are scanned.
+    """
     try:
-        conn = conectar()
-        cursor = conn.cursor()
+        with conexao(leitura=True, sessao=sessao) as conn:
+            return repositorio.listar_agendamentos(
+                conn.cursor(), data_inicio=data_inicio, data_fim=data_fim, status=status
+            )
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Error listing appointments: {str(e)}")
 
-        cursor.execute("""
-        SELECT 
-            ag.id,
-            ag.cliente_nome,
-            ag.cliente_telefone,
-            s.nome,
-            s.duracao,
-            ag.data,
-            ag.hora,
-            ag.status
-        FROM agendamentos ag
-        JOIN servicos s ON ag.servico_id = s.id
-        ORDER BY ag.data, ag.hora
-        """)
+def atualizar_status(agendamento_id, novo_status, sessao=None, usuario_id=None):
+    """Atualiza o status de um agendamento específico.
 
-        rows = cursor.fetchall()
-
-        agendamentos = []
-        for row in rows:
-            ag_id, nome, telefone, servico, duracao, data, hora, status = row
-            cliente = Cliente(nome=nome, telefone=telefone)
-            agendamento = Agendamento(
-                id=ag_id,
-                cliente=cliente,
-                servico=servico,
-                duracao=duracao,
-                data=data,
-                hora=hora,
-                status=status
+    Num cancelamento, a vaga é oferecida à lista de espera na mesma transação. Retorna
+    os ids dos agendamentos criados a partir da lista de espera.
+    """
+    try:
+        with conexao(sessao=sessao) as conn:
+            cursor = conn.cursor()
+            alterado = repositorio.atualizar_status(cursor, agendamento_id, novo_status)
+            if alterado is None:
+                raise NaoEncontrado("Agendamento não encontrado")
+            data, anterior = alterado
+            preenchidos = []
+            if novo_status == 'Cancelado':
+                preenchidos = _preencher_vagas(cursor, [(agendamento_id, data, anterior)])
+        _notificar(
+            'agendamento_alterado',
+            [(agendamento_id, data)],
+            mudancas_status=[(agendamento_id, data, anterior, novo_status)],
+            usuario_id=usuario_id
+        )
+        _notificar_preenchidos(preenchidos)
+        return [novo_id for novo_id, _, _ in preenchidos]
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao atualizar status: {str(e)}")
+
+def entrar_lista_espera(nome, telefone, servico_id, data, hora_inicio, hora_fim, sessao=None):
+    """Inscreve o cliente na lista de espera para qualquer horário entre hora_inicio e hora_fim do dia.
+
+    Retorna o id da inscrição.
+    """
+    _validar_dados_agendamento(nome, telefone, servico_id, data, hora_inicio)
+    if not hora_fim or hora_fim < hora_inicio:
+        raise DatabaseError("Faixa de horário inválida")
+    faixa = _horarios_da_faixa(data, hora_inicio, hora_fim)
+    if not faixa:
+        raise DatabaseError("Não há atendimento nesta faixa de horário")
+    try:
+        with conexao(sessao=sessao) as conn:
+            cursor = conn.cursor()
+            if not repositorio.servico_existe(cursor, servico_id):
+                raise NaoEncontrado(f"Service with ID {servico_id} not found")
+            espera_id, criado_em = repositorio.inserir_lista_espera(
+                cursor, nome.strip(), telefone, servico_id, data, hora_inicio, hora_fim
             )
-            agendamentos.append(agendamento)
+            repositorio.inserir_horarios_lista_espera(cursor, espera_id, data, criado_em, faixa)
+            return espera_id
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao entrar na lista de espera: {str(e)}")
+
+def _horarios_da_faixa(data, hora_inicio, hora_fim):
+    """Horários de atendimento ("HH:MM") da data entre hora_inicio e hora_fim, inclusive."""
+    inicio, fim = str(hora_inicio)[:5], str(hora_fim)[:5]
+    return [hora for hora in horarios.horarios_do_dia(data) if inicio <= hora <= fim]
+
+def _preencher_vagas(cursor, cancelados):
+    """Agenda o primeiro inscrito da lista de espera em cada vaga liberada pelos cancelamentos.
 
-        return agendamentos
+    Roda no cursor (e portanto na transação) do cancelamento. `cancelados` traz
+    (id, data, status anterior); vagas passadas ou que já estavam canceladas são ignoradas.
+    Retorna (id do novo agendamento, data, id da inscrição) de cada vaga preenchida.
+    """
+    liberados = [(ag_id, data) for ag_id, data, anterior in cancelados if anterior != 'Cancelado']
+    if not liberados:
+        return []
+    agora = datetime.now()
+    preenchidos = []
+    for data, hora in repositorio.vagas_liberadas(
+        cursor, [ag_id for ag_id, _ in liberados], {data for _, data in liberados}
+    ):
+        if datetime.combine(data, hora) <= agora or repositorio.contar_conflitos(cursor, data, hora) > 0:
+            continue
+        inscrito = repositorio.reservar_da_lista_espera(cursor, data, hora)
+        if inscrito is None:
+            continue
+        espera_id, nome, telefone, servico_id = inscrito
+        novo_id = repositorio.inserir_agendamento(cursor, nome, telefone, servico_id, data, hora)
+        repositorio.marcar_lista_espera_atendida(cursor, espera_id, novo_id)
+        preenchidos.append((novo_id, data, espera_id))
+    return preenchidos
+
+def _notificar_preenchidos(preenchidos):
+    if preenchidos:
+        _notificar(
+            'agendamento_criado',
+            [(novo_id, data) for novo_id, data, _ in preenchidos],
+            origem='lista_espera'
+        )
+
+def _notificar_mudancas_status(alterados, novo_status, usuario_id):
+    _notificar(
+        'agendamento_alterado',
+        [(ag_id, data) for ag_id, data, _ in alterados],
+        mudancas_status=[(ag_id, data, anterior, novo_status) for ag_id, data, anterior in alterados],
+        usuario_id=usuario_id
+    )
+
+def atualizar_status_em_lote(agendamento_ids, novo_status, status_atual=None, sessao=None, usuario_id=None):
+    """Altera o status de vários agendamentos numa única transação e num único UPDATE.
+
+    Com `status_atual`, só altera os que estiverem nesse status. Retorna ({id: status
+    anterior} dos agendamentos que realmente mudaram, ids dos agendamentos criados a
+    partir da lista de espera nas vagas liberadas).
+    """
+    if not agendamento_ids:
+        return {}, []
+    try:
+        with conexao(sessao=sessao) as conn:
+            cursor = conn.cursor()
+            alterados = repositorio.atualizar_status_por_ids(
+                cursor, agendamento_ids, novo_status, status_atual
+            )
+            preenchidos = _preencher_vagas(cursor, alterados) if novo_status == 'Cancelado' else []
+        _notificar_mudancas_status(alterados, novo_status, usuario_id)
+        _notificar_preenchidos(preenchidos)
+        return {ag_id: anterior for ag_id, _, anterior in alterados}, [novo_id for novo_id, _, _ in preenchidos]
     except psycopg2.Error as e:
-        raise DatabaseError(f"Error listing appointments: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
+        raise DatabaseError(f"Erro ao atualizar status: {str(e)}")
 
-def atualizar_status(agendamento_id, novo_status):
-    """Atualiza o status de um agendamento específico."""
-    conn = None
+def atualizar_status_do_dia(data, status_atual, novo_status, sessao=None, usuario_id=None):
+    """Ex.: confirma todos os pendentes do dia. Retorna o mesmo que atualizar_status_em_lote."""
     try:
-        conn = conectar()
-        cursor = conn.cursor()
-        
-        cursor.execute("UPDATE agendamentos SET status = %s WHERE id = %s", 
-                      (novo_status, agendamento_id))
-        
-        if cursor.rowcount == 0:
-            raise DatabaseError("Agendamento não encontrado")
-            
-        conn.commit()
+        with conexao(sessao=sessao) as conn:
+            cursor = conn.cursor()
+            alterados = repositorio.atualizar_status_do_dia(cursor, data, status_atual, novo_status)
+            preenchidos = _preencher_vagas(cursor, alterados) if novo_status == 'Cancelado' else []
+        _notificar_mudancas_status(alterados, novo_status, usuario_id)
+        _notificar_preenchidos(preenchidos)
+        return {ag_id: anterior for ag_id, _, anterior in alterados}, [novo_id for novo_id, _, _ in preenchidos]
     except psycopg2.Error as e:
         raise DatabaseError(f"Erro ao atualizar status: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
 
-def buscar_agendamentos_por_cliente(cliente_nome):
-    """Busca agendamentos pelo nome do cliente."""
-    conn = None
+def grade_semana(inicio_semana, horarios, sessao=None):
+    """Ocupação de uma semana para a grade do barbeiro, numa única consulta agregada.
+
+    Retorna {(dia, indice_horario): (status, clientes, ativos, cancelados)}, em que dia
+    vai de 0 a 6 a partir de inicio_semana e indice_horario é a posição em `horarios`.
+    Células sem nenhum agendamento não aparecem.
+    """
     try:
-        conn = conectar()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-        SELECT 
-            ag.id,
-            ag.cliente_nome,
-            ag.cliente_telefone,
-            s.nome,
-            s.duracao,
-            ag.data,
-            ag.hora,
-            ag.status
-        FROM agendamentos ag
-        JOIN servicos s ON ag.servico_id = s.id
-        WHERE ag.cliente_nome LIKE %s
-        ORDER BY ag.data, ag.hora
-        """, (f"%{cliente_nome}%",))
-        
-        rows = cursor.fetchall()
-        
-        agendamentos = []
-        for row in rows:
-            ag_id, nome, telefone, servico, duracao, data, hora, status = row
-            cliente = Cliente(nome=nome, telefone=telefone)
-            agendamento = Agendamento(
-                id=ag_id,
-                cliente=cliente,
-                servico=servico,
-                duracao=duracao,
-                data=data,
-                hora=hora,
-                status=status
+        with conexao(leitura=True, sessao=sessao) as conn:
+            linhas = repositorio.grade_semana(
+                conn.cursor(), inicio_semana, inicio_semana + timedelta(days=6), horarios
             )
-            agendamentos.append(agendamento)
-        
-        return agendamentos
+        return {(dia, indice): tuple(resto) for dia, indice, *resto in linhas}
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao carregar a semana: {str(e)}")
+
+def versao_agendamentos(sessao=None):
+    """Retorna (versao, alterado_em) do contador de alterações de agendamentos."""
+    try:
+        with conexao(leitura=True, sessao=sessao) as conn:
+            versao, alterado_em, pendentes = repositorio.versao_agendamentos(conn.cursor())
+        if pendentes >= MAXIMO_ALTERACOES_PENDENTES:
+            compactar_versao_agendamentos()
+        return versao, alterado_em
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao ler a versão dos agendamentos: {str(e)}")
+
+def compactar_versao_agendamentos():
+    """Soma as alterações registradas à base do contador (a versão lida não muda)."""
+    try:
+        with conexao() as conn:
+            repositorio.compactar_versao_agendamentos(conn.cursor())
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao compactar a versão dos agendamentos: {str(e)}")
+
+def buscar_agendamentos_por_cliente(cliente_nome, sessao=None):
+    """Busca agendamentos pelo nome do cliente."""
+    try:
+        with conexao(leitura=True, sessao=sessao) as conn:
+            return repositorio.listar_agendamentos(conn.cursor(), cliente_nome=cliente_nome)
     except psycopg2.Error as e:
         raise DatabaseError(f"Erro ao buscar agendamentos: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+
+def buscar_agendamentos_por_telefone(telefone, sessao=None):
+    """Busca agendamentos pelo telefone do cliente."""
+    try:
+        with conexao(leitura=True, sessao=sessao) as conn:
+            return repositorio.listar_agendamentos(conn.cursor(), cliente_telefone=telefone)
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao buscar agendamentos: {str(e)}")
+
+def gerar_datas_serie(frequencia, data_inicio, data_fim):
+    """Datas de uma série recorrente entre data_inicio e data_fim, inclusive.
+
+    Na frequência mensal a série repete o dia do mês de data_inicio; em meses mais
+    curtos usa o último dia do mês.
+    """
+    if frequencia not in FREQUENCIAS_SERIE:
+        raise DatabaseError(f"Frequência inválida: {frequencia}")
+    if isinstance(data_inicio, str):
+        data_inicio = datetime.strptime(data_inicio, "%Y-%m-%d").date()
+    if isinstance(data_fim, str):
+        data_fim = datetime.strptime(data_fim, "%Y-%m-%d").date()
+    if data_fim < data_inicio:
+        raise DatabaseError("A data final da série deve ser depois da inicial")
+    if (data_fim - data_inicio).days > LIMITE_SERIE_DIAS:
+        raise DatabaseError(f"A série pode durar no máximo {LIMITE_SERIE_DIAS} dias")
+
+    intervalo = FREQUENCIAS_SERIE[frequencia]
+    datas = []
+    if intervalo:
+        atual = data_inicio
+        while atual <= data_fim:
+            datas.append(atual)
+            atual += timedelta(days=intervalo)
+    else:
+        meses = 0
+        while True:
+            mes = _somar_meses(data_inicio, meses)
+            ultimo_dia = calendar.monthrange(mes.year, mes.month)[1]
+            atual = mes.replace(day=min(data_inicio.day, ultimo_dia))
+            if atual > data_fim:
+                break
+            datas.append(atual)
+            meses += 1
+    return datas
+
+def criar_serie(nome, telefone, servico_id, data_inicio, data_fim, hora, frequencia, sessao=None):
+    """Cria uma série recorrente e agenda todas as ocorrências livres de uma só vez.
+
+    Os conflitos da série inteira são verificados numa única consulta e as ocorrências
+    livres são inseridas num único INSERT, tudo na mesma transação. Retorna um dict com
+    'serie_id', 'agendados' (datas agendadas) e 'conflitos' (lista de (data, motivo)).
+    Se nenhuma ocorrência estiver livre, a série não é criada e serie_id é None.
+    """
+    try:
+        _validar_dados_agendamento(nome, telefone, servico_id, data_inicio, hora)
+        datas = gerar_datas_serie(frequencia, data_inicio, data_fim)
+
+        # Dias sem atendimento nesse horário (domingos, feriados, expediente reduzido)
+        conflitos = [(d, "Fechado") for d in datas if not horarios.horario_permitido(d, hora)]
+        datas = [d for d in datas if horarios.horario_permitido(d, hora)]
+        if not datas:
+            return {'serie_id': None, 'agendados': [], 'conflitos': conflitos}
+
+        garantir_particoes(datas[0], datas[-1])
+
+        with conexao(sessao=sessao) as conn:
+            cursor = conn.cursor()
+
+            if not repositorio.servico_existe(cursor, servico_id):
+                raise NaoEncontrado(f"Service with ID {servico_id} not found")
+
+            ocupadas = set(repositorio.datas_ocupadas(cursor, datas, hora))
+            conflitos += [(d, "Horário ocupado") for d in datas if d in ocupadas]
+            livres = [d for d in datas if d not in ocupadas]
+            conflitos.sort()
+            if not livres:
+                return {'serie_id': None, 'agendados': [], 'conflitos': conflitos}
+
+            serie_id = repositorio.inserir_serie(
+                cursor, nome.strip(), telefone, servico_id, frequencia, livres[0], livres[-1], hora
+            )
+            ids = repositorio.inserir_agendamentos_em_lote(
+                cursor, nome.strip(), telefone, servico_id, livres, hora, serie_id
+            )
+
+        _notificar('agendamento_criado', zip(ids, livres))
+        return {'serie_id': serie_id, 'agendados': livres, 'conflitos': conflitos}
+
+    except psycopg2.IntegrityError:
+        raise DatabaseError("Error saving appointment. Check the data and try again.")
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao criar série: {str(e)}")
+
+def cancelar_serie(serie_id, a_partir_de=None, sessao=None, usuario_id=None):
+    """Cancela, num único UPDATE, as ocorrências da série a partir da data informada (padrão: hoje).
+
+    Retorna a quantidade de agendamentos cancelados.
+    """
+    try:
+        with conexao(sessao=sessao) as conn:
+            cursor = conn.cursor()
+            cancelados = repositorio.cancelar_serie(cursor, serie_id, a_partir_de or date.today())
+            preenchidos = _preencher_vagas(cursor, cancelados)
+        _notificar_mudancas_status(cancelados, 'Cancelado', usuario_id)
+        _notificar_preenchidos(preenchidos)
+        return len(cancelados)
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao cancelar série: {str(e)}")
+
+def alterar_hora_serie(serie_id, nova_hora, a_partir_de=None, telefone=None, sessao=None):
+    """Move as ocorrências futuras da série para outro horário, de uma só vez.
+
+    Com `telefone`, só altera a série se ela for desse cliente (uso pela API). As
+    ocorrências em que o novo horário está ocupado, fora do expediente do dia ou já
+    passou continuam no horário antigo e são devolvidas em 'conflitos', como (data,
+    motivo); 'alterados' traz quantas foram movidas. O horário da série passa a ser o novo.
+    """
+    if not horarios.horario_valido(nova_hora):
+        raise DatabaseError("Time outside business hours")
+    nova_hora = str(nova_hora)[:5]
+    inicio = a_partir_de or date.today()
+    try:
+        with conexao(sessao=sessao) as conn:
+            cursor = conn.cursor()
+            serie = repositorio.buscar_serie(cursor, serie_id)
+            if serie is None or (telefone is not None and serie[0] != telefone):
+                raise NaoEncontrado("Série não encontrada")
+
+            agora = datetime.now()
+            conflitos = []
+            for data in repositorio.datas_da_serie(cursor, serie_id, inicio):
+                if not horarios.horario_permitido(data, nova_hora):
+                    conflitos.append((data, "Fechado"))
+                elif datetime.combine(data, datetime.strptime(nova_hora, "%H:%M").time()) <= agora:
+                    conflitos.append((data, "Horário já passou"))
+            conflitos += [
+                (data, "Horário ocupado")
+                for data in repositorio.conflitos_nova_hora_serie(cursor, serie_id, inicio, nova_hora)
+            ]
+            conflitos.sort()
+            alterados = repositorio.alterar_hora_serie(
+                cursor, serie_id, inicio, nova_hora, [data for data, _ in conflitos]
+            )
+            repositorio.atualizar_hora_serie(cursor, serie_id, nova_hora)
+        _notificar('agendamento_alterado', alterados)
+        return {'alterados': len(alterados), 'conflitos': conflitos}
+    except psycopg2.Error as e:
+        raise DatabaseError(f"Erro ao alterar série: {str(e)}")
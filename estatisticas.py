@@ -0,0 +1,152 @@
+"""Mapa de calor de ocupação, cancelamentos e receita por dia da semana x horário.
+
+Os agendamentos do período vêm de uma única consulta a agendamentos + servicos, lida
+em lotes por um cursor do lado do servidor, já em forma compacta (dia da semana,
+posição do horário, código do status, preço). Cada lote vira um array NumPy e é
+somado nas matrizes 7 x horários com np.bincount, sem laço Python por agendamento.
+
+Cancelamentos anteriores a db.inicio_cancelados_preservados() já foram apagados pela
+compactação (db.arquivar_particoes), então 'cancelados', 'taxa_cancelamento' e
+'receita_perdida' só contam o trecho do período a partir dessa data
+('cancelados_desde'); ocupação e receita usam o período inteiro.
+
+O resultado fica em cache por período e só é recalculado quando o contador de
+alterações de agendamentos (db.versao_agendamentos) muda.
+
+Uso:
+    mapa = calcular_mapa(date(2025, 1, 1), date(2025, 12, 31))
+    mapa['ocupacao'][0, 3]   # fração dos horários de segunda às 10:30 que foram ocupados
+"""
+import threading
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+
+import db
+import horarios as grade_horarios
+import repositorio
+from utils import HORARIOS_DISPONIVEIS
+
+# Códigos de status usados na consulta compacta
+CODIGOS_STATUS = {"Pendente": 0, "Confirmado": 1, "Cancelado": 2}
+CANCELADO = CODIGOS_STATUS["Cancelado"]
+
+# Linhas lidas do cursor do servidor a cada ida ao banco
+LINHAS_POR_LOTE = 20_000
+
+# Quantos períodos diferentes ficam guardados em cache
+MAXIMO_PERIODOS_CACHE = 16
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _vagas(data_inicio, data_fim, horarios):
+    """Vagas (7 x horários) do período: em quantas datas de cada dia da semana há
+    atendimento em cada horário, pela grade de horarios.py (expediente e feriados)."""
+    # Datas com o mesmo dia da semana e os mesmos horários abertos somam de uma vez
+    modelos = Counter()
+    dia = data_inicio
+    while dia <= data_fim:
+        modelos[(dia.weekday(), grade_horarios.horarios_do_dia(dia))] += 1
+        dia += timedelta(days=1)
+    vagas = np.zeros((7, len(horarios)), dtype=np.int64)
+    for (dia_semana, abertos), datas in modelos.items():
+        vagas[dia_semana] += datas * np.isin(horarios, abertos)
+    return vagas
+
+
+def _agregar(cursor, quantidade_horarios):
+    """Soma os lotes do cursor nas matrizes (7 x horários) de contagem e receita.
+
+    Cancelados e receita perdida só somam as linhas dentro da janela de cancelamentos
+    preservados; 'ativos_janela' conta os ativos dessa mesma janela, para a taxa.
+    """
+    celulas = 7 * quantidade_horarios
+    ativos = np.zeros(celulas, dtype=np.int64)
+    ativos_janela = np.zeros(celulas, dtype=np.int64)
+    cancelados = np.zeros(celulas, dtype=np.int64)
+    receita = np.zeros(celulas, dtype=np.float64)
+    receita_perdida = np.zeros(celulas, dtype=np.float64)
+    while True:
+        linhas = cursor.fetchmany(LINHAS_POR_LOTE)
+        if not linhas:
+            break
+        lote = np.array(linhas, dtype=np.float64)
+        indice = lote[:, 0].astype(np.intp) * quantidade_horarios + lote[:, 1].astype(np.intp)
+        cancelado = lote[:, 2] == CANCELADO
+        preco = lote[:, 3]
+        na_janela = lote[:, 4] == 1
+        ativos += np.bincount(indice[~cancelado], minlength=celulas)
+        ativos_janela += np.bincount(indice[~cancelado & na_janela], minlength=celulas)
+        cancelados += np.bincount(indice[cancelado & na_janela], minlength=celulas)
+        receita += np.bincount(indice[~cancelado], weights=preco[~cancelado], minlength=celulas)
+        perdido = cancelado & na_janela
+        receita_perdida += np.bincount(indice[perdido], weights=preco[perdido], minlength=celulas)
+    forma = (7, quantidade_horarios)
+    return (
+        ativos.reshape(forma),
+        ativos_janela.reshape(forma),
+        cancelados.reshape(forma),
+        receita.reshape(forma),
+        receita_perdida.reshape(forma),
+    )
+
+
+def _calcular(data_inicio, data_fim, horarios, cancelados_desde):
+    with db.conexao(leitura=True) as conn:
+        cursor = repositorio.cursor_ocupacao(
+            conn, data_inicio, data_fim, horarios, CODIGOS_STATUS,
+            cancelados_desde, LINHAS_POR_LOTE
+        )
+        ativos, ativos_janela, cancelados, receita, receita_perdida = _agregar(cursor, len(horarios))
+        cursor.close()
+
+    vagas = _vagas(data_inicio, data_fim, horarios)
+    total = ativos_janela + cancelados
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ocupacao = np.where(vagas > 0, ativos / vagas, 0.0)
+        taxa_cancelamento = np.where(total > 0, cancelados / total, 0.0)
+    return {
+        'horarios': list(horarios),
+        'ativos': ativos,
+        'cancelados': cancelados,
+        'ocupacao': ocupacao,
+        'taxa_cancelamento': taxa_cancelamento,
+        'receita': receita,
+        'receita_perdida': receita_perdida,
+        'cancelados_desde': max(data_inicio, cancelados_desde),
+    }
+
+
+def calcular_mapa(data_inicio, data_fim, horarios=HORARIOS_DISPONIVEIS):
+    """Mapa de calor do período (datas inclusivas).
+
+    Retorna um dict com 'horarios' e matrizes NumPy 7 x len(horarios), linha 0 =
+    segunda: 'ativos', 'cancelados', 'ocupacao' (ativos / vagas do período),
+    'taxa_cancelamento', 'receita' (preço dos não cancelados) e 'receita_perdida'.
+    As métricas de cancelamento só cobrem as datas a partir de 'cancelados_desde'
+    (cancelamentos mais antigos já foram removidos pela compactação).
+    """
+    horarios = tuple(horarios)
+    cancelados_desde = db.inicio_cancelados_preservados()
+    chave = (data_inicio, data_fim, horarios, cancelados_desde)
+    versao, _ = db.versao_agendamentos()
+    with _cache_lock:
+        em_cache = _cache.get(chave)
+    if em_cache and em_cache[0] == versao:
+        return em_cache[1]
+
+    mapa = _calcular(data_inicio, data_fim, horarios, cancelados_desde)
+    with _cache_lock:
+        _cache.pop(chave, None)
+        _cache[chave] = (versao, mapa)
+        while len(_cache) > MAXIMO_PERIODOS_CACHE:
+            _cache.pop(next(iter(_cache)))
+    return mapa
+
+
+def limpar_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,161 @@
+"""Exportação da agenda em iCalendar (.ics) e CSV, por barbeiro ou da barbearia inteira.
+
+Os feeds são gerados aos poucos a partir de um cursor do lado do servidor, sem montar
+listas em memória. ETag e Last-Modified vêm do contador de alterações mantido por
+trigger em agendamentos (ver db.versao_agendamentos): enquanto ele não muda, uma
+requisição condicional (If-None-Match / If-Modified-Since) recebe "304 Not Modified"
+sem consultar os agendamentos nem renderizar o feed.
+
+Uso:
+    status, cabecalhos, corpo = abrir_feed("ics", barbeiro_id=1, if_none_match=etag)
+    if corpo is not None:
+        for pedaco in corpo:
+            ...
+"""
+import csv
+import io
+from datetime import date, datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+import db
+import repositorio
+
+# Quantos dias de agendamentos passados entram nos feeds
+DIAS_PASSADOS_FEED = 30
+
+# Linhas agrupadas em cada pedaço devolvido pelo gerador
+LINHAS_POR_PEDACO = 200
+
+TIPOS_CONTEUDO = {
+    'ics': "text/calendar; charset=utf-8",
+    'csv': "text/csv; charset=utf-8",
+}
+
+STATUS_ICAL = {
+    "Pendente": "TENTATIVE",
+    "Confirmado": "CONFIRMED",
+    "Cancelado": "CANCELLED",
+}
+
+
+def _escapar_ical(texto):
+    return (
+        str(texto or "")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+def _linha_ical(linha):
+    """Quebra linhas com mais de 75 octetos, como pede a RFC 5545."""
+    dados = linha.encode("utf-8")
+    if len(dados) <= 75:
+        return linha + "\r\n"
+    partes = []
+    atual = ""
+    limite = 75
+    for caractere in linha:
+        if len((atual + caractere).encode("utf-8")) > limite:
+            partes.append(atual)
+            atual = " "
+            limite = 75
+        atual += caractere
+    partes.append(atual)
+    return "\r\n".join(partes) + "\r\n"
+
+
+def _evento_ical(linha, carimbo):
+    ag_id, nome, telefone, servico, duracao, data, hora, status = linha
+    inicio = datetime.combine(data, hora)
+    fim = inicio + timedelta(minutes=duracao or 0)
+    return "".join(_linha_ical(campo) for campo in (
+        "BEGIN:VEVENT",
+        f"UID:agendamento-{ag_id}@barbearia",
+        f"DTSTAMP:{carimbo}",
+        f"DTSTART:{inicio.strftime('%Y%m%dT%H%M%S')}",
+        f"DTEND:{fim.strftime('%Y%m%dT%H%M%S')}",
+        f"SUMMARY:{_escapar_ical(f'{servico} - {nome}')}",
+        f"DESCRIPTION:{_escapar_ical(f'Telefone: {telefone}')}",
+        f"STATUS:{STATUS_ICAL.get(status, 'TENTATIVE')}",
+        "END:VEVENT",
+    ))
+
+
+def _gerar(formato, barbeiro_id, alterado_em):
+    """Gera o feed em pedaços de texto enquanto percorre o cursor do servidor."""
+    inicio = date.today() - timedelta(days=DIAS_PASSADOS_FEED)
+    with db.conexao(leitura=True) as conn:
+        cursor = repositorio.cursor_exportacao(conn, inicio, barbeiro_id, LINHAS_POR_PEDACO)
+        if formato == 'ics':
+            carimbo = alterado_em.strftime('%Y%m%dT%H%M%SZ')
+            yield "".join(_linha_ical(campo) for campo in (
+                "BEGIN:VCALENDAR",
+                "VERSION:2.0",
+                "PRODID:-//Barbearia//Agendamentos//PT-BR",
+                "CALSCALE:GREGORIAN",
+                f"X-WR-CALNAME:{'Agenda do barbeiro' if barbeiro_id else 'Agenda da barbearia'}",
+            ))
+            while True:
+                linhas = cursor.fetchmany(LINHAS_POR_PEDACO)
+                if not linhas:
+                    break
+                yield "".join(_evento_ical(linha, carimbo) for linha in linhas)
+            yield "END:VCALENDAR\r\n"
+        else:
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer)
+            escritor.writerow(["id", "cliente", "telefone", "servico", "duracao", "data", "hora", "status"])
+            while True:
+                linhas = cursor.fetchmany(LINHAS_POR_PEDACO)
+                if not linhas:
+                    break
+                escritor.writerows(
+                    (ag_id, nome, telefone, servico, duracao, data.isoformat(), hora.strftime("%H:%M"), status)
+                    for ag_id, nome, telefone, servico, duracao, data, hora, status in linhas
+                )
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        cursor.close()
+
+
+def _nao_modificado(etag, alterado_em, if_none_match, if_modified_since):
+    if if_none_match:
+        etags = [valor.strip() for valor in if_none_match.split(",")]
+        return "*" in etags or etag in etags or f"W/{etag}" in etags
+    if if_modified_since:
+        try:
+            return alterado_em.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def abrir_feed(formato, barbeiro_id=None, if_none_match=None, if_modified_since=None):
+    """Prepara a resposta de um feed da agenda.
+
+    Retorna (status HTTP, cabeçalhos, corpo). Quando o cliente já tem a versão atual,
+    status é 304 e corpo é None; senão, corpo é um gerador de pedaços de texto.
+    """
+    if formato not in TIPOS_CONTEUDO:
+        raise ValueError(f"Formato de exportação inválido: {formato}")
+
+    versao, alterado_em = db.versao_agendamentos()
+    alterado_em = alterado_em.astimezone(timezone.utc)
+    escopo = f"barbeiro-{barbeiro_id}" if barbeiro_id else "barbearia"
+    etag = f'"{escopo}-{formato}-{versao}"'
+    cabecalhos = {
+        'ETag': etag,
+        'Last-Modified': format_datetime(alterado_em, usegmt=True),
+        'Cache-Control': "no-cache",
+    }
+    if _nao_modificado(etag, alterado_em, if_none_match, if_modified_since):
+        return 304, cabecalhos, None
+
+    cabecalhos['Content-Type'] = TIPOS_CONTEUDO[formato]
+    cabecalhos['Content-Disposition'] = f'attachment; filename="agenda-{escopo}.{formato}"'
+    return 200, cabecalhos, _gerar(formato, barbeiro_id, alterado_em)
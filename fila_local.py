@@ -0,0 +1,365 @@
+"""Fila local de agendamentos para quando o banco está fora do ar (write-behind).
+
+Com a fila ativa, a tela de agendamento não depende do PostgreSQL estar no ar. Se o
+banco não responde, o agendamento é conferido contra o último retrato conhecido dos
+horários ocupados, gravado num diário local (uma linha JSON por registro, com fsync)
+e confirmado na hora ao cliente. Enquanto o banco está no ar, o retrato dos próximos
+HORIZONTE_RETRATO_DIAS dias é renovado em segundo plano; fora do ar, agendamentos para
+uma data sem retrato são recusados, pois não há como conferir o horário. Uma thread reaplica o diário em ordem assim que o
+banco volta: agendamentos que já tinham chegado ao banco (mesmo dia, horário e
+telefone) não são duplicados, e clientes cujo horário foi ocupado nesse meio tempo
+são avisados por um destino no formato dos lembretes (ex.: lembretes.DestinoArquivo).
+
+Enquanto houver registros pendentes no diário, novos agendamentos também entram nele,
+para que a ordem de chegada seja respeitada na reaplicação.
+
+Com vários workers na mesma máquina, cada um usa um diário próprio (BARBEARIA_FILA_ARQUIVO,
+BARBEARIA_FILA_ARQUIVO.1, .2, ...), reservado com flock enquanto o processo vive: um worker
+não esvazia o diário de outro, e quem sobe no lugar de um worker morto assume o diário
+que ele deixou e reaplica o que ficou pendente.
+
+Uso:
+    fila = FilaLocal("fila_agendamentos.jsonl", lembretes.DestinoArquivo("lembretes.jsonl"))
+    fila.iniciar()
+    agendamento_id = fila.adicionar_agendamento(nome, telefone, servico_id, "2025-06-10", "09:30")
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+import psycopg2
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock, um único worker por diário
+    fcntl = None
+
+import db
+import lembretes
+import repositorio
+
+# Intervalo (segundos) entre tentativas de falar com o banco enquanto ele está fora do ar
+ESPERA_RECONEXAO = 5
+
+PREFIXO_ID_LOCAL = "local-"
+
+# Dias à frente cujos horários ocupados ficam no retrato local (a tela oferece 30 dias)
+HORIZONTE_RETRATO_DIAS = 30
+
+# De quanto em quanto tempo (segundos) o retrato é renovado enquanto o banco está no ar
+INTERVALO_RETRATO = 60
+
+# Máximo de diários (um por worker ativo) com o mesmo BARBEARIA_FILA_ARQUIVO
+MAXIMO_DIARIOS = 64
+
+logger = logging.getLogger(__name__)
+
+
+def eh_local(agendamento_id):
+    """Diz se o id é de um agendamento ainda só no diário local."""
+    return isinstance(agendamento_id, str) and agendamento_id.startswith(PREFIXO_ID_LOCAL)
+
+
+class FilaLocal:
+    """Diário local de agendamentos com reaplicação em segundo plano.
+
+    Expõe adicionar_agendamento, horarios_ocupados e listar_servicos com a mesma
+    assinatura do módulo db, para a interface usar um ou outro sem mudanças. O destino
+    de avisos é qualquer objeto com `enviar(avisos)`, como os destinos de lembretes.
+    """
+
+    def __init__(self, caminho, destino_avisos=None):
+        self.caminho = caminho
+        self.destino_avisos = destino_avisos
+        self.fora_do_ar = False
+        self._lock = threading.Lock()
+        # Registros do diário ainda não aplicados no banco, na ordem de chegada
+        self._pendentes = []
+        # Último retrato conhecido: data ("AAAA-MM-DD") -> horários ("HH:MM") ocupados
+        self._ocupados = {}
+        # Momento (time.monotonic) da última renovação do retrato do horizonte
+        self._retrato_em = None
+        self._servicos = None
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self._carregar_diario()
+
+    # ------------------------------------------------------------ ciclo de vida
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._executar, name="fila_local", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._acordar.set()
+        if self._thread:
+            self._thread.join()
+
+    # ------------------------------------------------------------------- diário
+
+    def _carregar_diario(self):
+        """Reconstrói os pendentes a partir do diário (após reinício do processo)."""
+        if not os.path.exists(self.caminho):
+            return
+        pendentes = {}
+        with open(self.caminho, encoding="utf-8") as arquivo:
+            for numero, linha in enumerate(arquivo, 1):
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    # Última linha incompleta de uma gravação interrompida
+                    logger.warning("Linha %d inválida no diário %s ignorada", numero, self.caminho)
+                    continue
+                if registro['tipo'] == 'agendamento':
+                    pendentes[registro['id']] = registro
+                elif registro['tipo'] == 'aplicado':
+                    pendentes.pop(registro['id'], None)
+        self._pendentes = list(pendentes.values())
+        if self._pendentes:
+            logger.info("%d agendamento(s) pendente(s) no diário local", len(self._pendentes))
+
+    def _anexar(self, registro):
+        """Grava o registro no diário e só retorna depois do fsync."""
+        with open(self.caminho, "a", encoding="utf-8") as arquivo:
+            arquivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+
+    def _ocupados_pendentes(self, data):
+        return {registro['hora'] for registro in self._pendentes if registro['data'] == data}
+
+    # ------------------------------------------------------- operações da interface
+
+    def adicionar_agendamento(self, nome, telefone, servico_id, data, hora, sessao=None):
+        """Agenda direto no banco ou, se ele estiver fora do ar, no diário local.
+
+        Retorna o id do banco ou um id local (ver eh_local). Levanta ConflitoHorario se o
+        horário já consta como ocupado no último retrato conhecido e ConexaoIndisponivel
+        se o banco está fora do ar e não há retrato da data.
+        """
+        data, hora = str(data), str(hora)[:5]
+        if not self.fora_do_ar and not self._pendentes:
+            try:
+                agendamento_id = db.adicionar_agendamento(nome, telefone, servico_id, data, hora, sessao=sessao)
+                with self._lock:
+                    self._ocupados.setdefault(data, set()).add(hora)
+                return agendamento_id
+            except db.ConexaoIndisponivel:
+                logger.warning("Banco indisponível; agendamentos vão para o diário local")
+                self.fora_do_ar = True
+        if data not in self._ocupados and not self.fora_do_ar:
+            # No ar, mas com pendentes à frente: o retrato da data ainda pode ser lido
+            self.horarios_ocupados(data, sessao=sessao)
+
+        with self._lock:
+            if data not in self._ocupados:
+                raise db.ConexaoIndisponivel(
+                    "Sem conexão com o banco para conferir os horários deste dia; tente novamente em instantes"
+                )
+            if hora in self._ocupados.get(data, set()) or hora in self._ocupados_pendentes(data):
+                raise db.ConflitoHorario("There is already an appointment for this time")
+            registro = {
+                'tipo': 'agendamento',
+                'id': PREFIXO_ID_LOCAL + uuid.uuid4().hex,
+                'nome': nome,
+                'telefone': telefone,
+                'servico_id': servico_id,
+                'data': data,
+                'hora': hora,
+                'registrado_em': datetime.now().isoformat(timespec="seconds"),
+            }
+            self._anexar(registro)
+            self._pendentes.append(registro)
+        self._acordar.set()
+        return registro['id']
+
+    def horarios_ocupados(self, data, sessao=None, primario=False):
+        """Horários ocupados do dia, do banco ou, fora do ar, do último retrato conhecido."""
+        data = str(data)
+        if not self.fora_do_ar:
+            try:
+                ocupados = db.horarios_ocupados(data, sessao=sessao, primario=primario)
+                with self._lock:
+                    self._ocupados[data] = set(ocupados)
+                    return ocupados | self._ocupados_pendentes(data)
+            except db.ConexaoIndisponivel:
+                self.fora_do_ar = True
+                self._acordar.set()
+        with self._lock:
+            return set(self._ocupados.get(data, set())) | self._ocupados_pendentes(data)
+
+    def listar_servicos(self, sessao=None, primario=False):
+        if not self.fora_do_ar or self._servicos is None:
+            try:
+                self._servicos = db.listar_servicos(sessao=sessao, primario=primario)
+            except db.ConexaoIndisponivel:
+                self.fora_do_ar = True
+                self._acordar.set()
+                if self._servicos is None:
+                    raise
+        return self._servicos
+
+    # --------------------------------------------------------------- reaplicação
+
+    def _executar(self):
+        while not self._parar.is_set():
+            self._acordar.wait(ESPERA_RECONEXAO)
+            self._acordar.clear()
+            if not self._pendentes and not self.fora_do_ar:
+                self._renovar_retrato()
+                continue
+            if self.fora_do_ar and not self._banco_no_ar():
+                continue
+            try:
+                self._reaplicar()
+            except db.ConexaoIndisponivel:
+                self.fora_do_ar = True
+            except Exception:
+                logger.exception("Erro ao reaplicar o diário local")
+
+    def _banco_no_ar(self):
+        try:
+            with db.conexao() as conn:
+                conn.cursor().execute("SELECT 1")
+            return True
+        except db.PoolEsgotado:
+            # Todas as conexões em uso: o banco responde
+            return True
+        except (db.ConexaoIndisponivel, psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _renovar_retrato(self):
+        """Guarda os horários ocupados do horizonte de agendamento, para conferir fora do ar."""
+        if self._retrato_em is not None and time.monotonic() - self._retrato_em < INTERVALO_RETRATO:
+            return
+        hoje = date.today()
+        try:
+            ocupados = db.horarios_ocupados_periodo(hoje, hoje + timedelta(days=HORIZONTE_RETRATO_DIAS))
+        except db.ConexaoIndisponivel:
+            self.fora_do_ar = True
+            return
+        except db.DatabaseError:
+            logger.exception("Erro ao renovar o retrato dos horários ocupados")
+            return
+        with self._lock:
+            for data in [data for data in self._ocupados if data < str(hoje)]:
+                del self._ocupados[data]
+            self._ocupados.update(ocupados)
+        self._retrato_em = time.monotonic()
+
+    def _reaplicar(self):
+        """Aplica os pendentes em ordem; para no primeiro sinal de banco fora do ar."""
+        # Se o processo subiu com o banco fora do ar, o esquema ainda não foi conferido
+        db.criar_tabelas()
+        while True:
+            with self._lock:
+                if not self._pendentes:
+                    self.fora_do_ar = False
+                    # Tudo aplicado: o diário pode recomeçar vazio
+                    open(self.caminho, "w").close()
+                    return
+                registro = self._pendentes[0]
+            resultado, agendamento_id = self._aplicar(registro)
+            with self._lock:
+                self._anexar({
+                    'tipo': 'aplicado',
+                    'id': registro['id'],
+                    'resultado': resultado,
+                    'agendamento_id': agendamento_id,
+                })
+                self._pendentes.pop(0)
+            if resultado not in ('agendado', 'duplicado'):
+                self._avisar(registro, resultado)
+
+    def _aplicar(self, registro):
+        """Grava um registro do diário no banco; retorna (resultado, id do agendamento)."""
+        data = datetime.strptime(registro['data'], "%Y-%m-%d").date()
+        hora = datetime.strptime(registro['hora'], "%H:%M").time()
+        if datetime.combine(data, hora) <= datetime.now():
+            return 'expirado', None
+        try:
+            with db.conexao() as conn:
+                existentes = repositorio.listar_agendamentos(
+                    conn.cursor(), data=data, hora=hora, cliente_telefone=registro['telefone']
+                )
+        except psycopg2.Error as e:
+            if db.conexao_perdida(e):
+                raise db.ConexaoIndisponivel(f"Erro ao consultar agendamentos: {str(e)}")
+            raise
+        # Já chegou ao banco (ex.: a conexão caiu depois do commit)
+        for agendamento in existentes:
+            if agendamento.status != 'Cancelado':
+                return 'duplicado', agendamento.id
+        try:
+            return 'agendado', db.adicionar_agendamento(
+                registro['nome'], registro['telefone'], registro['servico_id'], registro['data'], registro['hora']
+            )
+        except db.ConflitoHorario:
+            return 'conflito', None
+        except db.ConexaoIndisponivel:
+            raise
+        except db.DatabaseError as e:
+            logger.warning("Agendamento %s do diário recusado: %s", registro['id'], e)
+            return 'recusado', None
+
+    def _avisar(self, registro, motivo):
+        if self.destino_avisos is None:
+            return
+        try:
+            self.destino_avisos.enviar([{
+                'tipo': 'agendamento_nao_confirmado',
+                'motivo': motivo,
+                'cliente_nome': registro['nome'],
+                'cliente_telefone': registro['telefone'],
+                'horario': f"{registro['data']} {registro['hora']}",
+            }])
+        except Exception:
+            logger.exception("Erro ao avisar o cliente do agendamento %s", registro['id'])
+
+
+# Arquivos de trava dos diários reservados por este processo (abertos até ele terminar)
+_travas_diario = []
+
+
+def reservar_diario(caminho):
+    """Reserva para este processo o primeiro diário livre entre `caminho`, `caminho`.1, ...
+
+    A reserva é um flock exclusivo no arquivo `<diário>.trava`, solto pelo sistema quando
+    o processo termina. Retorna o caminho do diário reservado.
+    """
+    if fcntl is None:
+        return caminho
+    for numero in range(MAXIMO_DIARIOS):
+        diario = caminho if numero == 0 else f"{caminho}.{numero}"
+        trava = open(diario + ".trava", "a")
+        try:
+            fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            trava.close()
+            continue
+        _travas_diario.append(trava)
+        return diario
+    raise RuntimeError(f"Todos os {MAXIMO_DIARIOS} diários de {caminho} estão em uso")
+
+
+def iniciar_padrao():
+    """Inicia a fila se BARBEARIA_FILA_ARQUIVO estiver definida; senão retorna None.
+
+    Cada worker reserva um diário próprio (ver reservar_diario). Os avisos aos clientes
+    vão para o mesmo arquivo dos lembretes.
+    """
+    caminho = os.environ.get("BARBEARIA_FILA_ARQUIVO")
+    if not caminho:
+        return None
+    fila = FilaLocal(
+        reservar_diario(caminho),
+        lembretes.DestinoArquivo(os.environ.get("BARBEARIA_LEMBRETES_ARQUIVO", "lembretes.jsonl"))
+    )
+    fila.iniciar()
+    return fila
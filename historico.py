@@ -0,0 +1,109 @@
+"""Histórico de status dos agendamentos (tabela agendamentos_status_historico).
+
+Cada criação e mudança de status publicada pelo módulo db vira um evento no
+histórico, somente inserção. A gravação é feita em lotes por uma thread própria,
+que descarrega quando junta TAMANHO_LOTE eventos ou a cada INTERVALO_DESCARGA
+segundos. Assim o registro de auditoria não acrescenta latência ao clique no status.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import db
+import repositorio
+
+TAMANHO_LOTE = 100
+INTERVALO_DESCARGA = 1.0
+
+# Limite de eventos guardados em memória enquanto o banco está fora do ar
+MAXIMO_PENDENTES = 100_000
+
+logger = logging.getLogger(__name__)
+
+
+def _como_data(valor):
+    if isinstance(valor, str):
+        return datetime.strptime(valor, "%Y-%m-%d").date()
+    return valor
+
+
+class EscritorHistorico:
+    """Ouve os eventos de agendamento e grava o histórico de status em lotes."""
+
+    def __init__(self, tamanho_lote=TAMANHO_LOTE, intervalo=INTERVALO_DESCARGA):
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self._fila = queue.Queue()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        db.registrar_ouvinte(self.registrar)
+        self._thread = threading.Thread(target=self._executar, name="historico", daemon=True)
+        self._thread.start()
+        atexit.register(self.parar)
+
+    def parar(self):
+        """Para de ouvir e grava o que ainda estiver na fila."""
+        db.remover_ouvinte(self.registrar)
+        if self._thread and self._thread.is_alive():
+            self._parar.set()
+            self._fila.put(None)
+            self._thread.join()
+
+    def registrar(self, evento):
+        """Ouvinte do db: só converte o evento e enfileira (roda na thread de quem alterou)."""
+        agora = datetime.now(timezone.utc)
+        usuario_id = evento.get('usuario_id')
+        if evento['tipo'] == 'agendamento_criado':
+            for agendamento_id, data in evento['agendamentos']:
+                self._fila.put((agendamento_id, _como_data(data), None, 'Pendente', usuario_id, agora))
+        for agendamento_id, data, anterior, novo in evento.get('mudancas_status', ()):
+            if anterior != novo:
+                self._fila.put((agendamento_id, _como_data(data), anterior, novo, usuario_id, agora))
+
+    def _executar(self):
+        pendentes = []
+        prazo = None
+        while True:
+            espera = self.intervalo if prazo is None else max(0.0, prazo - time.monotonic())
+            try:
+                item = self._fila.get(timeout=espera)
+                if item is not None:
+                    pendentes.append(item)
+                    if prazo is None:
+                        prazo = time.monotonic() + self.intervalo
+            except queue.Empty:
+                pass
+
+            encerrar = self._parar.is_set()
+            vencido = prazo is not None and time.monotonic() >= prazo
+            if pendentes and (len(pendentes) >= self.tamanho_lote or vencido or encerrar):
+                try:
+                    db.criar_tabelas()
+                    with db.conexao() as conn:
+                        repositorio.inserir_historico_status(conn.cursor(), pendentes)
+                    pendentes = []
+                    prazo = None
+                except Exception:
+                    # Qualquer falha, não só do banco: a thread não pode morrer com eventos pendentes
+                    logger.exception("Erro ao gravar histórico de status; nova tentativa em seguida")
+                    if encerrar:
+                        return
+                    if len(pendentes) > MAXIMO_PENDENTES:
+                        logger.error("Descartando %d eventos antigos de histórico", len(pendentes) - MAXIMO_PENDENTES)
+                        pendentes = pendentes[-MAXIMO_PENDENTES:]
+                    prazo = time.monotonic() + self.intervalo
+
+            if encerrar and not pendentes and self._fila.empty():
+                return
+
+
+def iniciar_padrao():
+    """Inicia o escritor de histórico do processo (as tabelas são criadas na primeira gravação)."""
+    escritor = EscritorHistorico()
+    escritor.iniciar()
+    return escritor
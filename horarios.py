@@ -0,0 +1,124 @@
+"""Horários de funcionamento da barbearia: expediente por dia da semana, intervalo de
+almoço, feriados e duração de cada horário de atendimento.
+
+A configuração é compilada uma vez em modelos por dia da semana: a lista de horários
+do dia e uma máscara de bits (um bit por horário da grade). Validar um horário ou
+montar os horários de um dia vira uma consulta a dicionário/máscara, sem strptime nem
+busca em lista. A interface, a API e o caminho de gravação (db) usam todos as mesmas
+regras daqui.
+
+Uso:
+    horarios.horario_permitido("2025-06-10", "09:30")   # True/False
+    horarios.horarios_do_dia(date(2025, 6, 10))          # ["09:00", "09:30", ...]
+"""
+import os
+from datetime import date, datetime, timedelta
+
+# Duração de cada horário de atendimento, em minutos
+GRANULARIDADE_MINUTOS = 30
+
+# Expediente por dia da semana (0 = segunda): períodos (abertura, fechamento); o intervalo
+# entre dois períodos é o almoço. Lista vazia = fechado.
+EXPEDIENTE = {
+    0: [("09:00", "12:00"), ("14:00", "18:00")],
+    1: [("09:00", "12:00"), ("14:00", "18:00")],
+    2: [("09:00", "12:00"), ("14:00", "18:00")],
+    3: [("09:00", "12:00"), ("14:00", "18:00")],
+    4: [("09:00", "12:00"), ("14:00", "18:00")],
+    5: [("09:00", "12:00"), ("14:00", "18:00")],
+    6: [],
+}
+
+# Datas sem atendimento, ex.: BARBEARIA_FERIADOS="2025-12-25,2026-01-01"
+FERIADOS = {
+    date.fromisoformat(dia.strip())
+    for dia in os.environ.get("BARBEARIA_FERIADOS", "").split(",")
+    if dia.strip()
+}
+
+
+def _como_data(valor):
+    if isinstance(valor, str):
+        return date.fromisoformat(valor)
+    if isinstance(valor, datetime):
+        return valor.date()
+    return valor
+
+
+def _como_texto_hora(valor):
+    if isinstance(valor, str):
+        return valor[:5]
+    return valor.strftime("%H:%M")
+
+
+class GradeHorarios:
+    """Expediente compilado em modelos de horários por dia da semana."""
+
+    def __init__(self, expediente=EXPEDIENTE, granularidade=GRANULARIDADE_MINUTOS, feriados=FERIADOS):
+        self.granularidade = granularidade
+        self.feriados = frozenset(_como_data(dia) for dia in feriados)
+        passo = timedelta(minutes=granularidade)
+
+        por_dia = {}
+        for dia_semana in range(7):
+            horarios = []
+            for abertura, fechamento in expediente.get(dia_semana, []):
+                atual = datetime.strptime(abertura, "%H:%M")
+                fim = datetime.strptime(fechamento, "%H:%M")
+                # O último horário precisa terminar até o fechamento
+                while atual + passo <= fim:
+                    horarios.append(atual.strftime("%H:%M"))
+                    atual += passo
+            por_dia[dia_semana] = horarios
+
+        # Eixo comum a todos os dias (linhas da grade semanal e do mapa de ocupação)
+        self.horarios = tuple(sorted({hora for horarios in por_dia.values() for hora in horarios}))
+        self._indice = {hora: posicao for posicao, hora in enumerate(self.horarios)}
+        self._horarios_dia = {dia_semana: tuple(horarios) for dia_semana, horarios in por_dia.items()}
+        self._mascaras = {
+            dia_semana: sum(1 << self._indice[hora] for hora in horarios)
+            for dia_semana, horarios in por_dia.items()
+        }
+
+    def horario_valido(self, hora):
+        """Se a hora ("HH:MM" ou time) é um horário da grade em algum dia da semana."""
+        try:
+            return _como_texto_hora(hora) in self._indice
+        except (AttributeError, TypeError):
+            return False
+
+    def dia_aberto(self, data):
+        data = _como_data(data)
+        return self._mascaras[data.weekday()] != 0 and data not in self.feriados
+
+    def mascara(self, data):
+        """Máscara de bits dos horários de atendimento da data (bit i = self.horarios[i])."""
+        data = _como_data(data)
+        if data in self.feriados:
+            return 0
+        return self._mascaras[data.weekday()]
+
+    def horario_permitido(self, data, hora):
+        """Se há atendimento na data e hora informadas."""
+        try:
+            posicao = self._indice.get(_como_texto_hora(hora))
+            data = _como_data(data)
+        except (AttributeError, TypeError, ValueError):
+            return False
+        return posicao is not None and bool(self.mascara(data) >> posicao & 1)
+
+    def horarios_do_dia(self, data):
+        """Horários de atendimento ("HH:MM") da data, em ordem; vazio se fechado."""
+        data = _como_data(data)
+        if data in self.feriados:
+            return ()
+        return self._horarios_dia[data.weekday()]
+
+
+PADRAO = GradeHorarios()
+
+# Atalhos para a grade padrão
+horario_valido = PADRAO.horario_valido
+dia_aberto = PADRAO.dia_aberto
+horario_permitido = PADRAO.horario_permitido
+horarios_do_dia = PADRAO.horarios_do_dia
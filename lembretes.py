@@ -0,0 +1,409 @@
+"""Envio automático de lembretes de agendamento (ex.: 24h e 2h antes do horário).
+
+O agendador não consulta a tabela inteira periodicamente: carrega uma vez os
+agendamentos que vencem na janela próxima (consulta por faixa de datas, usando o
+índice de data/hora) num heap ordenado pelo momento de envio e o mantém atualizado
+com os eventos de agendamento e mudança de status publicados pelo módulo db. Os
+lembretes vencidos são enviados em lotes para um destino plugável e registrados em
+lembretes_enviados depois da entrega, garantindo envio pelo menos uma vez.
+
+Com vários workers, só um roda o agendador (ver lider.py) e ele acompanha os
+agendamentos feitos nos demais pelo tópico 'agendamentos' da coerência de cache
+(coerencia.py), relendo as datas avisadas. Agendamentos criados pela lista de espera
+(evento com origem 'lista_espera') geram, pelo mesmo destino, um aviso
+'vaga_lista_espera' ao cliente, enviado por AvisosListaEspera no worker onde a vaga
+foi preenchida.
+
+Uso:
+    agendador = AgendadorLembretes(DestinoArquivo("lembretes.jsonl"), coerencia=coerencia)
+    agendador.iniciar()
+"""
+import heapq
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import date, datetime, timedelta
+
+import psycopg2
+
+import db
+import repositorio
+
+# Tipo do lembrete -> antecedência em relação ao horário do agendamento
+ANTECEDENCIAS = {
+    '24h': timedelta(hours=24),
+    '2h': timedelta(hours=2),
+}
+
+# Máximo de lembretes por lote entregue ao destino
+TAMANHO_LOTE = 200
+
+# De quanto em quanto tempo a janela carregada em memória avança (nova consulta por faixa de datas)
+INTERVALO_JANELA = timedelta(hours=1)
+
+# Espera antes de tentar de novo quando o banco ou o destino falham
+ESPERA_APOS_ERRO = 10
+
+logger = logging.getLogger(__name__)
+
+
+class DestinoArquivo:
+    """Grava cada lembrete como uma linha JSON num arquivo local."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+
+    def enviar(self, lembretes):
+        with open(self.caminho, "a", encoding="utf-8") as arquivo:
+            for lembrete in lembretes:
+                arquivo.write(json.dumps(lembrete, ensure_ascii=False) + "\n")
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+
+
+class DestinoFila:
+    """Coloca os lembretes numa queue.Queue (útil para testes ou para outro consumidor)."""
+
+    def __init__(self, fila=None):
+        self.fila = fila if fila is not None else queue.Queue()
+
+    def enviar(self, lembretes):
+        for lembrete in lembretes:
+            self.fila.put(lembrete)
+
+
+def _como_data(valor):
+    if isinstance(valor, str):
+        return datetime.strptime(valor, "%Y-%m-%d").date()
+    return valor
+
+
+def _como_hora(valor):
+    if isinstance(valor, str):
+        return datetime.strptime(valor[:5], "%H:%M").time()
+    return valor
+
+
+class AgendadorLembretes:
+    """Mantém um heap de lembretes pendentes e os envia no momento certo.
+
+    O destino é qualquer objeto com um método `enviar(lembretes)` que recebe uma lista
+    de dicts; se ele levantar exceção o lote é reenviado mais tarde. Com `coerencia`
+    (coerencia.Coerencia), as mudanças chegam pelo tópico 'agendamentos', de todos os
+    workers; sem ela, só pelos eventos do db deste processo.
+    """
+
+    def __init__(self, destino, antecedencias=None, tamanho_lote=TAMANHO_LOTE, coerencia=None):
+        self.destino = destino
+        self.coerencia = coerencia
+        self.antecedencias = dict(antecedencias or ANTECEDENCIAS)
+        self.tamanho_lote = tamanho_lote
+        # (momento de envio, id do agendamento, tipo, versão)
+        self._heap = []
+        # id -> dados atuais do agendamento; a versão invalida entradas antigas do heap
+        self._agendamentos = {}
+        self._versao = 0
+        self._fim_janela = None
+        self._eventos = queue.Queue()
+        self._parar = threading.Event()
+        self._thread = None
+
+    # ------------------------------------------------------------ ciclo de vida
+
+    def iniciar(self):
+        """Começa a ouvir as mudanças de agendamentos e dispara a thread de envio."""
+        if self.coerencia is not None:
+            self.coerencia.registrar('agendamentos', self._datas_alteradas)
+        else:
+            db.registrar_ouvinte(self._eventos.put)
+        self._thread = threading.Thread(target=self._executar, name="lembretes", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        if self.coerencia is not None:
+            self.coerencia.remover('agendamentos', self._datas_alteradas)
+        else:
+            db.remover_ouvinte(self._eventos.put)
+        self._parar.set()
+        self._eventos.put(None)
+        if self._thread:
+            self._thread.join()
+
+    def _datas_alteradas(self, chaves):
+        """Invalidação da coerência: datas ("AAAA-MM-DD") com agendamentos alterados, ou None (todas)."""
+        self._eventos.put({'datas': chaves})
+
+    # ------------------------------------------------------------- laço principal
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                if self._fim_janela is None:
+                    db.criar_tabelas()
+                    # Recuperação após (re)início: tudo da janela que ainda não foi entregue
+                    self._carregar_periodo(date.today(), self._calcular_fim_janela(), recuperacao=True)
+                self._aguardar_e_processar_eventos()
+                self._avancar_janela()
+                self._enviar_vencidos()
+            except (psycopg2.Error, db.DatabaseError):
+                logger.exception("Erro de banco no envio de lembretes")
+                self._parar.wait(ESPERA_APOS_ERRO)
+            except Exception:
+                logger.exception("Erro no envio de lembretes")
+                self._parar.wait(ESPERA_APOS_ERRO)
+
+    def _calcular_fim_janela(self):
+        maior_antecedencia = max(self.antecedencias.values())
+        return (datetime.now() + maior_antecedencia + INTERVALO_JANELA).date()
+
+    def _aguardar_e_processar_eventos(self):
+        """Dorme até o próximo lembrete vencer ou chegar um evento, e processa os eventos em lote."""
+        espera = INTERVALO_JANELA.total_seconds()
+        if self._heap:
+            espera = min(espera, max(0.0, (self._heap[0][0] - datetime.now()).total_seconds()))
+
+        eventos = []
+        try:
+            eventos.append(self._eventos.get(timeout=espera))
+            while True:
+                eventos.append(self._eventos.get_nowait())
+        except queue.Empty:
+            pass
+
+        alterados = {}
+        datas = set()
+        for evento in eventos:
+            if evento is None:
+                continue
+            if 'datas' in evento:
+                # None (tópico inteiro) vira a janela inteira
+                datas = None if datas is None or evento['datas'] is None else datas | set(evento['datas'])
+                continue
+            for agendamento_id, data in evento['agendamentos']:
+                data = _como_data(data)
+                if data <= self._fim_janela:
+                    alterados[agendamento_id] = data
+        if alterados:
+            self._recarregar_agendamentos(alterados)
+        if datas is None or datas:
+            self._recarregar_datas(None if datas is None else {_como_data(data) for data in datas})
+
+    def _avancar_janela(self):
+        novo_fim = self._calcular_fim_janela()
+        if novo_fim > self._fim_janela:
+            self._carregar_periodo(self._fim_janela + timedelta(days=1), novo_fim)
+
+    # ------------------------------------------------------------- estado em memória
+
+    def _carregar_periodo(self, inicio, fim, recuperacao=False):
+        with db.conexao(leitura=True) as conn:
+            linhas = repositorio.agendamentos_para_lembrete(conn.cursor(), inicio, fim)
+        for linha in linhas:
+            self._agendar(*linha, recuperacao=recuperacao)
+        self._fim_janela = fim
+
+    def _recarregar_agendamentos(self, alterados):
+        """Relê do banco (pelos ids) os agendamentos afetados por eventos."""
+        with db.conexao() as conn:
+            linhas = repositorio.agendamentos_para_lembrete_por_ids(
+                conn.cursor(), alterados.keys(), set(alterados.values())
+            )
+        ativos = set()
+        for linha in linhas:
+            self._agendar(*linha)
+            ativos.add(linha[0])
+        # Cancelados (ou removidos) saem do mapa; suas entradas no heap ficam obsoletas
+        for agendamento_id in alterados.keys() - ativos:
+            self._agendamentos.pop(agendamento_id, None)
+
+    def _recarregar_datas(self, datas):
+        """Relê do banco os agendamentos das datas informadas (None = janela inteira)."""
+        inicio, fim = date.today(), self._fim_janela
+        if datas is not None:
+            datas = {data for data in datas if inicio <= data <= fim}
+            if not datas:
+                return
+            inicio, fim = min(datas), max(datas)
+        with db.conexao() as conn:
+            linhas = repositorio.agendamentos_para_lembrete(conn.cursor(), inicio, fim)
+        ativos = set()
+        for linha in linhas:
+            if datas is None or _como_data(linha[3]) in datas:
+                self._agendar(*linha)
+                ativos.add(linha[0])
+        for agendamento_id, agendamento in list(self._agendamentos.items()):
+            data = agendamento['momento'].date()
+            afetada = inicio <= data <= fim if datas is None else data in datas
+            if afetada and agendamento_id not in ativos:
+                del self._agendamentos[agendamento_id]
+
+    def _agendar(self, agendamento_id, nome, telefone, data, hora, tipos_enviados, recuperacao=False):
+        """Põe no heap os lembretes ainda não enviados do agendamento.
+
+        Lembretes cujo momento de envio já tinha passado quando o agendamento foi visto
+        pela primeira vez não são enviados (ex.: agendado 1h antes, não recebe os de 24h
+        e 2h). Na recuperação após um reinício, o mais recente dos vencidos ainda é
+        enviado, se não tiver sido entregue.
+        """
+        momento = datetime.combine(_como_data(data), _como_hora(hora))
+        envios = {tipo: momento - antecedencia for tipo, antecedencia in self.antecedencias.items()}
+        agora = datetime.now()
+        anterior = self._agendamentos.get(agendamento_id)
+        if anterior is not None:
+            # Releitura: os vencidos que já estavam na fila continuam nela
+            manter = anterior['tipos']
+        elif recuperacao:
+            manter = {tipo for _, tipo in sorted((envio, tipo) for tipo, envio in envios.items() if envio <= agora)[-1:]}
+        else:
+            manter = set()
+        envios = {
+            tipo: envio for tipo, envio in envios.items()
+            if tipo not in tipos_enviados and (envio > agora or tipo in manter)
+        }
+        self._versao += 1
+        self._agendamentos[agendamento_id] = {
+            'versao': self._versao,
+            'nome': nome,
+            'telefone': telefone,
+            'momento': momento,
+            'tipos': set(envios),
+        }
+        for tipo, envio in envios.items():
+            heapq.heappush(self._heap, (envio, agendamento_id, tipo, self._versao))
+
+    # ------------------------------------------------------------------- envio
+
+    def _enviar_vencidos(self):
+        agora = datetime.now()
+        while self._heap and self._heap[0][0] <= agora:
+            lote = []
+            while self._heap and self._heap[0][0] <= agora and len(lote) < self.tamanho_lote:
+                entrada = heapq.heappop(self._heap)
+                _, agendamento_id, tipo, versao = entrada
+                agendamento = self._agendamentos.get(agendamento_id)
+                if agendamento is None or agendamento['versao'] != versao:
+                    continue
+                # Lembrete atrasado (ex.: serviço parado) de horário que já passou não é mais útil
+                if agendamento['momento'] <= agora:
+                    continue
+                lote.append((entrada, agendamento))
+            if lote:
+                self._entregar(lote)
+
+    def _entregar(self, lote):
+        lembretes = [
+            {
+                'agendamento_id': entrada[1],
+                'tipo': entrada[2],
+                'cliente_nome': agendamento['nome'],
+                'cliente_telefone': agendamento['telefone'],
+                'horario': agendamento['momento'].strftime("%Y-%m-%d %H:%M"),
+            }
+            for entrada, agendamento in lote
+        ]
+        try:
+            self.destino.enviar(lembretes)
+            with db.conexao() as conn:
+                repositorio.registrar_lembretes_enviados(
+                    conn.cursor(),
+                    [lembrete['agendamento_id'] for lembrete in lembretes],
+                    [lembrete['tipo'] for lembrete in lembretes]
+                )
+        except Exception:
+            # Volta tudo para o heap: pode haver reenvio, mas nenhum lembrete se perde
+            for entrada, _ in lote:
+                heapq.heappush(self._heap, entrada)
+            raise
+
+
+class AvisosListaEspera:
+    """Avisa, pelo destino dos lembretes, os clientes da lista de espera que receberam uma vaga.
+
+    Ouve os eventos do db deste processo (a vaga é preenchida no worker que processou o
+    cancelamento), então roda em todos os workers. Avisos que o destino recusa ficam
+    pendentes e são tentados de novo.
+    """
+
+    def __init__(self, destino):
+        self.destino = destino
+        # id -> data dos agendamentos da lista de espera cujo aviso ainda não foi entregue
+        self._pendentes = {}
+        self._eventos = queue.Queue()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        db.registrar_ouvinte(self.registrar)
+        self._thread = threading.Thread(target=self._executar, name="avisos_lista_espera", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        db.remover_ouvinte(self.registrar)
+        self._parar.set()
+        self._eventos.put(None)
+        if self._thread:
+            self._thread.join()
+
+    def registrar(self, evento):
+        """Ouvinte do db: só enfileira os agendamentos criados pela lista de espera."""
+        if evento['tipo'] == 'agendamento_criado' and evento.get('origem') == 'lista_espera':
+            self._eventos.put(evento['agendamentos'])
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                agendamentos = self._eventos.get(timeout=ESPERA_APOS_ERRO if self._pendentes else None)
+            except queue.Empty:
+                agendamentos = ()
+            for agendamento_id, data in agendamentos or ():
+                self._pendentes[agendamento_id] = _como_data(data)
+            try:
+                self._avisar()
+            except Exception:
+                logger.exception("Erro ao avisar clientes da lista de espera")
+
+    def _avisar(self):
+        if not self._pendentes:
+            return
+        with db.conexao() as conn:
+            linhas = repositorio.agendamentos_para_lembrete_por_ids(
+                conn.cursor(), self._pendentes.keys(), set(self._pendentes.values())
+            )
+        avisos = [
+            {
+                'agendamento_id': agendamento_id,
+                'tipo': 'vaga_lista_espera',
+                'cliente_nome': nome,
+                'cliente_telefone': telefone,
+                'horario': datetime.combine(_como_data(data), _como_hora(hora)).strftime("%Y-%m-%d %H:%M"),
+            }
+            for agendamento_id, nome, telefone, data, hora, _ in linhas
+        ]
+        if avisos:
+            self.destino.enviar(avisos)
+        self._pendentes.clear()
+
+
+def _destino_padrao():
+    return DestinoArquivo(os.environ.get("BARBEARIA_LEMBRETES_ARQUIVO", "lembretes.jsonl"))
+
+
+def iniciar_padrao(coerencia=None):
+    """Inicia o agendador gravando em BARBEARIA_LEMBRETES_ARQUIVO (padrão: lembretes.jsonl).
+
+    Com vários workers, deve rodar em um só (ver lider.py) e receber a `coerencia` do
+    processo, para enxergar os agendamentos feitos nos outros. Não exige o banco no ar:
+    a carga inicial (e a criação das tabelas) é refeita até conseguir.
+    """
+    agendador = AgendadorLembretes(_destino_padrao(), coerencia=coerencia)
+    agendador.iniciar()
+    return agendador
+
+
+def iniciar_avisos_padrao():
+    """Inicia os avisos da lista de espera deste worker, no mesmo arquivo dos lembretes."""
+    avisos = AvisosListaEspera(_destino_padrao())
+    avisos.iniciar()
+    return avisos
@@ -0,0 +1,148 @@
+"""Serviços que rodam em um único worker por implantação (ex.: envio de lembretes).
+
+Com vários processos do servidor, tarefas como o agendador de lembretes não podem
+rodar em todos: cada lembrete sairia uma vez por worker. Cada uma dessas tarefas tem
+uma chave de pg_advisory_lock; todos os workers tentam pegá-la numa conexão dedicada
+e só quem consegue inicia o serviço. Se o líder morre ou perde a conexão, o PostgreSQL
+solta a trava e outro worker assume na próxima tentativa. TravasMemoria faz o papel do
+PostgreSQL dentro de um único processo, para testes.
+
+Uso:
+    lideranca = Lideranca(TravaPostgres(TRAVA_LEMBRETES), lembretes.iniciar_padrao, "lembretes")
+    lideranca.iniciar()
+"""
+import logging
+import threading
+
+import psycopg2
+
+import db
+
+# Chave de pg_advisory_lock do agendador de lembretes (diferente de db.TRAVA_ESQUEMA)
+TRAVA_LEMBRETES = 4_201_734
+
+# Intervalo (segundos) entre tentativas de assumir a trava e conferências de que ela continua nossa
+INTERVALO_TENTATIVA = 10
+
+logger = logging.getLogger(__name__)
+
+
+class TravaPostgres:
+    """pg_try_advisory_lock numa conexão própria: a trava vale enquanto a conexão viver."""
+
+    def __init__(self, chave):
+        self.chave = chave
+        self._conn = None
+
+    def tentar(self):
+        """Diz se a trava é (ou continua) deste worker."""
+        if self._conn is not None:
+            try:
+                self._conn.cursor().execute("SELECT 1")
+                return True
+            except psycopg2.Error:
+                # Conexão perdida: a trava já foi solta no servidor
+                self.soltar()
+                return False
+        conn = db.conectar()
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (self.chave,))
+            if cursor.fetchone()[0]:
+                self._conn, conn = conn, None
+                return True
+            return False
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def soltar(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class TravasMemoria:
+    """Travas dentro do processo: cada `trava(chave)` faz o papel da conexão de um worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._donos = {}
+
+    def trava(self, chave):
+        return _TravaMemoria(self, chave)
+
+
+class _TravaMemoria:
+    def __init__(self, travas, chave):
+        self.travas = travas
+        self.chave = chave
+
+    def tentar(self):
+        with self.travas._lock:
+            if self.travas._donos.get(self.chave, self) is not self:
+                return False
+            self.travas._donos[self.chave] = self
+            return True
+
+    def soltar(self):
+        with self.travas._lock:
+            if self.travas._donos.get(self.chave) is self:
+                del self.travas._donos[self.chave]
+
+
+class Lideranca:
+    """Roda o serviço criado por `iniciar_servico()` só enquanto este worker tiver a trava.
+
+    `iniciar_servico` retorna um objeto com `parar()`, chamado se a trava for perdida.
+    """
+
+    def __init__(self, trava, iniciar_servico, nome="serviço", intervalo=INTERVALO_TENTATIVA):
+        self.trava = trava
+        self.iniciar_servico = iniciar_servico
+        self.nome = nome
+        self.intervalo = intervalo
+        self.servico = None
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._executar, name="lideranca", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread:
+            self._thread.join()
+
+    def verificar(self):
+        """Uma rodada: assume o serviço se pegou a trava, ou o para se a perdeu."""
+        try:
+            lider = self.trava.tentar()
+        except (psycopg2.Error, db.DatabaseError):
+            logger.exception("Erro ao verificar a liderança")
+            lider = False
+        if lider and self.servico is None:
+            logger.info("Este worker assumiu: %s", self.nome)
+            self.servico = self.iniciar_servico()
+        elif not lider and self.servico is not None:
+            logger.warning("Liderança perdida; parando: %s", self.nome)
+            self.servico.parar()
+            self.servico = None
+
+    def _executar(self):
+        while not self._parar.is_set():
+            self.verificar()
+            self._parar.wait(self.intervalo)
+        if self.servico is not None:
+            self.servico.parar()
+            self.servico = None
+        self.trava.soltar()
+
+
+def iniciar_padrao(chave, iniciar_servico, nome="serviço"):
+    """Disputa a trava `chave` no PostgreSQL e roda o serviço no worker que a pegar."""
+    lideranca = Lideranca(TravaPostgres(chave), iniciar_servico, nome)
+    lideranca.iniciar()
+    return lideranca
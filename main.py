@@ -1,19 +1,43 @@
+import threading
+import time
 import flet as ft
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import db
 import auth
+import lembretes
+import api
+import historico
+import estatisticas
+import fila_local
+import horarios
+import coerencia
+import lider
 from utils import (
     STATUS_CORES, 
     HORARIOS_DISPONIVEIS,
     criar_mensagem_erro, 
     criar_mensagem_sucesso, 
     validar_data, 
-    validar_hora,
     formatar_telefone
 )
 
+# Por quanto tempo (segundos) uma semana carregada na grade é reaproveitada sem nova consulta
+CACHE_GRADE_SEGUNDOS = 30
+
+# Chave do token de sessão do barbeiro no armazenamento do navegador
+CHAVE_SESSAO = "barbearia.sessao"
+
+DIAS_SEMANA = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
+
+# Faixas de horário oferecidas para a lista de espera: chave -> (texto, primeiro e último horário)
+FAIXAS_LISTA_ESPERA = {
+    "dia": ("Qualquer horário", HORARIOS_DISPONIVEIS[0], HORARIOS_DISPONIVEIS[-1]),
+    "manha": ("Manhã", HORARIOS_DISPONIVEIS[0], max(h for h in HORARIOS_DISPONIVEIS if h < "12:00")),
+    "tarde": ("Tarde", min(h for h in HORARIOS_DISPONIVEIS if h >= "12:00"), HORARIOS_DISPONIVEIS[-1]),
+}
+
 class BarbeariaApp:
-    def __init__(self, page: ft.Page):
+    def __init__(self, page: ft.Page, fila=None, coerencia=None):
         self.page = page
         self.page.title = "Barbearia - Sistema de Agendamento"
         self.page.theme_mode = ft.ThemeMode.LIGHT
@@ -22,12 +46,30 @@ class BarbeariaApp:
         self.page.scroll = ft.ScrollMode.AUTO
         self.page.padding = 20
         
-        # Inicializar banco de dados e tabelas
-        db.criar_tabelas()
-        auth.criar_tabela_usuarios()
+        # Fila local (write-behind) usada nos agendamentos quando o banco cai; None = só o banco
+        self.fila = fila
+        # Agendamento, horários e serviços passam pela fila quando ela está ativa
+        self.agenda = fila or db
+        
+        # Com vários workers, os caches deste processo são invalidados pelos demais
+        self.coerencia = coerencia
+        if coerencia:
+            self.agenda = coerencia.agenda(self.agenda)
+            coerencia.registrar('agendamentos', self.invalidar_cache_grade)
+            coerencia.registrar('usuarios', self.atualizar_barbeiro_atual)
+            coerencia.registrar('sessoes', self.verificar_sessao_revogada)
+            self.page.on_close = self.encerrar_sessao
         
         # Estado do usuário
         self.barbeiro_atual = None
+        # Filtro da lista do barbeiro (valores dos dropdowns "Filtrar por data" e "Status")
+        self.filtro_data, self.filtro_status = "hoje", "todos"
+        # Garante que esta sessão leia as próprias escritas mesmo quando as leituras vão para a réplica
+        self.sessao_db = db.SessaoDados()
+        
+        # Semanas já carregadas na grade do barbeiro: início da semana -> (instante, células)
+        self.cache_grade = {}
+        self.cache_grade_lock = threading.Lock()
         
         # Componentes de login do barbeiro
         self.email_login = ft.TextField(
@@ -57,16 +99,16 @@ class BarbeariaApp:
             expand=True,
             options=[
                 ft.dropdown.Option(key=str(s.id), text=str(s))
-                for s in db.listar_servicos()
+                for s in self.agenda.listar_servicos(sessao=self.sessao_db)
             ]
         )
         
-        # Gerar próximos 30 dias disponíveis (exceto domingos)
+        # Gerar próximos 30 dias disponíveis (só dias com atendimento)
         dias_disponiveis = []
         data_atual = datetime.now()
         for i in range(30):
             data = data_atual + timedelta(days=i)
-            if data.weekday() < 6:  # Segunda a Sábado
+            if horarios.dia_aberto(data):
                 dias_disponiveis.append(
                     ft.dropdown.Option(data.strftime("%Y-%m-%d"))
                 )
@@ -84,6 +126,32 @@ class BarbeariaApp:
             expand=True
         )
         
+        # Repetição do agendamento (séries recorrentes)
+        self.repeticao_dropdown = ft.Dropdown(
+            label="Repetir",
+            options=[ft.dropdown.Option("nao", "Não repetir")] + [
+                ft.dropdown.Option(frequencia, frequencia.capitalize())
+                for frequencia in db.FREQUENCIAS_SERIE
+            ],
+            value="nao",
+            expand=True
+        )
+        self.repetir_ate = ft.TextField(
+            label="Repetir até (AAAA-MM-DD)",
+            expand=True
+        )
+        
+        # Faixa de horário aceita quando o cliente entra na lista de espera
+        self.faixa_espera = ft.Dropdown(
+            label="Lista de espera",
+            options=[
+                ft.dropdown.Option(chave, texto)
+                for chave, (texto, _, _) in FAIXAS_LISTA_ESPERA.items()
+            ],
+            value="dia",
+            expand=True
+        )
+        
         # Campos do formulário de registro de barbeiro
         self.registro_nome = ft.TextField(label="Nome", expand=True)
         self.registro_email = ft.TextField(label="Email", expand=True)
@@ -93,6 +161,9 @@ class BarbeariaApp:
         # Container para mensagens
         self.mensagem_container = ft.Container(visible=False)
         
+        # Cards da lista do barbeiro por id de agendamento (atualização parcial e ações em lote)
+        self.cards_agendamento = {}
+        
         # Mostrar tela inicial de agendamento
         self.mostrar_tela_agendamento()
     
@@ -125,7 +196,7 @@ class BarbeariaApp:
         # Link para área administrativa
         link_admin = ft.TextButton(
             "Área do Barbeiro",
-            on_click=lambda _: self.mostrar_tela_login()
+            on_click=self.abrir_area_barbeiro
         )
         
         # Formulário de agendamento
@@ -140,12 +211,24 @@ class BarbeariaApp:
                         self.dias_disponiveis,
                         self.horarios_disponiveis
                     ], spacing=10),
+                    ft.Row([
+                        self.repeticao_dropdown,
+                        self.repetir_ate
+                    ], spacing=10),
                     self.mensagem_container,
-                    ft.ElevatedButton(
-                        "Agendar",
-                        icon=ft.icons.CALENDAR_TODAY,
-                        on_click=self.fazer_agendamento
-                    )
+                    ft.Row([
+                        ft.ElevatedButton(
+                            "Agendar",
+                            icon=ft.icons.CALENDAR_TODAY,
+                            on_click=self.fazer_agendamento
+                        ),
+                        self.faixa_espera,
+                        ft.OutlinedButton(
+                            "Entrar na lista de espera",
+                            icon=ft.icons.HOURGLASS_EMPTY,
+                            on_click=self.entrar_lista_espera
+                        )
+                    ], spacing=10, wrap=True)
                 ], spacing=20),
                 padding=20
             )
@@ -160,6 +243,19 @@ class BarbeariaApp:
             ], spacing=20)
         )
     
+    def abrir_area_barbeiro(self, e=None):
+        """Vai direto para a área do barbeiro se o navegador tiver uma sessão válida."""
+        if not self.barbeiro_atual:
+            token = self.page.client_storage.get(CHAVE_SESSAO)
+            if token:
+                self.barbeiro_atual = auth.validar_sessao(token)
+                if not self.barbeiro_atual:
+                    self.page.client_storage.remove(CHAVE_SESSAO)
+        if self.barbeiro_atual:
+            self.mostrar_tela_barbeiro()
+        else:
+            self.mostrar_tela_login()
+    
     def mostrar_tela_login(self):
         """Mostra a tela de login para o barbeiro."""
         # Limpa mensagens antigas
@@ -257,6 +353,8 @@ class BarbeariaApp:
         barbeiro = auth.validar_login(email, senha)
         if barbeiro:
             self.barbeiro_atual = barbeiro
+            # Novas abas e recargas da página retomam a sessão sem repetir o bcrypt
+            self.page.client_storage.set(CHAVE_SESSAO, auth.criar_sessao(barbeiro))
             # Mostra notificação de login apenas na área administrativa, uma vez
             self.mensagem_login_admin = True
             self.mostrar_tela_barbeiro()
@@ -297,6 +395,7 @@ class BarbeariaApp:
             title=ft.Text(f"Área do Barbeiro - {self.barbeiro_atual['nome']}"),
             center_title=False,
             actions=[
+                ft.IconButton(ft.icons.LINK, tooltip="Links da agenda", on_click=self.mostrar_links_agenda),
                 ft.IconButton(ft.icons.LOGOUT, on_click=self.fazer_logout)
             ],
         )
@@ -329,6 +428,8 @@ class BarbeariaApp:
             )
         )
         self.lista_agendamentos = ft.Column(spacing=10)
+        # Os dropdowns acima começam em "hoje" e "todos"
+        self.filtro_data, self.filtro_status = "hoje", "todos"
         self.carregar_agendamentos()
         card_agendamentos = ft.Card(
             content=ft.Container(
@@ -341,12 +442,50 @@ class BarbeariaApp:
                             on_click=lambda _: self.carregar_agendamentos()
                         )
                     ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+                    ft.Row([
+                        ft.OutlinedButton(
+                            "Confirmar pendentes de hoje",
+                            icon=ft.icons.DONE_ALL,
+                            on_click=self.confirmar_pendentes_de_hoje
+                        ),
+                        ft.OutlinedButton(
+                            "Confirmar selecionados",
+                            icon=ft.icons.CHECK,
+                            on_click=lambda _: self.alterar_status_selecionados("Confirmado")
+                        ),
+                        ft.OutlinedButton(
+                            "Cancelar selecionados",
+                            icon=ft.icons.CLOSE,
+                            on_click=lambda _: self.alterar_status_selecionados("Cancelado")
+                        )
+                    ], wrap=True),
+                    self.mensagem_container,
                     self.lista_agendamentos
                 ]),
                 padding=20
             )
         )
-        conteudo = [filtros, card_agendamentos]
+        card_semana = self.criar_card_semana()
+        card_semana.visible = False
+        card_ocupacao = self.criar_card_ocupacao()
+        card_ocupacao.visible = False
+        
+        def alternar_visao(visao):
+            filtros.visible = card_agendamentos.visible = visao == "lista"
+            card_semana.visible = visao == "semana"
+            card_ocupacao.visible = visao == "ocupacao"
+            if card_semana.visible:
+                self.carregar_grade_semana()
+            if card_ocupacao.visible:
+                self.carregar_mapa_ocupacao()
+            self.page.update()
+        
+        seletor_visao = ft.Row([
+            ft.TextButton("Lista", icon=ft.icons.VIEW_LIST, on_click=lambda _: alternar_visao("lista")),
+            ft.TextButton("Semana", icon=ft.icons.CALENDAR_VIEW_WEEK, on_click=lambda _: alternar_visao("semana")),
+            ft.TextButton("Ocupação", icon=ft.icons.GRID_ON, on_click=lambda _: alternar_visao("ocupacao"))
+        ])
+        conteudo = [seletor_visao, filtros, card_agendamentos, card_semana, card_ocupacao]
         # Mostra notificação de login apenas uma vez e por 2 segundos
         if hasattr(self, 'mensagem_login_admin') and self.mensagem_login_admin:
             self.mensagem_login_admin = False
@@ -368,8 +507,46 @@ class BarbeariaApp:
             ft.Column(conteudo, spacing=20)
         )
     
+    def mostrar_links_agenda(self, e=None, renovar=False):
+        """Mostra os links de assinatura da agenda (.ics/.csv) com o token secreto do barbeiro."""
+        try:
+            barbeiro_id = self.barbeiro_atual['id']
+            token = auth.renovar_token_feed(barbeiro_id) if renovar else auth.token_feed(barbeiro_id)
+        except Exception as erro:
+            self.mostrar_mensagem(f"Erro ao gerar os links da agenda: {str(erro)}")
+            return
+        links = [
+            ("Minha agenda (calendário)", api.url_feed("ics", token, barbeiro_id)),
+            ("Minha agenda (planilha)", api.url_feed("csv", token, barbeiro_id)),
+            ("Agenda da barbearia (calendário)", api.url_feed("ics", token)),
+        ]
+        
+        def fechar(_):
+            self.page.dialog.open = False
+            self.page.update()
+        
+        self.page.dialog = ft.AlertDialog(
+            title=ft.Text("Links da agenda"),
+            content=ft.Column(
+                [ft.Text("Quem tiver estes links vê nomes e telefones dos clientes; não compartilhe.", italic=True)]
+                + [ft.TextField(label=rotulo, value=url, read_only=True) for rotulo, url in links],
+                tight=True,
+                width=600
+            ),
+            actions=[
+                ft.TextButton("Gerar novos links", on_click=lambda _: self.mostrar_links_agenda(renovar=True)),
+                ft.TextButton("Fechar", on_click=fechar),
+            ],
+            open=True
+        )
+        self.page.update()
+    
     def fazer_logout(self, e):
         """Realiza o logout do barbeiro."""
+        token = self.page.client_storage.get(CHAVE_SESSAO)
+        if token:
+            auth.revogar_sessao(token)
+            self.page.client_storage.remove(CHAVE_SESSAO)
         self.barbeiro_atual = None
         self.mostrar_tela_agendamento()
     
@@ -412,24 +589,54 @@ class BarbeariaApp:
             self.mostrar_mensagem("Selecione um horário")
             return
         
-        # Validar horário comercial
-        if not validar_hora(hora):
+        # Validar horário comercial (expediente do dia)
+        if not horarios.horario_permitido(data, hora):
             self.mostrar_mensagem("Horário inválido ou fora do horário comercial")
             return
         
+        repeticao = self.repeticao_dropdown.value
+        if repeticao and repeticao != "nao" and not validar_data(self.repetir_ate.value):
+            self.mostrar_mensagem("Informe até quando repetir (AAAA-MM-DD)")
+            return
+        
         try:
-            # Tenta adicionar o agendamento no banco
-            # Converte servico_id para inteiro já que vem como string do dropdown
-            db.adicionar_agendamento(
-                nome.strip(),  # Remove espaços extras
-                telefone,
-                int(servico_id),  # Convertendo para inteiro
-                data,
-                hora
-            )
+            if repeticao and repeticao != "nao":
+                # Série recorrente: todas as datas são verificadas e gravadas de uma vez
+                resultado = db.criar_serie(
+                    nome.strip(),
+                    telefone,
+                    int(servico_id),
+                    data,
+                    self.repetir_ate.value,
+                    hora,
+                    repeticao,
+                    sessao=self.sessao_db
+                )
+                ocupadas = ", ".join(d.strftime("%d/%m") for d, _ in resultado['conflitos'])
+                if not resultado['serie_id']:
+                    self.mostrar_mensagem(f"Nenhuma data livre nesse horário. Indisponível em: {ocupadas}")
+                    return
+                mensagem = f"Série criada com {len(resultado['agendados'])} agendamentos!"
+                if ocupadas:
+                    mensagem += f" Indisponível em: {ocupadas}"
+            else:
+                # Tenta adicionar o agendamento no banco
+                # Converte servico_id para inteiro já que vem como string do dropdown
+                agendamento_id = self.agenda.adicionar_agendamento(
+                    nome.strip(),  # Remove espaços extras
+                    telefone,
+                    int(servico_id),  # Convertendo para inteiro
+                    data,
+                    hora,
+                    sessao=self.sessao_db
+                )
+                if fila_local.eh_local(agendamento_id):
+                    mensagem = "Agendamento recebido! Ele será registrado assim que o sistema normalizar."
+                else:
+                    mensagem = "Agendamento realizado com sucesso!"
             
             # Se chegou aqui, deu tudo certo
-            self.mostrar_mensagem("Agendamento realizado com sucesso!", tipo="sucesso")
+            self.mostrar_mensagem(mensagem, tipo="sucesso")
             
             # Limpar campos após sucesso
             self.nome_cliente.value = ""
@@ -437,18 +644,38 @@ class BarbeariaApp:
             self.servicos_dropdown.value = None
             self.dias_disponiveis.value = None
             self.horarios_disponiveis.value = None
+            self.repeticao_dropdown.value = "nao"
+            self.repetir_ate.value = ""
             self.page.update()
         except db.DatabaseError as erro:
             self.mostrar_mensagem(str(erro))
         except Exception as erro:
             self.mostrar_mensagem(f"Erro ao realizar agendamento: {str(erro)}")
     
+    def periodo_do_filtro(self):
+        """(início, fim) do filtro de data da lista; (None, None) para todos os dias."""
+        hoje = datetime.now().date()
+        if self.filtro_data == "hoje":
+            return hoje, hoje
+        if self.filtro_data == "semana":
+            inicio_semana = hoje - timedelta(days=hoje.weekday())
+            return inicio_semana, inicio_semana + timedelta(days=6)
+        return None, None
+    
     def carregar_agendamentos(self, e=None):
-        """Carrega todos os agendamentos para visualização do barbeiro."""
+        """Carrega os agendamentos do filtro atual (data e status) para visualização do barbeiro."""
         self.lista_agendamentos.controls.clear()
+        self.cards_agendamento = {}
         
         try:
-            agendamentos = db.listar_agendamentos()
+            # O período do filtro vai para o banco, que só lê as partições necessárias
+            data_inicio, data_fim = self.periodo_do_filtro()
+            agendamentos = db.listar_agendamentos(
+                data_inicio,
+                data_fim,
+                status=None if self.filtro_status == "todos" else self.filtro_status,
+                sessao=self.sessao_db
+            )
             
             if not agendamentos:
                 self.lista_agendamentos.controls.append(
@@ -466,60 +693,93 @@ class BarbeariaApp:
     
     def filtrar_agendamentos(self, e):
         """Filtra os agendamentos por data e status de forma combinada, usando a data do agendamento."""
-        filtro_data = None
-        filtro_status = None
         for control in e.control.parent.controls:
             if isinstance(control, ft.Dropdown):
                 if control.label == "Filtrar por data":
-                    filtro_data = control.value
+                    self.filtro_data = control.value or "todos"
                 elif control.label == "Status":
-                    filtro_status = control.value
-        agendamentos = db.listar_agendamentos()
-        # Função para obter a data do agendamento como objeto date
-        def get_data_agendamento(a):
-            d = getattr(a, 'data', None)
-            if isinstance(d, datetime):
-                return d.date()
-            elif isinstance(d, str):
-                try:
-                    return datetime.strptime(d, "%Y-%m-%d").date()
-                except Exception:
-                    return None
-            return d
-        # Filtrar por data
-        if filtro_data and filtro_data != "todos":
-            hoje = datetime.now().date()
-            if filtro_data == "hoje":
-                agendamentos = [a for a in agendamentos if get_data_agendamento(a) == hoje]
-            elif filtro_data == "semana":
-                inicio_semana = hoje - timedelta(days=hoje.weekday())
-                fim_semana = inicio_semana + timedelta(days=6)
-                agendamentos = [a for a in agendamentos if get_data_agendamento(a) and inicio_semana <= get_data_agendamento(a) <= fim_semana]
-        # Filtrar por status
-        if filtro_status and filtro_status != "todos":
-            agendamentos = [a for a in agendamentos if a.status == filtro_status]
-        self.lista_agendamentos.controls.clear()
-        if not agendamentos:
-            self.lista_agendamentos.controls.append(
-                ft.Text("Nenhum agendamento encontrado", italic=True)
-            )
-        else:
-            for agendamento in agendamentos:
-                self.lista_agendamentos.controls.append(
-                    self.criar_card_agendamento(agendamento)
-                )
-        self.page.update()
+                    self.filtro_status = control.value or "todos"
+        self.carregar_agendamentos()
     
     def criar_card_agendamento(self, agendamento):
         """Cria um card para exibir um agendamento."""
         def atualizar_status(e):
             try:
-                db.atualizar_status(agendamento.id, e.control.value)
-                self.carregar_agendamentos()
+                preenchidos = db.atualizar_status(
+                    agendamento.id,
+                    e.control.value,
+                    sessao=self.sessao_db,
+                    usuario_id=self.barbeiro_atual['id'] if self.barbeiro_atual else None
+                )
+                self.limpar_cache_grade()
+                if preenchidos:
+                    # A vaga foi para a lista de espera: o novo agendamento precisa aparecer na lista
+                    self.carregar_agendamentos()
+                    self.mostrar_mensagem("Vaga preenchida por um cliente da lista de espera", tipo="sucesso")
+                else:
+                    self.aplicar_status_nos_cards([agendamento.id], e.control.value)
             except Exception as erro:
                 self.mostrar_mensagem(f"Erro ao atualizar status: {str(erro)}")
         
-        return ft.Card(
+        def cancelar_serie(e):
+            try:
+                db.cancelar_serie(
+                    agendamento.serie_id,
+                    agendamento.data,
+                    sessao=self.sessao_db,
+                    usuario_id=self.barbeiro_atual['id'] if self.barbeiro_atual else None
+                )
+                self.limpar_cache_grade()
+                self.carregar_agendamentos()
+            except Exception as erro:
+                self.mostrar_mensagem(f"Erro ao cancelar série: {str(erro)}")
+        
+        def mover_serie(e):
+            try:
+                resultado = db.alterar_hora_serie(
+                    agendamento.serie_id,
+                    e.control.value,
+                    agendamento.data,
+                    sessao=self.sessao_db
+                )
+                self.limpar_cache_grade()
+                self.carregar_agendamentos()
+                mensagem = f"{resultado['alterados']} agendamento(s) da série movido(s) para {e.control.value}."
+                if resultado['conflitos']:
+                    mensagem += " Mantidos no horário antigo: " + ", ".join(
+                        f"{data.strftime('%d/%m')} ({motivo})" for data, motivo in resultado['conflitos']
+                    )
+                self.mostrar_mensagem(mensagem, tipo="sucesso")
+            except Exception as erro:
+                self.mostrar_mensagem(f"Erro ao alterar série: {str(erro)}")
+        
+        acoes = [ft.Text("Status:")]
+        if agendamento.serie_id:
+            acoes[:0] = [
+                ft.TextButton(
+                    "Cancelar série a partir desta data",
+                    icon=ft.icons.EVENT_REPEAT,
+                    on_click=cancelar_serie
+                ),
+                ft.Dropdown(
+                    label="Mover série para",
+                    options=[ft.dropdown.Option(hora) for hora in HORARIOS_DISPONIVEIS],
+                    width=170,
+                    on_change=mover_serie
+                ),
+            ]
+        
+        selecao = ft.Checkbox(tooltip="Selecionar para ação em lote")
+        seletor_status = ft.Dropdown(
+            value=agendamento.status,
+            options=[
+                ft.dropdown.Option(status)
+                for status in ["Pendente", "Confirmado", "Cancelado"]
+            ],
+            on_change=atualizar_status
+        )
+        
+        card = ft.Card(
             content=ft.Container(
                 content=ft.Column([
                     ft.ListTile(
@@ -528,7 +788,8 @@ class BarbeariaApp:
                             agendamento.cliente.nome,
                             weight=ft.FontWeight.BOLD
                         ),
-                        subtitle=ft.Text(f"Tel: {formatar_telefone(agendamento.cliente.telefone)}")
+                        subtitle=ft.Text(f"Tel: {formatar_telefone(agendamento.cliente.telefone)}"),
+                        trailing=selecao
                     ),
                     ft.ListTile(
                         leading=ft.Icon(ft.icons.CALENDAR_TODAY),
@@ -539,30 +800,371 @@ class BarbeariaApp:
                         leading=ft.Icon(ft.icons.BUSINESS_CENTER),
                         title=ft.Text(f"Serviço: {agendamento.servico}")
                     ),
-                    ft.Row([
-                        ft.Text("Status:"),
-                        ft.Dropdown(
-                            value=agendamento.status,
-                            options=[
-                                ft.dropdown.Option(status)
-                                for status in ["Pendente", "Confirmado", "Cancelado"]
-                            ],
-                            on_change=atualizar_status
-                        )
-                    ], alignment=ft.MainAxisAlignment.END)
+                    ft.Row(acoes + [seletor_status], alignment=ft.MainAxisAlignment.END)
                 ]),
                 padding=10
             ),
             color=STATUS_CORES.get(agendamento.status)
         )
+        self.cards_agendamento[agendamento.id] = {
+            'agendamento': agendamento,
+            'card': card,
+            'selecao': selecao,
+            'status': seletor_status,
+        }
+        return card
+    
+    def aplicar_status_nos_cards(self, agendamento_ids, novo_status):
+        """Atualiza só os cards afetados (cor, status, seleção), sem recarregar a lista."""
+        for agendamento_id in agendamento_ids:
+            item = self.cards_agendamento.get(agendamento_id)
+            if not item:
+                continue
+            item['agendamento'].status = novo_status
+            item['status'].value = novo_status
+            item['selecao'].value = False
+            item['card'].color = STATUS_CORES.get(novo_status)
+        self.page.update()
+    
+    def alterar_status_selecionados(self, novo_status):
+        """Aplica o status a todos os cards marcados, num único UPDATE."""
+        selecionados = [
+            agendamento_id
+            for agendamento_id, item in self.cards_agendamento.items()
+            if item['selecao'].value
+        ]
+        if not selecionados:
+            self.mostrar_mensagem("Selecione ao menos um agendamento")
+            return
+        try:
+            alterados, preenchidos = db.atualizar_status_em_lote(
+                selecionados,
+                novo_status,
+                sessao=self.sessao_db,
+                usuario_id=self.barbeiro_atual['id'] if self.barbeiro_atual else None
+            )
+            self.limpar_cache_grade()
+            mensagem = f"{len(alterados)} agendamento(s) alterado(s) para {novo_status}"
+            if preenchidos:
+                self.carregar_agendamentos()
+                mensagem += f"; {len(preenchidos)} vaga(s) preenchida(s) pela lista de espera"
+            else:
+                self.aplicar_status_nos_cards(selecionados, novo_status)
+            self.mostrar_mensagem(mensagem, tipo="sucesso")
+        except Exception as erro:
+            self.mostrar_mensagem(f"Erro ao atualizar status: {str(erro)}")
+    
+    def confirmar_pendentes_de_hoje(self, e=None):
+        """Confirma de uma vez todos os agendamentos pendentes de hoje."""
+        try:
+            alterados, _ = db.atualizar_status_do_dia(
+                datetime.now().date(),
+                "Pendente",
+                "Confirmado",
+                sessao=self.sessao_db,
+                usuario_id=self.barbeiro_atual['id'] if self.barbeiro_atual else None
+            )
+            self.limpar_cache_grade()
+            self.aplicar_status_nos_cards(list(alterados), "Confirmado")
+            self.mostrar_mensagem(f"{len(alterados)} agendamento(s) de hoje confirmado(s)", tipo="sucesso")
+        except Exception as erro:
+            self.mostrar_mensagem(f"Erro ao confirmar agendamentos: {str(erro)}")
+
+    def criar_card_semana(self):
+        """Cria o card da grade semanal (dias x horários) da área do barbeiro."""
+        hoje = datetime.now().date()
+        self.inicio_semana_grade = hoje - timedelta(days=hoje.weekday())
+        self.titulo_semana = ft.Text(size=16, weight=ft.FontWeight.BOLD)
+        self.grade_semana = ft.Column(spacing=2)
+        return ft.Card(
+            content=ft.Container(
+                content=ft.Column([
+                    ft.Row([
+                        ft.IconButton(
+                            icon=ft.icons.CHEVRON_LEFT,
+                            tooltip="Semana anterior",
+                            on_click=lambda _: self.mudar_semana(-7)
+                        ),
+                        self.titulo_semana,
+                        ft.IconButton(
+                            icon=ft.icons.CHEVRON_RIGHT,
+                            tooltip="Próxima semana",
+                            on_click=lambda _: self.mudar_semana(7)
+                        )
+                    ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+                    ft.Row([self.grade_semana], scroll=ft.ScrollMode.AUTO)
+                ]),
+                padding=20
+            )
+        )
+    
+    def mudar_semana(self, dias):
+        """Avança ou volta a grade semanal."""
+        self.inicio_semana_grade += timedelta(days=dias)
+        self.carregar_grade_semana()
+        self.page.update()
+    
+    def limpar_cache_grade(self):
+        with self.cache_grade_lock:
+            self.cache_grade.clear()
+    
+    def invalidar_cache_grade(self, datas):
+        """Descarta do cache só as semanas das datas alteradas (None = todas)."""
+        if datas is None:
+            self.limpar_cache_grade()
+            return
+        with self.cache_grade_lock:
+            for valor in datas:
+                dia = date.fromisoformat(valor)
+                self.cache_grade.pop(dia - timedelta(days=dia.weekday()), None)
+    
+    def atualizar_barbeiro_atual(self, usuario_ids):
+        """Relê o barbeiro logado quando outro worker avisa que ele mudou."""
+        barbeiro = self.barbeiro_atual
+        if not barbeiro or (usuario_ids is not None and str(barbeiro['id']) not in usuario_ids):
+            return
+        usuario = auth.buscar_usuario(barbeiro['id'])
+        if usuario is None:
+            self.barbeiro_atual = None
+            self.mostrar_tela_login()
+        else:
+            barbeiro.update(usuario)
+    
+    def verificar_sessao_revogada(self, sessao_ids):
+        """Volta ao login se a sessão deste navegador foi encerrada em outro worker.
 
+        Só as páginas cuja sessão está entre `sessao_ids` (None = todas) consultam de novo.
+        """
+        if not self.barbeiro_atual:
+            return
+        token = self.page.client_storage.get(CHAVE_SESSAO)
+        if sessao_ids is not None and auth.id_do_token(token) not in sessao_ids:
+            return
+        if auth.validar_sessao(token) is None:
+            self.barbeiro_atual = None
+            self.mostrar_tela_login()
+    
+    def encerrar_sessao(self, e=None):
+        """Deixa de receber invalidações quando a sessão da página termina."""
+        self.coerencia.remover('agendamentos', self.invalidar_cache_grade)
+        self.coerencia.remover('usuarios', self.atualizar_barbeiro_atual)
+        self.coerencia.remover('sessoes', self.verificar_sessao_revogada)
+    
+    def obter_grade(self, inicio_semana):
+        """Células da semana, do cache se ainda estiverem frescas ou com uma consulta agregada."""
+        with self.cache_grade_lock:
+            em_cache = self.cache_grade.get(inicio_semana)
+        if em_cache and time.monotonic() - em_cache[0] < CACHE_GRADE_SEGUNDOS:
+            return em_cache[1]
+        celulas = db.grade_semana(inicio_semana, HORARIOS_DISPONIVEIS, sessao=self.sessao_db)
+        with self.cache_grade_lock:
+            self.cache_grade[inicio_semana] = (time.monotonic(), celulas)
+        return celulas
+    
+    def pre_carregar_semanas(self, inicio_semana):
+        """Carrega em segundo plano as semanas vizinhas para a troca de semana ser instantânea."""
+        def carregar():
+            for deslocamento in (7, -7):
+                try:
+                    self.obter_grade(inicio_semana + timedelta(days=deslocamento))
+                except db.DatabaseError:
+                    pass
+        threading.Thread(target=carregar, daemon=True).start()
+    
+    def carregar_grade_semana(self):
+        """Monta a grade da semana atual (segunda a sábado x HORARIOS_DISPONIVEIS)."""
+        inicio = self.inicio_semana_grade
+        fim = inicio + timedelta(days=5)
+        self.titulo_semana.value = f"{inicio.strftime('%d/%m')} a {fim.strftime('%d/%m/%Y')}"
+        self.grade_semana.controls.clear()
+        try:
+            celulas = self.obter_grade(inicio)
+        except Exception as erro:
+            self.grade_semana.controls.append(criar_mensagem_erro(f"Erro ao carregar a semana: {str(erro)}"))
+            return
+        
+        largura = 110
+        self.grade_semana.controls.append(ft.Row(
+            [ft.Container(width=60)] + [
+                ft.Container(
+                    content=ft.Text(
+                        f"{DIAS_SEMANA[dia]} {(inicio + timedelta(days=dia)).strftime('%d/%m')}",
+                        weight=ft.FontWeight.BOLD
+                    ),
+                    width=largura
+                )
+                for dia in range(6)
+            ],
+            spacing=2
+        ))
+        for indice, hora in enumerate(HORARIOS_DISPONIVEIS):
+            linha = [ft.Container(content=ft.Text(hora), width=60)]
+            for dia in range(6):
+                celula = celulas.get((dia, indice))
+                status, clientes, ativos = (celula[0], celula[1], celula[2]) if celula else (None, "", 0)
+                aberto = horarios.horario_permitido(inicio + timedelta(days=dia), hora)
+                if ativos:
+                    cor = STATUS_CORES.get(status)
+                else:
+                    cor = None if aberto else ft.colors.GREY_200
+                linha.append(ft.Container(
+                    content=ft.Text(clientes if ativos else "", size=12, no_wrap=True),
+                    tooltip=f"{clientes} ({status})" if ativos else (None if aberto else "Fechado"),
+                    bgcolor=cor,
+                    border=ft.border.all(1, ft.colors.GREY_300),
+                    width=largura,
+                    height=32,
+                    padding=4
+                ))
+            self.grade_semana.controls.append(ft.Row(linha, spacing=2))
+        
+        self.pre_carregar_semanas(inicio)
+    
+    def criar_card_ocupacao(self):
+        """Cria o card do mapa de calor (dia da semana x horário) do histórico."""
+        self.periodo_ocupacao = ft.Dropdown(
+            label="Período",
+            value="90",
+            options=[
+                ft.dropdown.Option("30", "Últimos 30 dias"),
+                ft.dropdown.Option("90", "Últimos 90 dias"),
+                ft.dropdown.Option("365", "Último ano"),
+            ],
+            on_change=lambda _: self.atualizar_mapa_ocupacao(),
+            width=200
+        )
+        self.metrica_ocupacao = ft.Dropdown(
+            label="Métrica",
+            value="ocupacao",
+            options=[
+                ft.dropdown.Option("ocupacao", "Ocupação"),
+                ft.dropdown.Option("taxa_cancelamento", "Cancelamentos"),
+                ft.dropdown.Option("receita", "Receita"),
+            ],
+            on_change=lambda _: self.atualizar_mapa_ocupacao(),
+            width=200
+        )
+        self.mapa_ocupacao = ft.Column(spacing=2)
+        return ft.Card(
+            content=ft.Container(
+                content=ft.Column([
+                    ft.Row([
+                        ft.Text("Ocupação por horário", size=20, weight=ft.FontWeight.BOLD),
+                        self.periodo_ocupacao,
+                        self.metrica_ocupacao
+                    ], spacing=20, wrap=True),
+                    ft.Row([self.mapa_ocupacao], scroll=ft.ScrollMode.AUTO)
+                ]),
+                padding=20
+            )
+        )
+    
+    def atualizar_mapa_ocupacao(self):
+        self.carregar_mapa_ocupacao()
+        self.page.update()
+    
+    def carregar_mapa_ocupacao(self):
+        """Monta o mapa de calor (segunda a sábado x HORARIOS_DISPONIVEIS) do período escolhido."""
+        fim = datetime.now().date()
+        inicio = fim - timedelta(days=int(self.periodo_ocupacao.value) - 1)
+        metrica = self.metrica_ocupacao.value
+        self.mapa_ocupacao.controls.clear()
+        try:
+            mapa = estatisticas.calcular_mapa(inicio, fim)
+        except Exception as erro:
+            self.mapa_ocupacao.controls.append(criar_mensagem_erro(f"Erro ao calcular a ocupação: {str(erro)}"))
+            return
+        
+        valores = mapa[metrica]
+        maximo = float(valores.max()) or 1.0
+        largura = 80
+        if mapa['cancelados_desde'] > inicio:
+            self.mapa_ocupacao.controls.append(ft.Text(
+                f"Cancelamentos contados a partir de {mapa['cancelados_desde'].strftime('%d/%m/%Y')}: "
+                "os mais antigos já foram removidos pela compactação do histórico.",
+                size=12,
+                color=ft.colors.GREY_700
+            ))
+        self.mapa_ocupacao.controls.append(ft.Row(
+            [ft.Container(width=60)] + [
+                ft.Container(content=ft.Text(DIAS_SEMANA[dia], weight=ft.FontWeight.BOLD), width=largura)
+                for dia in range(6)
+            ],
+            spacing=2
+        ))
+        for indice, hora in enumerate(mapa['horarios']):
+            linha = [ft.Container(content=ft.Text(hora), width=60)]
+            for dia in range(6):
+                valor = float(valores[dia, indice])
+                texto = f"R$ {valor:.0f}" if metrica == "receita" else f"{valor:.0%}"
+                linha.append(ft.Container(
+                    content=ft.Text(texto, size=12),
+                    tooltip=(
+                        f"{mapa['ativos'][dia, indice]} atendimento(s), "
+                        f"{mapa['cancelados'][dia, indice]} cancelado(s), "
+                        f"R$ {mapa['receita'][dia, indice]:.2f}"
+                    ),
+                    bgcolor=ft.colors.with_opacity(valor / maximo, ft.colors.BLUE),
+                    border=ft.border.all(1, ft.colors.GREY_300),
+                    width=largura,
+                    height=32,
+                    padding=4
+                ))
+            self.mapa_ocupacao.controls.append(ft.Row(linha, spacing=2))
+    
+    def entrar_lista_espera(self, e):
+        """Inscreve o cliente na lista de espera do dia escolhido, na faixa de horário escolhida."""
+        nome = self.nome_cliente.value
+        telefone = self.telefone_cliente.value
+        servico_id = self.servicos_dropdown.value
+        data = self.dias_disponiveis.value
+        
+        if not nome or len(nome.strip()) < 3:
+            self.mostrar_mensagem("Nome deve ter pelo menos 3 caracteres")
+            return
+        if not telefone or len(''.join(filter(str.isdigit, telefone))) < 10:
+            self.mostrar_mensagem("Digite um telefone válido")
+            return
+        if not servico_id:
+            self.mostrar_mensagem("Selecione um serviço")
+            return
+        if not data:
+            self.mostrar_mensagem("Selecione uma data")
+            return
+        
+        # Um horário escolhido restringe a espera a ele; senão vale a faixa selecionada
+        hora = self.horarios_disponiveis.value
+        if hora:
+            texto, hora_inicio, hora_fim = hora, hora, hora
+        else:
+            texto, hora_inicio, hora_fim = FAIXAS_LISTA_ESPERA[self.faixa_espera.value or "dia"]
+        try:
+            db.entrar_lista_espera(
+                nome.strip(),
+                telefone,
+                int(servico_id),
+                data,
+                hora_inicio,
+                hora_fim,
+                sessao=self.sessao_db
+            )
+            self.mostrar_mensagem(
+                f"Você está na lista de espera de {data} ({texto.lower()}). "
+                "Se uma vaga abrir, o horário será agendado para você.",
+                tipo="sucesso"
+            )
+        except db.DatabaseError as erro:
+            self.mostrar_mensagem(str(erro))
+    
     def atualizar_horarios_disponiveis(self, e):
         """Atualiza os horários disponíveis com base na data selecionada e no horário atual, desabilitando horários já agendados ou passados."""
         data = self.dias_disponiveis.value
         novas_opcoes = []
         agora = datetime.now()
         hoje_str = agora.strftime("%Y-%m-%d")
-        for hora in HORARIOS_DISPONIVEIS:
+        # Uma única consulta para o dia inteiro, em vez de uma por horário
+        ocupados = self.agenda.horarios_ocupados(data, sessao=self.sessao_db) if data else set()
+        for hora in (horarios.horarios_do_dia(data) if data else HORARIOS_DISPONIVEIS):
             ocupado = False
             passado = False
             if data:
@@ -572,7 +1174,7 @@ class BarbeariaApp:
                     if hora_dt <= agora:
                         passado = True
                 # Verifica se já está agendado
-                ocupado = db.verificar_conflito_horario(data, hora)
+                ocupado = hora in ocupados
             # Desabilita se já passou ou está agendado
             novas_opcoes.append(
                 ft.dropdown.Option(
@@ -585,8 +1187,49 @@ class BarbeariaApp:
         self.horarios_disponiveis.value = None
         self.page.update()
 
+# Fila local e coerência de caches compartilhadas pelas sessões do processo
+FILA_LOCAL = None
+COERENCIA = None
+
+def preparar_banco():
+    """Cria as tabelas uma vez ao iniciar o processo (não a cada página aberta).
+
+    Com a fila local e o banco fora do ar, a fila já começa em modo local, para as
+    páginas abertas não esperarem o connect_timeout, e as tabelas são criadas em
+    segundo plano quando o banco voltar.
+    """
+    try:
+        db.criar_tabelas()
+        auth.criar_tabela_usuarios()
+    except db.ConexaoIndisponivel:
+        # Com a fila local, a tela de agendamento abre mesmo com o banco fora do ar
+        if not FILA_LOCAL:
+            raise
+        FILA_LOCAL.fora_do_ar = True
+        threading.Thread(target=preparar_banco_quando_voltar, name="preparar_banco", daemon=True).start()
+
+def preparar_banco_quando_voltar():
+    while True:
+        time.sleep(fila_local.ESPERA_RECONEXAO)
+        try:
+            db.criar_tabelas()
+            auth.criar_tabela_usuarios()
+            return
+        except db.ConexaoIndisponivel:
+            continue
+
 def main(page: ft.Page):
-    app = BarbeariaApp(page)
+    app = BarbeariaApp(page, fila=FILA_LOCAL, coerencia=COERENCIA)
 
 if __name__ == "__main__":
+    FILA_LOCAL = fila_local.iniciar_padrao()
+    preparar_banco()
+    COERENCIA = coerencia.iniciar_padrao()
+    # Logout em um worker tira a sessão do cache de todos
+    COERENCIA.registrar('sessoes', auth.descartar_sessoes_em_cache)
+    historico.iniciar_padrao()
+    lembretes.iniciar_avisos_padrao()
+    # Com vários workers, só um envia lembretes; ele vê os agendamentos dos outros pela coerência
+    lider.iniciar_padrao(lider.TRAVA_LEMBRETES, lambda: lembretes.iniciar_padrao(COERENCIA), "lembretes")
+    api.iniciar_em_segundo_plano()
     ft.app(target=main, view=ft.WEB_BROWSER)
\ No newline at end of file
@@ -27,7 +27,7 @@ class Agendamento:
     
     STATUS_OPCOES = ["Pendente", "Confirmado", "Cancelado"]
     
-    def __init__(self, id, cliente, servico, duracao, data, hora, status="Pendente"):
+    def __init__(self, id, cliente, servico, duracao, data, hora, status="Pendente", serie_id=None):
         self.id = id
         self.cliente = cliente
         self.servico = servico
@@ -35,6 +35,7 @@ class Agendamento:
         self.data = data
         self.hora = hora
         self.status = status if status in self.STATUS_OPCOES else "Pendente"
+        self.serie_id = serie_id
     
     def __str__(self):
         return f"{self.cliente.nome} - {self.servico} - {self.data} {self.hora} [{self.status}]"
\ No newline at end of file
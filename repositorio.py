@@ -0,0 +1,628 @@
+"""Camada de repositório: todo o SQL de agendamentos, serviços e usuários.
+
+Cada comando é preparado no servidor (PREPARE) na primeira vez que roda em uma
+conexão e, dali em diante, executado com EXECUTE, sem novo parse/plan. As funções
+recebem um cursor; abrir conexões, transações e tratar erros fica com o módulo db.
+"""
+from psycopg2.extensions import connection
+from models import Cliente, Agendamento, Servico
+
+
+class ConexaoPreparada(connection):
+    """Conexão do psycopg2 que lembra quais comandos já foram preparados nela."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+
+
+def executar(cursor, nome, comando, parametros=()):
+    """Executa `comando` (com parâmetros $1, $2...) como prepared statement `nome`."""
+    conn = cursor.connection
+    if nome not in conn.preparadas:
+        cursor.execute(f"PREPARE {nome} AS {comando}")
+        conn.preparadas.add(nome)
+    if parametros:
+        marcadores = ", ".join(["%s"] * len(parametros))
+        cursor.execute(f"EXECUTE {nome} ({marcadores})", list(parametros))
+    else:
+        cursor.execute(f"EXECUTE {nome}")
+
+
+# ---------------------------------------------------------------- agendamentos
+
+SELECT_AGENDAMENTOS = """
+    SELECT
+        ag.id,
+        ag.cliente_nome,
+        ag.cliente_telefone,
+        s.nome,
+        s.duracao,
+        ag.data,
+        ag.hora,
+        ag.status,
+        ag.serie_id
+    FROM agendamentos ag
+    JOIN servicos s ON ag.servico_id = s.id
+"""
+
+# Filtros aceitos por listar_agendamentos: nome do filtro -> condição com o marcador do parâmetro.
+# Um novo formato de consulta é só uma nova entrada aqui.
+FILTROS_AGENDAMENTO = {
+    'data': "ag.data = {}",
+    'data_inicio': "ag.data >= {}",
+    'data_fim': "ag.data <= {}",
+    'hora': "ag.hora = {}",
+    'status': "ag.status = {}",
+    'cliente_nome': "ag.cliente_nome LIKE '%' || {} || '%'",
+    'cliente_telefone': "ag.cliente_telefone = {}",
+    'barbeiro_id': "ag.barbeiro_id = {}",
+}
+
+
+def mapear_agendamentos(linhas):
+    """Converte as linhas de SELECT_AGENDAMENTOS em objetos Agendamento."""
+    return [
+        Agendamento(
+            id=ag_id,
+            cliente=Cliente(nome=nome, telefone=telefone),
+            servico=servico,
+            duracao=duracao,
+            data=data,
+            hora=hora,
+            status=status,
+            serie_id=serie_id
+        )
+        for ag_id, nome, telefone, servico, duracao, data, hora, status, serie_id in linhas
+    ]
+
+
+def listar_agendamentos(cursor, **filtros):
+    """Lista agendamentos combinando os filtros de FILTROS_AGENDAMENTO (valores None são ignorados)."""
+    chaves = sorted(chave for chave, valor in filtros.items() if valor is not None)
+    desconhecidos = set(chaves) - FILTROS_AGENDAMENTO.keys()
+    if desconhecidos:
+        raise ValueError(f"Filtros desconhecidos: {', '.join(sorted(desconhecidos))}")
+
+    condicoes = [FILTROS_AGENDAMENTO[chave].format(f"${i}") for i, chave in enumerate(chaves, 1)]
+    comando = SELECT_AGENDAMENTOS
+    if condicoes:
+        comando += " WHERE " + " AND ".join(condicoes)
+    comando += " ORDER BY ag.data, ag.hora"
+
+    # Cada combinação de filtros vira um prepared statement próprio
+    nome = "agendamentos_por_" + "_e_".join(chaves) if chaves else "agendamentos_todos"
+    executar(cursor, nome, comando, [filtros[chave] for chave in chaves])
+    return mapear_agendamentos(cursor.fetchall())
+
+
+def contar_conflitos(cursor, data, hora, ignorar_id=None):
+    """Quantos agendamentos ativos existem no mesmo dia e horário."""
+    if ignorar_id:
+        executar(cursor, "conflitos_exceto_id", """
+            SELECT COUNT(*) FROM agendamentos
+            WHERE data = $1 AND hora = $2 AND id != $3 AND status != 'Cancelado'
+        """, (data, hora, ignorar_id))
+    else:
+        executar(cursor, "conflitos", """
+            SELECT COUNT(*) FROM agendamentos
+            WHERE data = $1 AND hora = $2 AND status != 'Cancelado'
+        """, (data, hora))
+    return cursor.fetchone()[0]
+
+
+def inserir_agendamento(cursor, nome, telefone, servico_id, data, hora, status='Pendente'):
+    """Insere um agendamento e retorna o id gerado."""
+    executar(cursor, "inserir_agendamento", """
+        INSERT INTO agendamentos (cliente_nome, cliente_telefone, servico_id, data, hora, status)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        RETURNING id
+    """, (nome, telefone, servico_id, data, hora, status))
+    return cursor.fetchone()[0]
+
+
+def horarios_ocupados(cursor, data):
+    """Horários com agendamento ativo no dia."""
+    executar(cursor, "horarios_ocupados", """
+        SELECT DISTINCT hora FROM agendamentos
+        WHERE data = $1 AND status != 'Cancelado'
+    """, (data,))
+    return [linha[0] for linha in cursor.fetchall()]
+
+
+def horarios_ocupados_periodo(cursor, data_inicio, data_fim):
+    """(data, hora) com agendamento ativo entre as datas (inclusivas)."""
+    executar(cursor, "horarios_ocupados_periodo", """
+        SELECT DISTINCT data, hora FROM agendamentos
+        WHERE data BETWEEN $1 AND $2 AND status != 'Cancelado'
+    """, (data_inicio, data_fim))
+    return cursor.fetchall()
+
+
+def cancelar_agendamento_cliente(cursor, agendamento_id, telefone):
+    """Cancela o agendamento se o telefone conferir; retorna (data, status anterior) ou None."""
+    executar(cursor, "cancelar_agendamento_cliente", """
+        UPDATE agendamentos ag SET status = 'Cancelado'
+        FROM (
+            SELECT id, data, status FROM agendamentos
+            WHERE id = $1 AND cliente_telefone = $2 AND status != 'Cancelado'
+            FOR UPDATE
+        ) anterior
+        WHERE ag.id = anterior.id AND ag.data = anterior.data
+        RETURNING ag.data, anterior.status
+    """, (agendamento_id, telefone))
+    return cursor.fetchone()
+
+
+def datas_ocupadas(cursor, datas, hora):
+    """Das datas informadas, quais já têm agendamento ativo no horário (uma única consulta)."""
+    executar(cursor, "datas_ocupadas", """
+        SELECT DISTINCT data FROM agendamentos
+        WHERE data = ANY($1::date[]) AND hora = $2 AND status != 'Cancelado'
+    """, (list(datas), hora))
+    return [linha[0] for linha in cursor.fetchall()]
+
+
+def inserir_agendamentos_em_lote(cursor, nome, telefone, servico_id, datas, hora, serie_id=None, status='Pendente'):
+    """Insere um agendamento por data num único INSERT; retorna os ids gerados."""
+    executar(cursor, "inserir_agendamentos_em_lote", """
+        INSERT INTO agendamentos (cliente_nome, cliente_telefone, servico_id, data, hora, status, serie_id)
+        SELECT $1::text, $2::text, $3::integer, d, $5::time, $6::text, $7::integer
+        FROM unnest($4::date[]) AS d
+        RETURNING id
+    """, (nome, telefone, servico_id, list(datas), hora, status, serie_id))
+    return [linha[0] for linha in cursor.fetchall()]
+
+
+def inserir_serie(cursor, nome, telefone, servico_id, frequencia, data_inicio, data_fim, hora):
+    executar(cursor, "inserir_serie", """
+        INSERT INTO series_agendamento
+            (cliente_nome, cliente_telefone, servico_id, frequencia, data_inicio, data_fim, hora)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        RETURNING id
+    """, (nome, telefone, servico_id, frequencia, data_inicio, data_fim, hora))
+    return cursor.fetchone()[0]
+
+
+def cancelar_serie(cursor, serie_id, a_partir_de):
+    """Cancela as ocorrências da série a partir da data; retorna (id, data, status anterior) das canceladas."""
+    executar(cursor, "cancelar_serie", """
+        UPDATE agendamentos ag SET status = 'Cancelado'
+        FROM (
+            SELECT id, data, status FROM agendamentos
+            WHERE serie_id = $1 AND data >= $2 AND status != 'Cancelado'
+            FOR UPDATE
+        ) anterior
+        WHERE ag.id = anterior.id AND ag.data = anterior.data
+        RETURNING ag.id, ag.data, anterior.status
+    """, (serie_id, a_partir_de))
+    return cursor.fetchall()
+
+
+def buscar_serie(cursor, serie_id):
+    """(cliente_telefone, hora) da série ou None."""
+    executar(cursor, "serie_por_id", """
+        SELECT cliente_telefone, hora FROM series_agendamento WHERE id = $1
+    """, (serie_id,))
+    return cursor.fetchone()
+
+
+def datas_da_serie(cursor, serie_id, a_partir_de):
+    """Datas das ocorrências ativas da série a partir da data informada."""
+    executar(cursor, "datas_da_serie", """
+        SELECT DISTINCT data FROM agendamentos
+        WHERE serie_id = $1 AND data >= $2 AND status != 'Cancelado'
+        ORDER BY data
+    """, (serie_id, a_partir_de))
+    return [linha[0] for linha in cursor.fetchall()]
+
+
+def atualizar_hora_serie(cursor, serie_id, hora):
+    executar(cursor, "atualizar_hora_serie", """
+        UPDATE series_agendamento SET hora = $2 WHERE id = $1
+    """, (serie_id, hora))
+
+
+def conflitos_nova_hora_serie(cursor, serie_id, a_partir_de, nova_hora):
+    """Datas da série em que `nova_hora` já está ocupada por outro agendamento."""
+    executar(cursor, "conflitos_nova_hora_serie", """
+        SELECT DISTINCT outro.data
+        FROM agendamentos ag
+        JOIN agendamentos outro
+          ON outro.data = ag.data AND outro.hora = $3 AND outro.status != 'Cancelado'
+         AND outro.serie_id IS DISTINCT FROM ag.serie_id
+        WHERE ag.serie_id = $1 AND ag.data >= $2 AND ag.status != 'Cancelado'
+        ORDER BY outro.data
+    """, (serie_id, a_partir_de, nova_hora))
+    return [linha[0] for linha in cursor.fetchall()]
+
+
+def alterar_hora_serie(cursor, serie_id, a_partir_de, nova_hora, datas_excluidas):
+    """Move as ocorrências da série para `nova_hora`; retorna (id, data) das movidas."""
+    executar(cursor, "alterar_hora_serie", """
+        UPDATE agendamentos SET hora = $3
+        WHERE serie_id = $1 AND data >= $2 AND status != 'Cancelado'
+          AND data != ALL($4::date[])
+        RETURNING id, data
+    """, (serie_id, a_partir_de, nova_hora, list(datas_excluidas)))
+    return cursor.fetchall()
+
+
+def atualizar_status(cursor, agendamento_id, novo_status):
+    """Altera o status de um agendamento; retorna (data, status anterior) ou None se não existir."""
+    executar(cursor, "atualizar_status", """
+        UPDATE agendamentos ag SET status = $1
+        FROM (SELECT id, data, status FROM agendamentos WHERE id = $2 FOR UPDATE) anterior
+        WHERE ag.id = anterior.id AND ag.data = anterior.data
+        RETURNING ag.data, anterior.status
+    """, (novo_status, agendamento_id))
+    return cursor.fetchone()
+
+
+def atualizar_status_por_ids(cursor, ids, novo_status, status_atual=None):
+    """Altera o status de vários agendamentos num único UPDATE.
+
+    Com `status_atual`, só altera os que estão nesse status. Retorna (id, data, status
+    anterior) de cada agendamento alterado.
+    """
+    executar(cursor, "atualizar_status_por_ids", """
+        UPDATE agendamentos ag SET status = $1
+        FROM (
+            SELECT id, data, status FROM agendamentos
+            WHERE id = ANY($2::integer[]) AND status != $1
+              AND ($3::text IS NULL OR status = $3)
+            FOR UPDATE
+        ) anterior
+        WHERE ag.id = anterior.id AND ag.data = anterior.data
+        RETURNING ag.id, ag.data, anterior.status
+    """, (novo_status, list(ids), status_atual))
+    return cursor.fetchall()
+
+
+def atualizar_status_do_dia(cursor, data, status_atual, novo_status):
+    """Passa todos os agendamentos do dia em `status_atual` para `novo_status` num único UPDATE."""
+    executar(cursor, "atualizar_status_do_dia", """
+        UPDATE agendamentos ag SET status = $3
+        FROM (
+            SELECT id, data, status FROM agendamentos
+            WHERE data = $1 AND status = $2
+            FOR UPDATE
+        ) anterior
+        WHERE ag.id = anterior.id AND ag.data = anterior.data
+        RETURNING ag.id, ag.data, anterior.status
+    """, (data, status_atual, novo_status))
+    return cursor.fetchall()
+
+
+def inserir_historico_status(cursor, eventos):
+    """Grava um lote de eventos (agendamento_id, data, anterior, novo, usuario_id, registrado_em)."""
+    colunas = [list(coluna) for coluna in zip(*eventos)]
+    # usuario_id chega como text[]: uma lista só de None viraria ARRAY[NULL] (text[]) no EXECUTE
+    executar(cursor, "inserir_historico_status", """
+        INSERT INTO agendamentos_status_historico
+            (agendamento_id, data_agendamento, status_anterior, status_novo, usuario_id, registrado_em)
+        SELECT * FROM unnest(
+            $1::integer[], $2::date[], $3::text[], $4::text[], $5::text[]::integer[], $6::timestamptz[]
+        )
+    """, colunas)
+
+
+def grade_semana(cursor, data_inicio, data_fim, horarios):
+    """Uma linha por célula (dia, horário) ocupada no período, já agregada no banco.
+
+    Retorna (deslocamento do dia, posição do horário em `horarios`, status da célula,
+    clientes ativos, quantidade de ativos, quantidade de cancelados).
+    """
+    # Os horários ("HH:MM") chegam como text[]: o EXECUTE não converte text[] em time[] sozinho
+    executar(cursor, "grade_semana", """
+        SELECT
+            ag.data - $1::date,
+            array_position($3::text[]::time[], ag.hora) - 1,
+            CASE
+                WHEN bool_or(ag.status = 'Pendente') THEN 'Pendente'
+                WHEN bool_or(ag.status = 'Confirmado') THEN 'Confirmado'
+                ELSE 'Cancelado'
+            END,
+            COALESCE(string_agg(ag.cliente_nome, ', ') FILTER (WHERE ag.status != 'Cancelado'), ''),
+            COUNT(*) FILTER (WHERE ag.status != 'Cancelado'),
+            COUNT(*) FILTER (WHERE ag.status = 'Cancelado')
+        FROM agendamentos ag
+        WHERE ag.data BETWEEN $1 AND $2 AND ag.hora = ANY($3::text[]::time[])
+        GROUP BY ag.data, ag.hora
+    """, (data_inicio, data_fim, list(horarios)))
+    return cursor.fetchall()
+
+
+def versao_agendamentos(cursor):
+    """(versao, alterado_em, alterações ainda não compactadas) do contador de agendamentos.
+
+    A versão é a base de agendamentos_versao mais as linhas que o trigger insere em
+    agendamentos_alteracoes; dentro de uma mesma fotografia do banco ela só cresce,
+    mesmo com transações confirmando fora de ordem.
+    """
+    executar(cursor, "versao_agendamentos", """
+        SELECT v.versao + count(a.*), GREATEST(v.alterado_em, max(a.alterado_em)), count(a.*)
+        FROM agendamentos_versao v
+        LEFT JOIN agendamentos_alteracoes a ON TRUE
+        GROUP BY v.versao, v.alterado_em
+    """)
+    return cursor.fetchone()
+
+
+def compactar_versao_agendamentos(cursor):
+    """Move as alterações registradas para a base de agendamentos_versao num só comando."""
+    executar(cursor, "compactar_versao_agendamentos", """
+        WITH removidas AS (
+            DELETE FROM agendamentos_alteracoes RETURNING alterado_em
+        )
+        UPDATE agendamentos_versao
+        SET versao = versao + (SELECT count(*) FROM removidas),
+            alterado_em = GREATEST(alterado_em, (SELECT max(alterado_em) FROM removidas))
+    """)
+
+
+def cursor_exportacao(conn, data_inicio, barbeiro_id=None, tamanho_lote=500):
+    """Cursor do lado do servidor com os agendamentos a exportar, lido aos poucos.
+
+    Linhas: id, cliente_nome, cliente_telefone, serviço, duração, data, hora, status.
+    Com `barbeiro_id`, traz os agendamentos do barbeiro e os sem barbeiro definido.
+    """
+    cursor = conn.cursor(name="exportacao_agendamentos")
+    cursor.itersize = tamanho_lote
+    cursor.execute("""
+        SELECT ag.id, ag.cliente_nome, ag.cliente_telefone, s.nome, s.duracao, ag.data, ag.hora, ag.status
+        FROM agendamentos ag
+        JOIN servicos s ON ag.servico_id = s.id
+        WHERE ag.data >= %(inicio)s
+          AND (%(barbeiro)s::integer IS NULL OR ag.barbeiro_id = %(barbeiro)s OR ag.barbeiro_id IS NULL)
+        ORDER BY ag.data, ag.hora
+    """, {'inicio': data_inicio, 'barbeiro': barbeiro_id})
+    return cursor
+
+
+def cursor_ocupacao(conn, data_inicio, data_fim, horarios, codigos_status,
+                    cancelados_desde, tamanho_lote=5000):
+    """Cursor do lado do servidor com os agendamentos do período em forma compacta.
+
+    Linhas: dia da semana (0 = segunda), posição do horário em `horarios`, código do
+    status (de `codigos_status`), preço do serviço e 1 se a data é igual ou posterior a
+    `cancelados_desde` (0 se não). Horários fora de `horarios` ficam de fora.
+    """
+    cursor = conn.cursor(name="ocupacao_agendamentos")
+    cursor.itersize = tamanho_lote
+    cursor.execute("""
+        SELECT
+            (EXTRACT(ISODOW FROM ag.data)::smallint - 1),
+            (array_position(%(horarios)s::time[], ag.hora) - 1)::smallint,
+            CASE ag.status
+                WHEN 'Cancelado' THEN %(cancelado)s
+                WHEN 'Confirmado' THEN %(confirmado)s
+                ELSE %(pendente)s
+            END::smallint,
+            COALESCE(s.preco, 0),
+            (ag.data >= %(cancelados_desde)s)::int::smallint
+        FROM agendamentos ag
+        LEFT JOIN servicos s ON ag.servico_id = s.id
+        WHERE ag.data BETWEEN %(inicio)s AND %(fim)s
+          AND ag.hora = ANY(%(horarios)s::time[])
+    """, {
+        'inicio': data_inicio,
+        'cancelados_desde': cancelados_desde,
+        'fim': data_fim,
+        'horarios': list(horarios),
+        'cancelado': codigos_status["Cancelado"],
+        'confirmado': codigos_status["Confirmado"],
+        'pendente': codigos_status["Pendente"],
+    })
+    return cursor
+
+
+# ------------------------------------------------------------------- lembretes
+
+SELECT_LEMBRETES = """
+    SELECT
+        ag.id,
+        ag.cliente_nome,
+        ag.cliente_telefone,
+        ag.data,
+        ag.hora,
+        COALESCE(array_agg(le.tipo) FILTER (WHERE le.tipo IS NOT NULL), '{}')
+    FROM agendamentos ag
+    LEFT JOIN lembretes_enviados le ON le.agendamento_id = ag.id
+"""
+
+
+def agendamentos_para_lembrete(cursor, data_inicio, data_fim):
+    """Agendamentos ativos no intervalo de datas, com os tipos de lembrete já enviados."""
+    executar(cursor, "lembretes_por_periodo", SELECT_LEMBRETES + """
+        WHERE ag.data BETWEEN $1 AND $2 AND ag.status IN ('Pendente', 'Confirmado')
+        GROUP BY ag.id, ag.cliente_nome, ag.cliente_telefone, ag.data, ag.hora
+    """, (data_inicio, data_fim))
+    return cursor.fetchall()
+
+
+def agendamentos_para_lembrete_por_ids(cursor, ids, datas):
+    """Como agendamentos_para_lembrete, mas só para os ids (e datas, para podar partições) dados."""
+    executar(cursor, "lembretes_por_ids", SELECT_LEMBRETES + """
+        WHERE ag.id = ANY($1::integer[]) AND ag.data = ANY($2::date[])
+          AND ag.status IN ('Pendente', 'Confirmado')
+        GROUP BY ag.id, ag.cliente_nome, ag.cliente_telefone, ag.data, ag.hora
+    """, (list(ids), list(datas)))
+    return cursor.fetchall()
+
+
+def registrar_lembretes_enviados(cursor, ids, tipos):
+    """Marca os lembretes (agendamento, tipo) como entregues, num único INSERT."""
+    executar(cursor, "registrar_lembretes_enviados", """
+        INSERT INTO lembretes_enviados (agendamento_id, tipo)
+        SELECT * FROM unnest($1::integer[], $2::text[])
+        ON CONFLICT DO NOTHING
+    """, (list(ids), list(tipos)))
+
+
+# ------------------------------------------------------------- lista de espera
+
+def inserir_lista_espera(cursor, nome, telefone, servico_id, data, hora_inicio, hora_fim):
+    """Inscreve o cliente na lista de espera do dia/faixa de horário; retorna (id, criado_em)."""
+    executar(cursor, "inserir_lista_espera", """
+        INSERT INTO lista_espera (cliente_nome, cliente_telefone, servico_id, data, hora_inicio, hora_fim)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        RETURNING id, criado_em
+    """, (nome, telefone, servico_id, data, hora_inicio, hora_fim))
+    return cursor.fetchone()
+
+
+def inserir_horarios_lista_espera(cursor, espera_id, data, criado_em, horas):
+    """Um registro em lista_espera_horarios por horário ("HH:MM") coberto pela inscrição."""
+    executar(cursor, "inserir_horarios_lista_espera", """
+        INSERT INTO lista_espera_horarios (data, hora, criado_em, espera_id)
+        SELECT $2, hora, $3, $1 FROM unnest($4::text[]::time[]) AS hora
+    """, (espera_id, data, criado_em, list(horas)))
+
+
+def vagas_liberadas(cursor, agendamento_ids, datas):
+    """(data, hora) dos agendamentos informados, para oferecer as vagas à lista de espera."""
+    executar(cursor, "vagas_liberadas", """
+        SELECT DISTINCT data, hora FROM agendamentos
+        WHERE id = ANY($1::integer[]) AND data = ANY($2::date[])
+        ORDER BY data, hora
+    """, (list(agendamento_ids), list(datas)))
+    return cursor.fetchall()
+
+
+def reservar_da_lista_espera(cursor, data, hora):
+    """Trava e retorna o primeiro inscrito aguardando cuja faixa cobre o horário, ou None.
+
+    Desce a chave primária (data, hora, criado_em, espera_id) de lista_espera_horarios:
+    o primeiro registro do horário já é o inscrito mais antigo, por maior que seja a lista
+    do dia. Inscrições já travadas por outra transação são puladas (SKIP LOCKED) em vez
+    de esperar por elas. Retorna (id, cliente_nome, cliente_telefone, servico_id).
+    """
+    executar(cursor, "reservar_da_lista_espera", """
+        SELECT le.id, le.cliente_nome, le.cliente_telefone, le.servico_id
+        FROM lista_espera_horarios h
+        JOIN lista_espera le ON le.id = h.espera_id
+        WHERE h.data = $1 AND h.hora = $2 AND le.status = 'Aguardando'
+        ORDER BY h.criado_em, h.espera_id
+        LIMIT 1
+        FOR UPDATE OF le SKIP LOCKED
+    """, (data, hora))
+    return cursor.fetchone()
+
+
+def marcar_lista_espera_atendida(cursor, espera_id, agendamento_id):
+    executar(cursor, "marcar_lista_espera_atendida", """
+        UPDATE lista_espera SET status = 'Atendido', agendamento_id = $2
+        WHERE id = $1
+    """, (espera_id, agendamento_id))
+    executar(cursor, "remover_horarios_lista_espera", """
+        DELETE FROM lista_espera_horarios WHERE espera_id = $1
+    """, (espera_id,))
+
+
+# ------------------------------------------------------------------- coerência
+
+def publicar_invalidacao(cursor, topico, chaves):
+    """NOTIFY de invalidação fora dos triggers; só é entregue com o commit da transação."""
+    executar(cursor, "publicar_invalidacao", """
+        SELECT publicar_coerencia($1::text, $2::text[])
+    """, (topico, chaves))
+
+
+# -------------------------------------------------------------------- serviços
+
+def listar_servicos(cursor):
+    executar(cursor, "listar_servicos", "SELECT id, nome, preco, duracao, descricao FROM servicos")
+    return [Servico(*linha) for linha in cursor.fetchall()]
+
+
+def servico_existe(cursor, servico_id):
+    executar(cursor, "servico_por_id", "SELECT id FROM servicos WHERE id = $1", (servico_id,))
+    return cursor.fetchone() is not None
+
+
+def servico_existe_por_nome(cursor, nome):
+    executar(cursor, "servico_por_nome", "SELECT id FROM servicos WHERE nome = $1", (nome,))
+    return cursor.fetchone() is not None
+
+
+def inserir_servico(cursor, nome, preco, duracao, descricao):
+    executar(cursor, "inserir_servico", """
+        INSERT INTO servicos (nome, preco, duracao, descricao)
+        VALUES ($1, $2, $3, $4)
+    """, (nome, preco, duracao, descricao))
+
+
+# -------------------------------------------------------------------- usuários
+
+def buscar_usuario_por_email(cursor, email):
+    """Retorna (id, nome, hash da senha) do usuário ou None."""
+    executar(cursor, "usuario_por_email", "SELECT id, nome, senha FROM usuarios WHERE email = $1", (email,))
+    return cursor.fetchone()
+
+
+def buscar_usuario_por_id(cursor, usuario_id):
+    """Retorna (id, nome) do usuário ou None."""
+    executar(cursor, "usuario_por_id", "SELECT id, nome FROM usuarios WHERE id = $1", (usuario_id,))
+    return cursor.fetchone()
+
+
+def inserir_usuario(cursor, email, senha_hash, nome):
+    """Insere o usuário e retorna o id gerado."""
+    executar(cursor, "inserir_usuario", """
+        INSERT INTO usuarios (email, senha, nome) VALUES ($1, $2, $3)
+        RETURNING id
+    """, (email, senha_hash, nome))
+    return cursor.fetchone()[0]
+
+
+def buscar_token_feed(cursor, usuario_id):
+    executar(cursor, "token_feed_por_usuario", "SELECT token FROM tokens_feed WHERE usuario_id = $1", (usuario_id,))
+    linha = cursor.fetchone()
+    return linha[0] if linha else None
+
+
+def criar_token_feed(cursor, usuario_id, token):
+    """Grava o token se o usuário ainda não tiver um; retorna o token em vigor."""
+    executar(cursor, "criar_token_feed", """
+        INSERT INTO tokens_feed (usuario_id, token) VALUES ($1, $2)
+        ON CONFLICT (usuario_id) DO NOTHING
+    """, (usuario_id, token))
+    return buscar_token_feed(cursor, usuario_id)
+
+
+def trocar_token_feed(cursor, usuario_id, token):
+    executar(cursor, "trocar_token_feed", """
+        INSERT INTO tokens_feed (usuario_id, token) VALUES ($1, $2)
+        ON CONFLICT (usuario_id) DO UPDATE SET token = EXCLUDED.token, criado_em = now()
+    """, (usuario_id, token))
+
+
+def usuario_por_token_feed(cursor, token):
+    """id do usuário dono do token ou None."""
+    executar(cursor, "usuario_por_token_feed", "SELECT usuario_id FROM tokens_feed WHERE token = $1", (token,))
+    linha = cursor.fetchone()
+    return linha[0] if linha else None
+
+
+def inserir_sessao(cursor, sessao_id, usuario_id, expira_em):
+    executar(cursor, "inserir_sessao", """
+        INSERT INTO sessoes (id, usuario_id, expira_em) VALUES ($1, $2, $3)
+    """, (sessao_id, usuario_id, expira_em))
+
+
+def buscar_sessao_valida(cursor, sessao_id):
+    """(usuario_id, nome, expira_em) da sessão não revogada e não expirada, ou None."""
+    executar(cursor, "sessao_valida", """
+        SELECT u.id, u.nome, s.expira_em
+        FROM sessoes s
+        JOIN usuarios u ON u.id = s.usuario_id
+        WHERE s.id = $1 AND s.revogada_em IS NULL AND s.expira_em > now()
+    """, (sessao_id,))
+    return cursor.fetchone()
+
+
+def revogar_sessao(cursor, sessao_id):
+    executar(cursor, "revogar_sessao", """
+        UPDATE sessoes SET revogada_em = now() WHERE id = $1 AND revogada_em IS NULL
+    """, (sessao_id,))
@@ -0,0 +1,142 @@
+"""Testes da API HTTP/JSON sem banco: as funções de db/auth/exportacao são substituídas."""
+import asyncio
+import json
+from datetime import date, timedelta
+
+import pytest
+
+import api
+import db
+
+
+def requisitar(metodo, caminho, corpo=None):
+    """Sobe a API numa porta livre, faz uma requisição e retorna (status, corpo)."""
+    async def executar():
+        servidor = await asyncio.start_server(api._tratar_conexao, "127.0.0.1", 0)
+        porta = servidor.sockets[0].getsockname()[1]
+        async with servidor:
+            leitor, escritor = await asyncio.open_connection("127.0.0.1", porta)
+            dados = json.dumps(corpo).encode() if corpo is not None else b""
+            escritor.write(
+                f"{metodo} {caminho} HTTP/1.1\r\nHost: teste\r\nConnection: close\r\n"
+                f"Content-Length: {len(dados)}\r\n\r\n".encode() + dados
+            )
+            await escritor.drain()
+            resposta = await leitor.read()
+            escritor.close()
+        cabecalho, _, conteudo = resposta.partition(b"\r\n\r\n")
+        return int(cabecalho.split()[1]), conteudo
+    return asyncio.run(executar())
+
+
+def proximo_dia_aberto():
+    dia = date.today() + timedelta(days=1)
+    while not api.horarios.dia_aberto(dia):
+        dia += timedelta(days=1)
+    return dia
+
+
+def test_agendamento_sem_hora_responde_400(monkeypatch):
+    monkeypatch.setattr(db, "adicionar_agendamento", lambda *args, **kwargs: pytest.fail("não deveria gravar"))
+    status, corpo = requisitar("POST", "/api/agendamentos", {
+        "nome": "Cliente Teste", "telefone": "11999998888", "servico_id": 1,
+        "data": proximo_dia_aberto().isoformat(),
+    })
+    assert status == 400
+    assert "hora" in json.loads(corpo)["erro"]
+
+
+def test_data_que_nao_e_texto_responde_400(monkeypatch):
+    monkeypatch.setattr(db, "adicionar_agendamento", lambda *args, **kwargs: pytest.fail("não deveria gravar"))
+    status, corpo = requisitar("POST", "/api/agendamentos", {
+        "nome": "Cliente Teste", "telefone": "11999998888", "servico_id": 1, "data": 20990101, "hora": "10:00",
+    })
+    assert status == 400
+    assert "Data inválida" in json.loads(corpo)["erro"]
+
+
+def test_agendamento_inexistente_responde_404(monkeypatch):
+    def cancelar(*args, **kwargs):
+        raise db.NaoEncontrado("Agendamento não encontrado")
+    monkeypatch.setattr(db, "cancelar_agendamento", cancelar)
+    status, _ = requisitar("POST", "/api/agendamentos/999/cancelar", {"telefone": "11999998888"})
+    assert status == 404
+
+
+def test_pool_esgotado_responde_503(monkeypatch):
+    def sem_conexao_livre(*args, **kwargs):
+        raise db.PoolEsgotado("sem conexão livre")
+    monkeypatch.setattr(db, "listar_servicos", sem_conexao_livre)
+    status, _ = requisitar("GET", "/api/servicos")
+    assert status == 503
+def test_disponibilidade_marca_horarios_ocupados(monkeypatch):
+    dia = proximo_dia_aberto()
+    grade = api.horarios.horarios_do_dia(dia)
+    monkeypatch.setattr(db, "horarios_ocupados", lambda data, **kwargs: {grade[0]})
+    status, corpo = requisitar("GET", f"/api/disponibilidade?data={dia.isoformat()}")
+    assert status == 200
+    resposta = json.loads(corpo)
+    assert resposta["data"] == dia.isoformat()
+    assert [item["hora"] for item in resposta["horarios"]] == list(grade)
+    assert resposta["horarios"][0]["disponivel"] is False
+    assert all(item["disponivel"] for item in resposta["horarios"][1:])
+
+
+def test_banco_fora_do_ar_responde_503(monkeypatch):
+    def fora_do_ar(*args, **kwargs):
+        raise db.ConexaoIndisponivel("sem conexão")
+    monkeypatch.setattr(db, "listar_servicos", fora_do_ar)
+    status, _ = requisitar("GET", "/api/servicos")
+    assert status == 503
+
+
+@pytest.fixture
+def feeds(monkeypatch):
+    """Barbeiros 1 e 2 com tokens; o feed em si é um texto fixo."""
+    tokens = {"token-1": 1, "token-2": 2}
+    monkeypatch.setattr(api.auth, "usuario_do_token_feed", tokens.get)
+
+    def gerar():
+        yield "id,cliente\r\n"
+
+    monkeypatch.setattr(
+        api.exportacao, "abrir_feed",
+        lambda formato, barbeiro_id, *args: (200, {'Content-Type': "text/csv"}, gerar())
+    )
+
+
+@pytest.mark.parametrize("caminho", [
+    "/feeds/barbearia.ics",
+    "/feeds/barbearia.ics?token=errado",
+    "/feeds/barbeiro/1.csv",
+    "/feeds/barbeiro/1.csv?token=token-2",
+])
+def test_feed_sem_token_valido_responde_403(feeds, caminho):
+    status, _ = requisitar("GET", caminho)
+    assert status == 403
+
+
+@pytest.mark.parametrize("caminho", [
+    "/feeds/barbearia.ics?token=token-2",
+    "/feeds/barbeiro/1.csv?token=token-1",
+])
+def test_feed_com_token_do_barbeiro(feeds, caminho):
+    status, corpo = requisitar("GET", caminho)
+    assert status == 200
+    assert b"id,cliente" in corpo
+
+
+def test_feed_que_falha_no_meio_so_fecha_a_conexao(feeds, monkeypatch):
+    def gerar():
+        yield "id,cliente\r\n"
+        raise db.DatabaseError("conexão perdida no meio do feed")
+
+    monkeypatch.setattr(
+        api.exportacao, "abrir_feed",
+        lambda formato, barbeiro_id, *args: (200, {'Content-Type': "text/csv"}, gerar())
+    )
+    status, corpo = requisitar("GET", "/feeds/barbearia.csv?token=token-1")
+    assert status == 200
+    assert b"id,cliente" in corpo
+    # Nem o pedaço final nem uma segunda resposta HTTP no meio do corpo
+    assert not corpo.endswith(b"0\r\n\r\n") and b"HTTP/1.1" not in corpo
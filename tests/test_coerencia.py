@@ -0,0 +1,150 @@
+"""Vários workers simulados num só processo: BarramentoMemoria no lugar do LISTEN/NOTIFY,
+TravasMemoria no lugar do pg_advisory_lock e um banco falso para os lembretes."""
+import json
+import queue
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import coerencia
+import db
+import fila_local
+import lembretes
+import lider
+import repositorio
+
+
+@pytest.fixture
+def banco(monkeypatch):
+    """Lista de linhas (id, nome, telefone, data, hora, tipos enviados) no lugar de agendamentos."""
+    linhas = []
+
+    @contextmanager
+    def conexao_falsa(leitura=False, sessao=None):
+        yield SimpleNamespace(cursor=lambda: None)
+
+    def por_periodo(cursor, inicio, fim):
+        return [linha for linha in list(linhas) if inicio <= linha[3] <= fim]
+
+    monkeypatch.setattr(db, "criar_tabelas", lambda: None)
+    monkeypatch.setattr(db, "conexao", conexao_falsa)
+    monkeypatch.setattr(repositorio, "agendamentos_para_lembrete", por_periodo)
+    monkeypatch.setattr(repositorio, "registrar_lembretes_enviados", lambda cursor, ids, tipos: None)
+    return linhas
+
+
+def test_lider_unico_e_substituido_quando_sai():
+    travas = lider.TravasMemoria()
+    iniciados = []
+
+    def servico(indice):
+        def iniciar():
+            iniciados.append(indice)
+            return SimpleNamespace(parar=lambda: iniciados.remove(indice))
+        return iniciar
+
+    workers = [
+        lider.Lideranca(travas.trava(lider.TRAVA_LEMBRETES), servico(indice), "lembretes")
+        for indice in range(3)
+    ]
+    for worker in workers:
+        worker.verificar()
+    assert len(iniciados) == 1
+    primeiro = iniciados[0]
+
+    # O líder sai (ou perde a conexão): outro assume na rodada seguinte
+    workers[primeiro].servico.parar()
+    workers[primeiro].servico = None
+    workers[primeiro].trava.soltar()
+    for indice, worker in enumerate(workers):
+        if indice != primeiro:
+            worker.verificar()
+    assert len(iniciados) == 1 and iniciados[0] != primeiro
+
+
+def test_lembrete_de_agendamento_em_outro_worker_sai_uma_vez(banco):
+    barramento = coerencia.BarramentoMemoria()
+    travas = lider.TravasMemoria()
+    destino = lembretes.DestinoFila()
+    antecedencias = {'teste': timedelta(hours=1)}
+
+    workers = []
+    for _ in range(3):
+        instancia = coerencia.Coerencia(barramento)
+        instancia.iniciar()
+        lideranca = lider.Lideranca(
+            travas.trava(lider.TRAVA_LEMBRETES),
+            lambda instancia=instancia: _iniciar_agendador(destino, antecedencias, instancia),
+            "lembretes"
+        )
+        lideranca.verificar()
+        workers.append((instancia, lideranca))
+    try:
+        lideres = [lideranca for _, lideranca in workers if lideranca.servico is not None]
+        assert len(lideres) == 1
+
+        # Agendamento gravado por um worker que não é o líder
+        outro = next(instancia for instancia, lideranca in workers if lideranca.servico is None)
+        momento = datetime.now() + timedelta(hours=1, seconds=1)
+        banco.append((1, "Cliente Outro Worker", "11999998888", momento.date(), momento.time(), []))
+        outro.publicar('agendamentos', [momento.date()])
+
+        lembrete = destino.fila.get(timeout=5)
+        assert lembrete['agendamento_id'] == 1 and lembrete['tipo'] == 'teste'
+        with pytest.raises(queue.Empty):
+            destino.fila.get(timeout=0.5)
+    finally:
+        for instancia, lideranca in workers:
+            if lideranca.servico is not None:
+                lideranca.servico.parar()
+            instancia.parar()
+
+
+def test_releitura_logo_apos_invalidacao_vai_ao_primario(monkeypatch):
+    leituras = []
+    cache = coerencia.CacheInvalidavel(lambda chave, primario: leituras.append(primario) or chave)
+    cache.obter("2099-01-01")
+    cache.invalidar(["2099-01-01"])
+    cache.obter("2099-01-01")
+    cache.obter("2099-01-02")
+    assert leituras == [False, True, False]
+
+    # Passada a janela, a réplica volta a servir
+    monkeypatch.setattr(coerencia, "JANELA_PRIMARIO", 0)
+    cache.invalidar(["2099-01-01"])
+    cache.obter("2099-01-01")
+    assert leituras[-1] is False
+
+
+def _iniciar_agendador(destino, antecedencias, instancia):
+    agendador = lembretes.AgendadorLembretes(destino, antecedencias, coerencia=instancia)
+    agendador.iniciar()
+    return agendador
+
+
+def test_cada_worker_tem_seu_diario(tmp_path, monkeypatch):
+    monkeypatch.setattr(fila_local, "_travas_diario", [])
+    caminho = str(tmp_path / "fila.jsonl")
+    primeiro = fila_local.reservar_diario(caminho)
+    segundo = fila_local.reservar_diario(caminho)
+    assert primeiro != segundo
+
+    registro = {
+        'tipo': 'agendamento', 'id': fila_local.PREFIXO_ID_LOCAL + "1", 'nome': "Cliente Fila",
+        'telefone': "11999998888", 'servico_id': 1, 'data': "2099-01-01", 'hora': "10:00",
+    }
+    with open(primeiro, "w", encoding="utf-8") as arquivo:
+        arquivo.write(json.dumps(registro) + "\n")
+
+    # O segundo worker esvazia o próprio diário sem tocar no do primeiro
+    monkeypatch.setattr(db, "criar_tabelas", lambda: None)
+    fila_local.FilaLocal(segundo)._reaplicar()
+    assert len(fila_local.FilaLocal(primeiro)._pendentes) == 1
+
+    # O primeiro worker morre: quem sobe depois assume o diário e os pendentes dele
+    fila_local._travas_diario.pop(0).close()
+    assert fila_local.reservar_diario(caminho) == primeiro
+    for trava in fila_local._travas_diario:
+        trava.close()
@@ -0,0 +1,18 @@
+"""Vagas do mapa de ocupação, sem banco: só a grade de horarios.py."""
+from datetime import date
+
+import estatisticas
+import horarios
+
+
+def test_vagas_seguem_expediente_e_feriados(monkeypatch):
+    # Segunda com expediente só de manhã; a segunda 2099-01-12 é feriado
+    grade = horarios.GradeHorarios(
+        expediente={0: [("09:00", "10:00")], 1: [("09:00", "11:00")]},
+        feriados=[date(2099, 1, 12)],
+    )
+    monkeypatch.setattr(horarios, "horarios_do_dia", grade.horarios_do_dia)
+    vagas = estatisticas._vagas(date(2099, 1, 5), date(2099, 1, 18), ("09:00", "09:30", "10:00", "10:30"))
+    assert vagas[0].tolist() == [1, 1, 0, 0]
+    assert vagas[1].tolist() == [2, 2, 2, 2]
+    assert vagas[2:].sum() == 0
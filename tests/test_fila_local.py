@@ -0,0 +1,35 @@
+"""Fila local com o banco fora do ar (ou só ocupado), sem banco: db é substituído."""
+import pytest
+
+import db
+import fila_local
+
+
+@pytest.fixture
+def fila(tmp_path, monkeypatch):
+    def fora_do_ar(*args, **kwargs):
+        raise db.ConexaoIndisponivel("sem conexão")
+    monkeypatch.setattr(db, "adicionar_agendamento", fora_do_ar)
+    monkeypatch.setattr(db, "horarios_ocupados", fora_do_ar)
+    return fila_local.FilaLocal(str(tmp_path / "fila.jsonl"))
+
+
+def test_fora_do_ar_so_agenda_datas_com_retrato(fila):
+    with pytest.raises(db.ConexaoIndisponivel):
+        fila.adicionar_agendamento("Cliente Fila", "11999998888", 1, "2099-01-05", "10:00")
+    assert fila.fora_do_ar and not fila._pendentes
+
+    fila._ocupados["2099-01-06"] = {"09:00"}
+    with pytest.raises(db.ConflitoHorario):
+        fila.adicionar_agendamento("Cliente Fila", "11999998888", 1, "2099-01-06", "09:00")
+    agendamento_id = fila.adicionar_agendamento("Cliente Fila", "11999998888", 1, "2099-01-06", "10:00")
+    assert fila_local.eh_local(agendamento_id)
+
+
+def test_pool_esgotado_nao_e_queda(fila, monkeypatch):
+    def esgotado(*args, **kwargs):
+        raise db.PoolEsgotado("Nenhuma conexão livre com o banco de dados no momento")
+    monkeypatch.setattr(db, "adicionar_agendamento", esgotado)
+    with pytest.raises(db.PoolEsgotado):
+        fila.adicionar_agendamento("Cliente Fila", "11999998888", 1, "2099-01-06", "10:00")
+    assert not fila.fora_do_ar and not fila._pendentes
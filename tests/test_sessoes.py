@@ -0,0 +1,43 @@
+"""Revogação de sessões vinda de outro worker, sem banco: auth.validar_sessao é substituída."""
+from types import SimpleNamespace
+
+import pytest
+
+import auth
+import main
+
+
+@pytest.fixture
+def pagina(monkeypatch):
+    """Página de um barbeiro logado com a sessão "sessao-1"; conta as idas ao banco."""
+    monkeypatch.setattr(auth, "_segredo", b"segredo-de-teste")
+    token = "sessao-1." + auth._assinar("sessao-1")
+    consultas = []
+
+    def validar_sessao(token_validado):
+        consultas.append(token_validado)
+        return None
+
+    monkeypatch.setattr(auth, "validar_sessao", validar_sessao)
+    app = SimpleNamespace(
+        barbeiro_atual={'id': 1, 'nome': "Barbeiro"},
+        page=SimpleNamespace(client_storage={main.CHAVE_SESSAO: token}),
+        telas_de_login=[],
+    )
+    app.mostrar_tela_login = lambda: app.telas_de_login.append(True)
+    return app, token, consultas
+
+
+def test_sessao_de_outra_pagina_nao_consulta_o_banco(pagina):
+    app, _, consultas = pagina
+    main.BarbeariaApp.verificar_sessao_revogada(app, ["sessao-2"])
+    assert consultas == []
+    assert app.barbeiro_atual is not None
+
+
+@pytest.mark.parametrize("sessao_ids", [["sessao-1"], None])
+def test_sessao_revogada_volta_ao_login(pagina, sessao_ids):
+    app, token, consultas = pagina
+    main.BarbeariaApp.verificar_sessao_revogada(app, sessao_ids)
+    assert consultas == [token]
+    assert app.barbeiro_atual is None and app.telas_de_login == [True]
@@ -1,5 +1,6 @@
 import flet as ft
-from datetime import datetime, time
+from datetime import datetime
+import horarios
 
 STATUS_CORES = {
     "Pendente": ft.colors.ORANGE_100,
@@ -7,11 +8,8 @@ STATUS_CORES = {
     "Cancelado": ft.colors.RED_100,
 }
 
-# Horários disponíveis para agendamento (de 30 em 30 minutos)
-HORARIOS_DISPONIVEIS = [
-    "09:00", "09:30", "10:00", "10:30", "11:00", "11:30",
-    "14:00", "14:30", "15:00", "15:30", "16:00", "16:30", "17:00", "17:30"
-]
+# Horários da grade de atendimento (configurados em horarios.EXPEDIENTE)
+HORARIOS_DISPONIVEIS = list(horarios.PADRAO.horarios)
 
 def validar_data(data_str):
     """Valida se a string está no formato de data YYYY-MM-DD e é uma data futura."""
@@ -25,13 +23,9 @@ def validar_data(data_str):
 
 def validar_hora(hora_str):
     """Valida se a string está no formato de hora HH:MM e está dentro dos horários disponíveis."""
-    try:
-        if not hora_str or len(hora_str) != 5:
-            return False
-        hora = datetime.strptime(hora_str, "%H:%M").time()
-        return hora_str in HORARIOS_DISPONIVEIS
-    except ValueError:
+    if not hora_str or len(hora_str) != 5:
         return False
+    return horarios.horario_valido(hora_str)
 
 def criar_mensagem_erro(mensagem):
     """Cria um componente de mensagem de erro."""
@@ -61,12 +55,8 @@ def formatar_telefone(telefone):
         return f"({numeros[:2]}) {numeros[2:7]}-{numeros[7:]}"
     return telefone
 
-def verificar_horario_comercial(hora_str):
-    """Verifica se o horário está dentro do horário comercial (9h às 18h)."""
-    try:
-        hora = datetime.strptime(hora_str, "%H:%M").time()
-        hora_inicio = time(9, 0)
-        hora_fim = time(18, 0)
-        return hora_inicio <= hora <= hora_fim
-    except ValueError:
-        return False
\ No newline at end of file
+def verificar_horario_comercial(hora_str, data=None):
+    """Verifica se o horário é de atendimento (na data informada ou em algum dia da semana)."""
+    if data is None:
+        return horarios.horario_valido(hora_str)
+    return horarios.horario_permitido(data, hora_str)
\ No newline at end of file